@@ -1,5 +1,8 @@
 from fastapi import FastAPI
+from fastapi.responses import Response
 from action_zone.action_http import logger
+from action_zone.action_http.metrics import record_latency
+from action_zone.utils.metrics import REGISTRY, CONTENT_TYPE
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from action_zone.action_http.routers.prompt_router import prompt_router
@@ -39,7 +42,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# REQUEST LATENCY PER ROUTE
+app.middleware("http")(record_latency)
+
 # INCLUDE ROUTER
 app.include_router(switch_routers)
 app.include_router(configs_routers)
-app.include_router(prompt_router)
\ No newline at end of file
+app.include_router(prompt_router)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
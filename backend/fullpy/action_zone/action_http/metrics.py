@@ -0,0 +1,23 @@
+"""Metrics of the HTTP API, scraped from GET /metrics"""
+import time
+from fastapi import Request
+from action_zone.utils.metrics import Histogram
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency by route template",
+    ["route", "method", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0)
+)
+
+
+async def record_latency(request: Request, call_next):
+    """HTTP middleware: one observation per request, labeled by the matched route (not the raw URL)"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_SECONDS.labels(getattr(route, "path", "unmatched"), request.method, status).observe(time.perf_counter() - start)
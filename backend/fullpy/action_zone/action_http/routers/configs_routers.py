@@ -1,6 +1,15 @@
 from action_zone.action_http import logger
 from fastapi import APIRouter, HTTPException
 from action_zone.action_sqlite.control_config import ControlConfig
+from services import request_websocket_model
+
+# SECONDS TO WAIT FOR THE INFERENCE SERVER TO PICK UP A CONFIG CHANGE
+CONFIG_PUSH_TIMEOUT = 5
+
+async def push_config(id_model: str):
+    """Tells the inference server to replace its sampling snapshot"""
+    if not await request_websocket_model("reload_config", id_model, CONFIG_PUSH_TIMEOUT):
+        logger.warning(f"Config for {id_model} saved but not pushed to the WebSocket server")
 
 configs_routers = APIRouter(prefix="/configs")
 
@@ -17,6 +26,7 @@ async def setConfigs(body:dict ) -> dict:
     control = ControlConfig(body) 
     if not control.add():
         raise HTTPException(status_code=400, detail="Config not found")
+    await push_config(body["id_model"])
     return {"status": "OK"}
 
 @configs_routers.patch("/")
@@ -25,6 +35,7 @@ async def updateConfigs(body:dict) -> dict:
     control = ControlConfig(body) 
     if not control.update():
         raise HTTPException(status_code=400, detail="Config not found")
+    await push_config(body["id_model"])
     return {"status": "OK"}
 
 @configs_routers.delete("/{id_model}")
@@ -32,4 +43,5 @@ async def deleteConfigs(id_model:str) -> dict:
     control = ControlConfig({"id_model":id_model})
     if not control.delete():
         raise HTTPException(status_code=400, detail="Config not found")
+    await push_config(id_model)
     return {"status": "OK"}
@@ -2,7 +2,8 @@ from action_zone.action_http import logger
 from fastapi import APIRouter, HTTPException
 from config import ModelSwitchResponse, ModelSwitchRequest  
 from action_zone.config.paths import CONFIG_FILE, READONLY_MODELS_DIR 
-from services import get_current_model, model_exists, save_current_model_config, wait_for_websocket_confirmation  
+from action_zone.action_ws import MODEL_SWITCH_TIMEOUT
+from services import get_current_model, model_exists, save_current_model_config, request_websocket_model  
 
 # switchRouters
 switch_routers = APIRouter()
@@ -33,8 +34,8 @@ async def switch_model(request: ModelSwitchRequest):
         logger.error(f"Error saving configuration for: {request.model_name}")
         raise HTTPException(status_code=500, detail="Error saving configuration")
 
-    # WAITS FOR CONFIRMATION
-    websocket_ok = await wait_for_websocket_confirmation(request.model_name, 60)
+    # ASKS THE WEBSOCKET SERVER TO LOAD AND ACTIVATE THE MODEL, RETURNS WHEN READY
+    websocket_ok = await request_websocket_model("switch_model", request.model_name, MODEL_SWITCH_TIMEOUT)
 
     if websocket_ok:
         return ModelSwitchResponse(
@@ -51,6 +52,16 @@ async def switch_model(request: ModelSwitchRequest):
             needs_restart=True
         )
 
+@switch_routers.post("/preload-model")
+async def preload_model(request: ModelSwitchRequest):
+    """Loads a model into the WebSocket server's pool without activating it"""
+    if not await model_exists(request.model_name):
+        raise HTTPException(status_code=404, detail="Model not found in models directory")
+
+    if not await request_websocket_model("preload_model", request.model_name, MODEL_SWITCH_TIMEOUT):
+        raise HTTPException(status_code=503, detail="WebSocket server could not preload the model")
+    return {"status": "loaded", "model": request.model_name}
+
 @switch_routers.get("/models/available")
 async def list_available_models():
     """Lists available models (READ ONLY)"""
@@ -5,6 +5,8 @@ import json
 from itertools import chain
 from datetime import datetime
 import asyncio
+import websockets
+from action_zone.action_ws import FALLBACK_PORTS_WEBSOCKET
 # MAIN FUNCTIONS
 async def get_current_model() -> str:
     """Reads the current model from the configuration file"""
@@ -102,13 +104,41 @@ async def model_exists(model_name: str) -> bool:
         logger.error(f"Error verifying model: {e}")
         return False
 
-async def wait_for_websocket_confirmation(model_name: str, timeout: int = 60) -> bool:
-    """Waits for WebSocket confirmation"""
-    try:
-        logger.info(f"Waiting for WebSocket confirmation: {model_name}")
-        await asyncio.sleep(2)
-        logger.info("WebSocket confirmation received")
-        return True
-    except Exception as e:
-        logger.error(f"WebSocket error: {e}")
-        return False
\ No newline at end of file
+async def request_websocket_model(action: str, model_name: str, timeout: int = 120) -> bool:
+    """
+    RPC to the WebSocket server: `switch_model`, `preload_model` or `reload_config`.
+    Returns only when the server confirms the action (or on failure).
+    """
+    expected = {
+        "switch_model": "model_switched",
+        "preload_model": "model_preloaded",
+        "reload_config": "config_reloaded",
+    }[action]
+
+    for port in FALLBACK_PORTS_WEBSOCKET:
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{port}", open_timeout=3, close_timeout=3) as ws:
+                logger.info(f"Requesting {action} for {model_name} on port {port}")
+                await ws.send(json.dumps({"action": action, "model": model_name}))
+
+                deadline = asyncio.get_running_loop().time() + timeout
+                while True:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    data = json.loads(await asyncio.wait_for(ws.recv(), max(remaining, 0)))
+                    if data.get("type") == expected:
+                        logger.info(f"WebSocket confirmation received: {data}")
+                        return True
+                    if data.get("type") == "error":
+                        logger.error(f"WebSocket refused {action}: {data.get('error')}")
+                        return False
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake) as e:
+            if isinstance(e, asyncio.TimeoutError):
+                logger.error(f"WebSocket {action} timed out after {timeout}s")
+                return False
+            continue
+        except Exception as e:
+            logger.error(f"WebSocket error: {e}")
+            return False
+
+    logger.error("WebSocket server not reachable")
+    return False
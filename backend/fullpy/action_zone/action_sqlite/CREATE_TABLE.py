@@ -1,3 +1,4 @@
 from action_zone.action_sqlite.control_config import ControlConfig
 control = ControlConfig()
-control.create()
\ No newline at end of file
+control.create()
+control.migrate()
\ No newline at end of file
@@ -13,13 +13,21 @@ class ControlConfig:
         frequency_penalty REAL DEFAULT 0.0,
         presence_penalty REAL DEFAULT 0.0,
         min_p REAL DEFAULT 0.05, tfs_z REAL DEFAULT 1.0,
-        mirostat_tau REAL DEFAULT 5.0, seed INTEGER, stop TEXT)"""
+        mirostat_tau REAL DEFAULT 5.0, seed INTEGER, stop TEXT,
+        speculative_mode TEXT, draft_tokens INTEGER DEFAULT 10)"""
+
+    # COLUMNS ADDED AFTER THE FIRST SCHEMA: name -> definition (APPLIED BY CREATE_TABLE.py, NEVER ON IMPORT)
+    MIGRATIONS = {
+        'speculative_mode': 'TEXT',
+        'draft_tokens': 'INTEGER DEFAULT 10',
+    }
     
     # SAFE DEFAULTS: Balanced for 1B-7B+ models
     SAFE_DEFAULTS = {
         'temperature': 0.7, 'top_p': 0.9, 'top_k': 40, 'tokens': 512,
         'repeat_penalty': 1.1, 'frequency_penalty': 0.0, 'presence_penalty': 0.0,
-        'min_p': 0.05, 'tfs_z': 1.0, 'mirostat_tau': 5.0, 'seed': None, 'stop': None
+        'min_p': 0.05, 'tfs_z': 1.0, 'mirostat_tau': 5.0, 'seed': None, 'stop': None,
+        'speculative_mode': None, 'draft_tokens': 10
     }
     
     # VALIDATION: Safety ranges for all parameters
@@ -37,18 +45,21 @@ class ControlConfig:
         'mirostat_tau': lambda v: isinstance(v, (int, float)) and 0 <= v <= 10,
         'seed': lambda v: v is None or (isinstance(v, int) and 0 <= v <= 2**32-1),
         'stop': lambda v: v is None or (isinstance(v, list) and all(isinstance(s, str) for s in v)),
+        'speculative_mode': lambda v: v in (None, 'prompt_lookup', 'draft_model'),
+        'draft_tokens': lambda v: isinstance(v, int) and 1 <= v <= 32,
     }
     
     # FIELD ORDER: Matches database column order (excluding id_model)
     FIELDS = ['temperature', 'top_p', 'top_k', 'tokens', 'repeat_penalty',
               'frequency_penalty', 'presence_penalty', 'min_p', 'tfs_z',
-              'mirostat_tau', 'seed', 'stop']
-    
+              'mirostat_tau', 'seed', 'stop', 'speculative_mode', 'draft_tokens']
+
+    # DATABASE FILE (TOOLS SUCH AS THE BENCHMARK POINT IT AT A COPY)
+    DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config_model.sqlite")
+
     def __init__(self, configs=None):
         self.configs = configs or {}
-        
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.__DB_FILE = os.path.join(current_dir, "config_model.sqlite")
+        self.__DB_FILE = self.DB_FILE
     
     def _valid(self, key, value):
         return key in self.VALID and self.VALID[key](value)
@@ -63,6 +74,20 @@ class ControlConfig:
             logger.error(f"DB: {e}")
             return None
     
+    def migrate(self):
+        # Add columns missing from databases created with an older SCHEMA
+        cur = self._db("PRAGMA table_info(configModel)")
+        if not cur:
+            return False
+        existing = {row[1] for row in cur.fetchall()}
+        if not existing:
+            return False
+        for column, definition in self.MIGRATIONS.items():
+            if column not in existing:
+                self._db(f"ALTER TABLE configModel ADD COLUMN {column} {definition}")
+                logger.info(f"DB: column {column} added")
+        return True
+
     def create(self):
         return bool(self._db(self.SCHEMA))
     
@@ -90,8 +115,10 @@ class ControlConfig:
             else:
                 values.append(self.SAFE_DEFAULTS[field] if field != 'stop' else None)
         
+        columns = ','.join(['id_model'] + self.FIELDS)
+        placeholders = ','.join('?' * len(values))
         return bool(self._db(
-            "INSERT INTO configModel VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            f"INSERT INTO configModel ({columns}) VALUES ({placeholders})",
             values
         ))
     
@@ -2,4 +2,45 @@ from action_zone.utils import setup_logging
 # LOGGING CONFIGURATION
 logger = setup_logging('SSE_Server')
 
-FALLBACK_PORTS_SSE = [ 8080, 8081, 8082, 8083, 8084, 8085, 8086, 8087, 8088, 8089, 8090]
\ No newline at end of file
+FALLBACK_PORTS_SSE = [ 8080, 8081, 8082, 8083, 8084, 8085, 8086, 8087, 8088, 8089, 8090]
+
+# SEGMENTED DOWNLOADS ("download_connections" IN models.json OVERRIDES THE CONNECTION COUNT)
+# A SEGMENT LASTS ABOUT DOWNLOAD_SEGMENT_SECONDS AT ITS CONNECTION'S SPEED, WITHIN THE MIN / MAX BYTES
+DOWNLOAD_CONNECTIONS = 8
+DOWNLOAD_MIN_SEGMENT_BYTES = 4 * 1024**2
+DOWNLOAD_MAX_SEGMENT_BYTES = 64 * 1024**2
+DOWNLOAD_SEGMENT_SECONDS = 4
+DOWNLOAD_SEGMENT_RETRIES = 5
+DOWNLOAD_READ_TIMEOUT = 30
+# SHA-256 ("sha256" OF A MODEL IN models.json, OPTIONAL) IS COMPUTED WHILE DOWNLOADING; ON A MISMATCH
+# THE FILE IS FETCHED AGAIN PIECE BY PIECE AND ONLY WHAT CHANGED IS HASHED AGAIN
+DOWNLOAD_PIECE_BYTES = 32 * 1024**2
+# PROGRESS EVENTS PER SECOND AT MOST, AND THE HALF-LIFE (SECONDS) OF THE SPEED THEY REPORT
+DOWNLOAD_EVENT_HZ = 4
+DOWNLOAD_SPEED_HALF_LIFE = 3.0
+
+# MIRRORS: EVERY URL OF A MODEL IS PROBED WITH A SMALL RANGE REQUEST AND THE FASTEST STARTS; A MIRROR WHOSE
+# THROUGHPUT EWMA FALLS UNDER MIRROR_DEGRADED_RATIO OF ANOTHER ONE'S HANDS ITS SEGMENTS OVER.
+# SPEEDS ARE KEPT IN MIRROR_STATS_FILE, NEXT TO THE TEMP FILES
+MIRROR_PROBE_BYTES = 256 * 1024
+MIRROR_PROBE_TIMEOUT = 10
+MIRROR_EWMA_ALPHA = 0.3
+MIRROR_DEGRADED_RATIO = 0.5
+MIRROR_MAX_FAILURES = 3
+MIRROR_STATS_FILE = "mirrors.json"
+
+# WRITE-BEHIND BUFFERS ("download_ram_max_mb" IN models.json OVERRIDES THE CAP)
+# A DOWNLOAD STAGES CHUNKS IN RAM FREE BEYOND ram_download_threshold_gb, NEVER MORE THAN THE CAP;
+# WITH LESS THAN DOWNLOAD_MIN_BUFFER_BYTES PER BUFFER LEFT IT WRITES STRAIGHT TO DISK
+DOWNLOAD_RAM_MAX_BYTES = 512 * 1024**2
+DOWNLOAD_BUFFER_BYTES = 8 * 1024**2
+DOWNLOAD_MIN_BUFFER_BYTES = 1024**2
+DOWNLOAD_FLUSH_TASKS = 2
+
+# DOWNLOAD QUEUE ("max_concurrent_downloads" AND "bandwidth_limit_mbps" IN models.json OVERRIDE THESE)
+# MODELS BEYOND THE SLOTS WAIT THEIR TURN, HIGHEST PRIORITY FIRST: TWO DOWNLOADS SPLITTING ONE LINE BOTH FINISH LATE.
+# THE BANDWIDTH CAP (MB/S, 0 FOR NONE) IS SHARED BY ALL DOWNLOADS AND CAN BE CHANGED AT RUNTIME
+DOWNLOAD_MAX_CONCURRENT = 1
+DOWNLOAD_BANDWIDTH_LIMIT_MBPS = 0
+# SECONDS cancel() WAITS FOR A DOWNLOAD TO CLOSE ITS FILE; PAST THAT THE CANCEL FAILS AND THE FILES STAY
+DOWNLOAD_CANCEL_TIMEOUT = 5
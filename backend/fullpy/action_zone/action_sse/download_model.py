@@ -8,11 +8,26 @@ from pathlib import Path
 from urllib.parse import urlparse
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
-from typing import AsyncGenerator, Optional
-from fastapi.responses import StreamingResponse
+from typing import AsyncGenerator, Dict, Optional
+from fastapi.responses import Response, StreamingResponse
 from action_zone.config.paths import possible_paths
 from fastapi.middleware.cors import CORSMiddleware
 from action_zone.action_sse import logger, FALLBACK_PORTS_SSE
+from action_zone.action_sse import DOWNLOAD_CONNECTIONS, DOWNLOAD_MIN_SEGMENT_BYTES, DOWNLOAD_MAX_SEGMENT_BYTES
+from action_zone.action_sse import DOWNLOAD_SEGMENT_SECONDS, DOWNLOAD_SEGMENT_RETRIES, DOWNLOAD_READ_TIMEOUT
+from action_zone.action_sse import DOWNLOAD_RAM_MAX_BYTES, DOWNLOAD_BUFFER_BYTES, DOWNLOAD_MIN_BUFFER_BYTES, DOWNLOAD_FLUSH_TASKS
+from action_zone.action_sse import DOWNLOAD_PIECE_BYTES, DOWNLOAD_EVENT_HZ, DOWNLOAD_SPEED_HALF_LIFE
+from action_zone.action_sse import MIRROR_PROBE_BYTES, MIRROR_PROBE_TIMEOUT, MIRROR_EWMA_ALPHA, MIRROR_DEGRADED_RATIO
+from action_zone.action_sse import MIRROR_MAX_FAILURES, MIRROR_STATS_FILE
+from action_zone.action_sse import DOWNLOAD_MAX_CONCURRENT, DOWNLOAD_BANDWIDTH_LIMIT_MBPS, DOWNLOAD_CANCEL_TIMEOUT
+from action_zone.action_sse import metrics
+from action_zone.action_sse.events import TERMINAL, EventBus, ProgressTracker
+from action_zone.action_sse.integrity import IntegrityError, check_gguf_header
+from action_zone.action_sse.mirrors import MirrorSet, MirrorStats
+from action_zone.action_sse.scheduler import QUEUED, DOWNLOADING, PAUSED, DONE, DownloadJob, DownloadQueue, TokenBucket
+from action_zone.action_sse.segmented import SegmentedDownloader
+from action_zone.action_sse.writers import FileWriter, WriteBehindWriter
+from action_zone.utils.metrics import REGISTRY, CONTENT_TYPE
 
 def which_os(posix, windows):
     """
@@ -37,48 +52,69 @@ class SecurityValidator:
         except:
             return False
 
+class DownloadStalled(Exception):
+    """No byte downloaded, hashed or fetched again within stall_timeout"""
+
 class ProgressMonitor:
-    __slots__ = ('last_progress', 'last_update', 'stall_timeout', 'cancel_event')
+    __slots__ = ('last_progress', 'last_bytes', 'last_update', 'stall_timeout', 'cancel_event', 'pause_event')
 
     def __init__(self, stall_timeout: int = 120):
         self.last_progress = 0
+        self.last_bytes = 0
         self.last_update = time.time()
         self.stall_timeout = stall_timeout
         self.cancel_event = asyncio.Event()
+        self.pause_event = asyncio.Event()
 
-    def update(self, progress: int):
-        if progress != self.last_progress:
+    def update(self, progress: int, downloaded: int = 0):
+        # Any new byte counts as progress: 1% of a large model can take longer than stall_timeout
+        if progress != self.last_progress or downloaded != self.last_bytes:
             self.last_progress = progress
+            self.last_bytes = downloaded
             self.last_update = time.time()
 
     def is_stalled(self) -> bool:
         return (time.time() - self.last_update) > self.stall_timeout
 
 class RAMDownloader:
+    """Picks how much of a download is staged in memory on its way to disk"""
+
     @staticmethod
     def get_available_ram_gb() -> float:
         return psutil.virtual_memory().available / (1024**3)
 
     @staticmethod
-    def can_use_ram(size_gb: float, threshold_gb: float) -> bool:
-        return RAMDownloader.get_available_ram_gb() >= ((size_gb * 2) + threshold_gb)
-
-    @staticmethod
-    async def download_to_ram(url: str) -> Optional[bytes]:
-        try:
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=3600)) as response:
-                    return await response.read() if response.status == 200 else None
-        except Exception as e:
-            logger.error(f"RAM download error: {e}")
-            return None
+    def make_writer(path: Path, size: Optional[int], connections: int, reserve_gb: float, max_bytes: int) -> FileWriter:
+        """
+        RAM-rich: a pool as large as the file, the network never waits for the disk.
+        RAM-tight: a pool of whatever is free beyond the reserve, up to max_bytes.
+        Small RAM: smaller buffers, or straight to disk.
+        """
+        budget = min(max_bytes, psutil.virtual_memory().available - int(reserve_gb * 1024**3))
+        # One buffer filling per connection, plus the ones being flushed
+        minimum = connections + DOWNLOAD_FLUSH_TASKS
+        buffer_bytes = min(DOWNLOAD_BUFFER_BYTES, max(budget, 0) // minimum)
+        if buffer_bytes < DOWNLOAD_MIN_BUFFER_BYTES:
+            logger.info(f"[DOWNLOAD] {path.name}: {max(budget, 0) // 1024**2} MB of RAM to spare, writing straight to disk")
+            return FileWriter(path, size)
+
+        count = -(-size // buffer_bytes) if size and size <= budget else budget // buffer_bytes
+        writer = WriteBehindWriter(path, size, count, buffer_bytes, DOWNLOAD_FLUSH_TASKS)
+        logger.info(f"[DOWNLOAD] {path.name}: {writer.tier} tier, {count} x {buffer_bytes // 1024**2} MB write-behind buffers")
+        return writer
 
 class DownloadManager:
     def __init__(self):
         self.config = {}
         self.models = {}
         self.active_downloads = {}
+        # SET BY _run() ONCE ITS MONITOR EXISTS: WHAT cancel() WAITS ON FOR A TASK THAT HAS NOT STARTED YET
+        self._started: Dict[str, asyncio.Event] = {}
+        # ONE EVENT BUS PER DOWNLOAD QUEUED, PAUSED OR IN PROGRESS; ONE BANDWIDTH BUDGET FOR ALL OF THEM
+        self.events = {}
+        self.queue = DownloadQueue(self._run, DOWNLOAD_MAX_CONCURRENT, self._publish_positions)
+        self.limiter = TokenBucket(DOWNLOAD_BANDWIDTH_LIMIT_MBPS * 1024**2)
+        self.mirror_stats = MirrorStats()
 
     def load_config(self):
         config_path = next((p for p in possible_paths if os.path.exists(p)), None)
@@ -91,6 +127,9 @@ class DownloadManager:
 
         for key in ['download_path', 'temp_path', 'log_path']:
             which_os(Path(self.config[key]), Path(self.config[f'win_{key}'])).mkdir(parents=True, exist_ok=True)
+        self.mirror_stats = MirrorStats(which_os(Path(self.config['temp_path']), Path(self.config['win_temp_path'])) / MIRROR_STATS_FILE)
+        self.set_limits(self.config.get('max_concurrent_downloads', DOWNLOAD_MAX_CONCURRENT),
+                        self.config.get('bandwidth_limit_mbps', DOWNLOAD_BANDWIDTH_LIMIT_MBPS))
 
         logger.info(f"Models loaded: {len(self.models)}")
 
@@ -104,9 +143,15 @@ class DownloadManager:
             "size_gb": m['size_gb'],
             "is_downloaded": (download_path / m['filename']).exists(),
             "is_downloading": mid in self.active_downloads,
+            **self._queue_state(mid),
             "file_path": str(download_path / m['filename']) if (download_path / m['filename']).exists() else None
         } for mid, m in self.models.items()]
 
+    def _queue_state(self, model_id: str) -> dict:
+        job = self.queue.get(model_id)
+        return {"state": job.state if job else None, "queue_position": self.queue.position(model_id),
+                "priority": job.priority if job else None}
+
     def get_model_status(self, model_id: str) -> dict:
         if model_id not in self.models:
             raise ValueError(f"Model not found: {model_id}")
@@ -122,10 +167,31 @@ class DownloadManager:
             "is_downloaded": fp.exists(),
             "is_downloading": model_id in self.active_downloads,
             "progress": self.active_downloads[model_id].last_progress if model_id in self.active_downloads else 0,
+            **self._queue_state(model_id),
+            "subscribers": self.events[model_id].subscribers if model_id in self.events else 0,
             "file_path": str(fp) if fp.exists() else None
         }
 
-    async def download(self, model_id: str) -> AsyncGenerator[dict, None]:
+    def get_queue(self) -> dict:
+        jobs = sorted(self.queue.jobs.values(), key=lambda j: (j.state != DOWNLOADING, -j.priority, j.seq))
+        return {
+            "max_concurrent": self.queue.max_active,
+            "bandwidth_limit_mbps": round(self.limiter.rate / 1024**2, 2),
+            "downloads": [{"id": j.model_id, "state": j.state, "priority": j.priority,
+                           "queue_position": self.queue.position(j.model_id)} for j in jobs]
+        }
+
+    def set_limits(self, max_concurrent: Optional[int] = None, bandwidth_limit_mbps: Optional[float] = None):
+        """Both apply at once: a lower cap slows running downloads, more slots start queued ones"""
+        if bandwidth_limit_mbps is not None:
+            self.limiter.set_rate(bandwidth_limit_mbps * 1024**2)
+        if max_concurrent is not None:
+            self.queue.set_max_active(max_concurrent)
+        logger.info(f"[QUEUE] {self.queue.max_active} concurrent downloads, bandwidth limit "
+                    f"{f'{self.limiter.rate / 1024**2:.1f} MB/s' if self.limiter.rate else 'none'}")
+
+    async def download(self, model_id: str, priority: Optional[int] = None) -> AsyncGenerator[dict, None]:
+        """Events of a model's download: joins the one queued or in progress, or queues it"""
         if not SecurityValidator.validate_model_id(model_id):
             yield {"type": "error", "message": "Invalid ID"}
             return
@@ -134,148 +200,268 @@ class DownloadManager:
             yield {"type": "error", "message": "Model not found"}
             return
 
-        if model_id in self.active_downloads:
-            yield {"type": "error", "message": "Download in progress"}
+        bus = self.events.get(model_id)
+        if bus is None:
+            final_file = which_os(Path(self.config['download_path']), Path(self.config['win_download_path'])) / self.models[model_id]['filename']
+            if final_file.exists():
+                yield {"type": "completed", "progress": 100, "message": "Already downloaded"}
+                return
+            bus = self.start(model_id, priority or 0)
+        elif priority is not None:
+            self.queue.set_priority(model_id, priority)
+
+        async for event in bus.subscribe():
+            yield event
+
+    def start(self, model_id: str, priority: int = 0) -> EventBus:
+        """
+        Queues the download; it runs in a task of its own once a slot is
+        free. SSE clients come and go without touching it, only pause() and
+        cancel() stop it.
+        """
+        bus = EventBus()
+        self.events[model_id] = bus
+        self.queue.submit(model_id, priority)
+        return bus
+
+    def _publish_positions(self):
+        # A position moves whenever a job ahead starts, pauses or changes priority
+        for position, job in enumerate(self.queue.waiting(), 1):
+            bus = self.events.get(job.model_id)
+            state = bus.snapshot.get("state", {}) if bus else {}
+            if bus and (state.get("type") != QUEUED or state.get("position") != position):
+                bus.publish({"type": QUEUED, "model_id": job.model_id,
+                             "model_name": self.models[job.model_id]['name'], "position": position})
+
+    async def _run(self, job: DownloadJob):
+        model_id = job.model_id
+        bus = self.events[model_id]
+        started = self._started.setdefault(model_id, asyncio.Event())
+        if job.state == PAUSED:
+            # Paused before its task got to run
+            self._started.pop(model_id, None)
+            started.set()
+            bus.publish({"type": PAUSED})
             return
 
+        self.active_downloads[model_id] = ProgressMonitor(self.config.get('stall_timeout', 120))
+        started.set()
+        ended = False
+        try:
+            async for event in self._download(model_id):
+                bus.publish(event)
+                ended = event.get("type") in TERMINAL
+        except Exception as e:
+            logger.error(f"Download of {model_id} crashed: {type(e).__name__}: {e}")
+            bus.publish({"type": "error", "message": "Download failed"})
+            ended = True
+        finally:
+            self._started.pop(model_id, None)
+            # A paused download keeps its bus: its clients stay until it resumes and ends
+            if ended or job.state == DOWNLOADING:
+                job.state = DONE
+                bus.close()
+                self.events.pop(model_id, None)
+
+    def pause(self, model_id: str) -> bool:
+        """Stops a download and gives its slot to the next one; the .parts checkpoint stays for resume()"""
+        previous = self.queue.pause(model_id)
+        if previous == DOWNLOADING and model_id in self.active_downloads:
+            self.active_downloads[model_id].pause_event.set()
+        elif previous == QUEUED:
+            self.events[model_id].publish({"type": PAUSED})
+        return previous is not None
+
+    def resume(self, model_id: str) -> bool:
+        return self.queue.resume(model_id)
+
+    async def shutdown(self):
+        # Paused, not cancelled: the checkpoints stay and the downloads resume when asked for again
+        tasks = [job.task for job in self.queue.jobs.values() if job.task]
+        for model_id in list(self.queue.jobs):
+            self.pause(model_id)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _download(self, model_id: str) -> AsyncGenerator[dict, None]:
         model = self.models[model_id]
         download_path = which_os(Path(self.config['download_path']), Path(self.config['win_download_path']))
         temp_path = which_os(Path(self.config['temp_path']), Path(self.config['win_temp_path']))
         final_file = download_path / model['filename']
-
-        if final_file.exists():
-            yield {"type": "completed", "progress": 100, "message": "Already downloaded"}
-            return
-
-        monitor = ProgressMonitor(self.config.get('stall_timeout', 120))
-        self.active_downloads[model_id] = monitor
+        monitor = self.active_downloads[model_id]
 
         try:
             yield {"type": "started", "model_id": model_id, "model_name": model['name']}
 
-            if RAMDownloader.can_use_ram(model['size_gb'], self.config.get('ram_download_threshold_gb', 2.5)):
-                yield {"type": "info", "message": "RAM download"}
-
-                for url in model['urls']:
-                    if not SecurityValidator.validate_url(url, self.config['allowed_domains']):
-                        continue
-
-                    data = await RAMDownloader.download_to_ram(url)
-                    if data:
-                        temp_file = temp_path / f"{model['filename']}.tmp"
-                        temp_file.write_bytes(data)
-                        temp_file.replace(final_file)
-                        yield {"type": "completed", "progress": 100}
-                        return
-
-            yield {"type": "info", "message": "Traditional download"}
-
-            wget_cmd = ["wget", "-4", "-c", "--progress=dot:mega", "--timeout=30", "--tries=3", "--read-timeout=60"]
-            curl_cmd = ["curl", "-4", "-L", "-C", "-", "--connect-timeout", "30", "--max-time", "7200", "--speed-time", "60", "--speed-limit", "1024", "--retry", "3"]
-
-            for url in model['urls']:
-                if not SecurityValidator.validate_url(url, self.config['allowed_domains']):
-                    continue
-
-                temp_file = temp_path / f"{model['filename']}.tmp"
-
-                for method_name, base_cmd in [("wget", wget_cmd), ("curl", curl_cmd)]:
-                    cmd = base_cmd + (["-O", str(temp_file), url] if method_name == "wget" else ["-o", str(temp_file), url])
-
-                    try:
-                        async for event in self._execute_download(method_name, cmd, model['size_gb'], monitor):
-                            yield event
-                            if event.get("type") == "completed":
-                                temp_file.replace(final_file)
-                                return
-                    except Exception as e:
-                        logger.warning(f"{method_name} failed: {e}")
-                        temp_file.unlink(missing_ok=True)
-                        yield {"type": "warning", "message": f"{method_name} failed"}
-
-            yield {"type": "error", "message": "All methods failed"}
+            yield {"type": "info", "message": "Segmented download"}
+            temp_file = temp_path / f"{model['filename']}.tmp"
+            connections = self.config.get('download_connections', DOWNLOAD_CONNECTIONS)
+            ram_max = self.config.get('download_ram_max_mb', DOWNLOAD_RAM_MAX_BYTES // 1024**2) * 1024**2
+            reserve_gb = self.config.get('ram_download_threshold_gb', 2.5)
+
+            def make_writer(path: Path, size: Optional[int]) -> FileWriter:
+                return RAMDownloader.make_writer(path, size, connections, reserve_gb, ram_max)
+
+            urls = [url for url in model['urls'] if SecurityValidator.validate_url(url, self.config['allowed_domains'])]
+            mirrors = MirrorSet(urls, self.mirror_stats, MIRROR_PROBE_BYTES, MIRROR_PROBE_TIMEOUT,
+                                MIRROR_EWMA_ALPHA, MIRROR_DEGRADED_RATIO, MIRROR_MAX_FAILURES)
+            downloader = SegmentedDownloader(
+                mirrors, temp_file, connections,
+                DOWNLOAD_MIN_SEGMENT_BYTES, DOWNLOAD_MAX_SEGMENT_BYTES, DOWNLOAD_SEGMENT_SECONDS,
+                DOWNLOAD_SEGMENT_RETRIES, DOWNLOAD_READ_TIMEOUT, make_writer,
+                model.get('sha256'), DOWNLOAD_PIECE_BYTES, self.limiter
+            )
+            failure = "All mirrors failed"
+            try:
+                if urls:
+                    async for event in self._execute_download(downloader, monitor):
+                        if event.get("type") == "progress":
+                            metrics.DOWNLOAD_SPEED.labels(model_id).set(event["speed_mbps"] * 1024**2)
+                        if event.get("type") == "completed":
+                            # A file llama.cpp cannot load is never renamed into place
+                            if final_file.suffix.lower() == ".gguf":
+                                try:
+                                    check_gguf_header(temp_file)
+                                except IntegrityError:
+                                    metrics.INTEGRITY_FAILURES.labels("gguf").inc()
+                                    raise
+                            temp_file.replace(final_file)
+                            metrics.DOWNLOADS_TOTAL.labels("completed").inc()
+                        if event.get("type") == "cancelled":
+                            metrics.DOWNLOADS_TOTAL.labels("cancelled").inc()
+                        yield event
+                        if event.get("type") in ("completed", "cancelled", PAUSED):
+                            return
+            except IntegrityError as e:
+                # Nothing of this file can be trusted, not even to resume from
+                logger.error(f"Integrity check of {model_id} failed: {e}")
+                for tmp in (temp_file, temp_file.with_name(temp_file.name + ".parts")):
+                    tmp.unlink(missing_ok=True)
+                metrics.DOWNLOADS_TOTAL.labels("failed").inc()
+                yield {"type": "error", "message": f"Integrity check failed: {e}"}
+                return
+            except DownloadStalled as e:
+                logger.warning(f"Download of {model_id} stalled: {e}")
+                failure = f"Download stalled: {e}"
+            except Exception as e:
+                # The .parts checkpoint stays until verification starts: the next attempt resumes where this one stopped
+                metrics.RETRIES.labels("segmented").inc()
+                logger.warning(f"Segmented download of {model_id} failed: {type(e).__name__}: {e}")
+
+            metrics.DOWNLOADS_TOTAL.labels("failed").inc()
+            yield {"type": "error", "message": failure}
         finally:
             self.active_downloads.pop(model_id, None)
+            metrics.DOWNLOAD_SPEED.labels(model_id).set(0)
 
-    async def _execute_download(self, method: str, cmd: list, size_gb: float, monitor: ProgressMonitor) -> AsyncGenerator[dict, None]:
-        process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        start = time.time()
-        last_prog = -1
+    async def _execute_download(self, downloader: SegmentedDownloader, monitor: ProgressMonitor) -> AsyncGenerator[dict, None]:
+        task = asyncio.create_task(downloader.run())
+        tracker = ProgressTracker(DOWNLOAD_SPEED_HALF_LIFE)
+        last_activity = -1
 
         try:
             while True:
+                # One poll per event: progress goes out at DOWNLOAD_EVENT_HZ at most
+                done, _ = await asyncio.wait({task}, timeout=1 / DOWNLOAD_EVENT_HZ)
+                if task in done:
+                    size = task.result()
+                    elapsed = time.monotonic() - downloader.started_at
+                    speed = downloader.fetched / 1024**2 / elapsed if elapsed > 0 else 0.0
+                    yield {"type": "completed", "progress": 100, "downloaded_bytes": size, "total_bytes": size,
+                           "speed_mbps": round(speed, 2), "sha256": downloader.sha256, "method": "segmented"}
+                    return
+
                 if monitor.cancel_event.is_set():
-                    process.kill()
-                    await process.wait()
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
                     yield {"type": "cancelled"}
                     return
 
+                if monitor.pause_event.is_set():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    yield {"type": PAUSED, "downloaded_bytes": downloader.downloaded, "total_bytes": downloader.size}
+                    return
+
+                size, downloaded = downloader.size, downloader.downloaded
+                prog = int(downloaded * 100 / size) if size else 0
+                # Hashing and repairs after the last byte are progress too: a long verification is not a stall
+                activity = downloader.activity
+                monitor.update(prog, activity)
                 if monitor.is_stalled():
-                    process.kill()
-                    await process.wait()
-                    raise RuntimeError("Stalled")
-
-                try:
-                    line = await asyncio.wait_for(process.stderr.readline(), timeout=0.5)
-                except asyncio.TimeoutError:
-                    if process.returncode is not None:
-                        break
-                    continue
+                    metrics.STALLS.inc()
+                    raise DownloadStalled(f"no progress in {monitor.stall_timeout} s while in the {downloader.phase} phase")
 
-                if not line:
-                    break
-
-                line_str = line.decode('utf-8', errors='ignore')
-
-                match = re.search(r'(\d{1,3})%', line_str)
-                if match:
-                    prog = int(match.group(1))
-                    if 0 <= prog <= 100 and prog != last_prog:
-                        monitor.update(prog)
-                        elapsed = time.time() - start
-
-                        if elapsed >= 0.5:
-                            speed = (prog / 100 * size_gb * 1024) / elapsed
-                            eta = int(((100 - prog) / 100 * size_gb * 1024) / speed) if speed > 0 else 0
-
-                            yield {
-                                "type": "progress",
-                                "progress": prog,
-                                "speed_mbps": round(speed, 2),
-                                "eta_seconds": eta,
-                                "method": method
-                            }
-                            last_prog = prog
-
-            await process.wait()
-
-            if process.returncode == 0:
-                yield {"type": "completed", "progress": 100, "method": method}
-            else:
-                raise RuntimeError(f"Exit code {process.returncode}")
+                if not downloader.started_at:
+                    continue
+                # Bytes actually written, smoothed: no jumps from one poll to the next
+                speed = tracker.sample(downloaded)
+                if activity == last_activity:
+                    continue
+                eta = tracker.eta(downloaded, size)
+                mirror = downloader.mirrors.best()
+                yield {
+                    "type": "progress",
+                    "progress": prog,
+                    "downloaded_bytes": downloaded,
+                    "total_bytes": size,
+                    "speed_mbps": round(speed / 1024**2, 2),
+                    "eta_seconds": eta,
+                    "connections": downloader.active,
+                    "mirror": mirror.host if mirror else None,
+                    "phase": downloader.phase,
+                    "verified_bytes": downloader.hasher.offset,
+                    "refetched_bytes": downloader.refetched,
+                    "method": "segmented"
+                }
+                last_activity = activity
         finally:
-            if process.returncode is None:
-                process.kill()
-                await process.wait()
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
 
     async def cancel(self, model_id: str) -> bool:
-        if model_id not in self.active_downloads:
+        job = self.queue.get(model_id)
+        if job is None:
             return False
 
-        self.active_downloads[model_id].cancel_event.set()
-        await asyncio.sleep(0.5)
-
-        for tmp in which_os(Path(self.config['temp_path']), Path(self.config['win_temp_path'])).glob("*.tmp"):
+        task = job.task
+        if task is not None:
+            # A job started a moment ago has no monitor yet
+            started = asyncio.ensure_future(self._started.setdefault(model_id, asyncio.Event()).wait())
+            await asyncio.wait({task, started}, return_when=asyncio.FIRST_COMPLETED)
+            started.cancel()
+            if model_id in self.active_downloads:
+                self.active_downloads[model_id].cancel_event.set()
+            # The download closes its file before it is deleted
+            await asyncio.wait({task}, timeout=DOWNLOAD_CANCEL_TIMEOUT)
+            if not task.done():
+                logger.warning(f"[DOWNLOAD] {model_id} did not stop within {DOWNLOAD_CANCEL_TIMEOUT}s, its files are kept")
+                return False
+
+        if self.queue.remove(model_id):
+            # Queued or paused: nothing runs, only its clients are left to tell
+            metrics.DOWNLOADS_TOTAL.labels("cancelled").inc()
+            bus = self.events.pop(model_id, None)
+            if bus:
+                bus.publish({"type": "cancelled"})
+                bus.close()
+
+        # Only this model's partial file: other downloads may be running
+        temp_file = which_os(Path(self.config['temp_path']), Path(self.config['win_temp_path'])) / f"{self.models[model_id]['filename']}.tmp"
+        for tmp in (temp_file, temp_file.with_name(temp_file.name + ".parts")):
             tmp.unlink(missing_ok=True)
 
         return True
 
 manager = DownloadManager()
+metrics.DOWNLOADS_ACTIVE.set_function(lambda: len(manager.active_downloads))
+metrics.DOWNLOADS_QUEUED.set_function(lambda: manager.queue.count(QUEUED))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     manager.load_config()
     yield
+    await manager.shutdown()
 
 app = FastAPI(title="Model Download API", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
@@ -299,12 +485,12 @@ async def model_status(model_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/models/{model_id}/download")
-async def download_model(model_id: str):
+async def download_model(model_id: str, priority: Optional[int] = None):
     if not SecurityValidator.validate_model_id(model_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
 
     async def event_stream():
-        async for event in manager.download(model_id):
+        async for event in manager.download(model_id, priority):
             yield f"data: {json.dumps(event)}\n\n"
 
     return StreamingResponse(event_stream(), media_type="text/event-stream",
@@ -318,9 +504,41 @@ async def cancel_download(model_id: str):
     success = await manager.cancel(model_id)
     return {"success": success, "message": "Cancelled" if success else "No active download"}
 
+@app.post("/api/models/{model_id}/pause")
+async def pause_download(model_id: str):
+    if not SecurityValidator.validate_model_id(model_id):
+        raise HTTPException(status_code=400, detail="Invalid ID")
+
+    success = manager.pause(model_id)
+    return {"success": success, "message": "Paused" if success else "No queued or active download"}
+
+@app.post("/api/models/{model_id}/resume")
+async def resume_download(model_id: str):
+    if not SecurityValidator.validate_model_id(model_id):
+        raise HTTPException(status_code=400, detail="Invalid ID")
+
+    success = manager.resume(model_id)
+    return {"success": success, "message": "Resumed" if success else "No paused download"}
+
+@app.get("/api/downloads")
+async def download_queue():
+    return {"success": True, **manager.get_queue()}
+
+@app.put("/api/downloads/limits")
+async def download_limits(max_concurrent: Optional[int] = None, bandwidth_limit_mbps: Optional[float] = None):
+    if (max_concurrent is not None and max_concurrent < 1) or (bandwidth_limit_mbps is not None and bandwidth_limit_mbps < 0):
+        raise HTTPException(status_code=400, detail="max_concurrent must be at least 1, bandwidth_limit_mbps at least 0 (0 for no limit)")
+
+    manager.set_limits(max_concurrent, bandwidth_limit_mbps)
+    return {"success": True, **manager.get_queue()}
+
 @app.get("/health")
 async def health():
-    return {"status": "ok", "active_downloads": len(manager.active_downloads), "available_ram_gb": round(RAMDownloader.get_available_ram_gb(), 2)}
+    return {"status": "ok", "active_downloads": len(manager.active_downloads), "queued_downloads": manager.queue.count(QUEUED), "available_ram_gb": round(RAMDownloader.get_available_ram_gb(), 2)}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 def main():
     import uvicorn, socket
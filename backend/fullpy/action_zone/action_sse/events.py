@@ -0,0 +1,110 @@
+"""Events of a download, fanned out to any number of SSE clients"""
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional, Set
+
+# EVENTS AFTER WHICH A DOWNLOAD HAS NOTHING MORE TO SAY
+TERMINAL = ("completed", "error", "cancelled")
+# WHERE A DOWNLOAD STANDS: ONLY THE LATEST ONE IS PART OF THE SNAPSHOT
+STATES = ("queued", "paused", "started")
+
+
+class ProgressTracker:
+    """
+    Speed and ETA from bytes written. The speed is an EWMA of the rate
+    between samples, weighted by the time they cover (`half_life` seconds),
+    so it reacts the same whatever the sampling rate.
+    """
+
+    def __init__(self, half_life: float = 3.0):
+        self.half_life = half_life
+        self.speed = 0.0
+        self._bytes: Optional[int] = None
+        self._at = 0.0
+
+    def sample(self, downloaded: int, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        if self._bytes is None or downloaded < self._bytes:
+            # First sample (resumed bytes included) or a restart from 0: a baseline, not a rate
+            self._bytes, self._at = downloaded, now
+            return self.speed
+        elapsed = now - self._at
+        if elapsed <= 0:
+            return self.speed
+        rate = (downloaded - self._bytes) / elapsed
+        weight = 1 - 0.5 ** (elapsed / self.half_life)
+        self.speed = rate if not self.speed else weight * rate + (1 - weight) * self.speed
+        self._bytes, self._at = downloaded, now
+        return self.speed
+
+    def eta(self, downloaded: int, size: Optional[int]) -> int:
+        return int((size - downloaded) / self.speed) if size and self.speed > 0 else 0
+
+
+class _Subscriber:
+    """Pending events of one client. Progress is a state: only the newest one waits"""
+
+    def __init__(self):
+        self.events: Deque[dict] = deque()
+        self.wakeup = asyncio.Event()
+
+    def put(self, event: dict):
+        if event.get("type") == "progress" and self.events and self.events[-1].get("type") == "progress":
+            self.events[-1] = event
+        else:
+            self.events.append(event)
+        self.wakeup.set()
+
+
+class EventBus:
+    """
+    Events of one download. A client that subscribes gets a snapshot first
+    (queued, paused or started, the last info and the last progress, or how
+    it ended) and
+    then the live tail until a terminal event. A slow client holds at most
+    the newest progress event: it never makes the download or the other
+    clients wait.
+    """
+
+    def __init__(self):
+        self.snapshot: Dict[str, dict] = {}
+        self.closed = False
+        self._subscribers: Set[_Subscriber] = set()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: dict):
+        kind = event.get("type")
+        self.snapshot["end" if kind in TERMINAL else "state" if kind in STATES else kind] = event
+        for subscriber in self._subscribers:
+            subscriber.put(event)
+
+    def close(self):
+        self.closed = True
+        for subscriber in self._subscribers:
+            subscriber.wakeup.set()
+
+    async def subscribe(self) -> AsyncIterator[dict]:
+        # Snapshot and registration with no await in between: nothing is missed or sent twice
+        subscriber = _Subscriber()
+        for event in self.snapshot.values():
+            subscriber.put(event)
+        if not self.closed:
+            self._subscribers.add(subscriber)
+        try:
+            while True:
+                if not subscriber.events:
+                    if self.closed:
+                        return
+                    subscriber.wakeup.clear()
+                    await subscriber.wakeup.wait()
+                    continue
+                event = subscriber.events.popleft()
+                yield event
+                if event.get("type") in TERMINAL:
+                    return
+        finally:
+            self._subscribers.discard(subscriber)
@@ -0,0 +1,85 @@
+"""Integrity of a downloaded model: SHA-256 computed while it downloads, GGUF header check"""
+import zlib
+import struct
+import hashlib
+from pathlib import Path
+from typing import List
+
+GGUF_MAGIC = b"GGUF"
+GGUF_VERSIONS = (1, 2, 3)
+# A HEADER CLAIMING MORE IS GARBAGE, NOT A MODEL
+GGUF_MAX_COUNT = 1 << 24
+
+
+class IntegrityError(Exception):
+    """The file is not what was asked for: hash mismatch or not a GGUF"""
+
+
+def check_gguf_header(path: Path) -> dict:
+    """Magic, version and tensor / metadata counts of a GGUF file. Raises IntegrityError"""
+    with open(path, "rb") as f:
+        header = f.read(24)
+    if len(header) < 8 or header[:4] != GGUF_MAGIC:
+        raise IntegrityError(f"{Path(path).name} is not a GGUF file (magic {header[:4]!r})")
+    version = struct.unpack_from("<I", header, 4)[0]
+    if version not in GGUF_VERSIONS:
+        raise IntegrityError(f"Unsupported GGUF version {version}")
+    # Version 1 had 32 bit counts
+    counts = "<II" if version == 1 else "<QQ"
+    if len(header) < 8 + struct.calcsize(counts):
+        raise IntegrityError(f"{Path(path).name} is truncated: {len(header)} byte header")
+    tensors, kv = struct.unpack_from(counts, header, 8)
+    # Zero tensors is a vocab-only GGUF
+    if tensors > GGUF_MAX_COUNT or kv > GGUF_MAX_COUNT:
+        raise IntegrityError(f"Implausible GGUF header: {tensors} tensors, {kv} metadata keys")
+    return {"version": version, "tensors": tensors, "metadata": kv}
+
+
+class StreamHasher:
+    """
+    SHA-256 of a file fed in order, from the first byte. Keeps the hash state
+    and a CRC32 at every `piece_bytes` boundary: after a mismatch the pieces
+    whose fresh copy differs are rewritten and the hash resumes from the
+    first one instead of from byte 0.
+
+    update() is meant for a worker thread; hashlib and zlib release the GIL.
+    """
+
+    def __init__(self, piece_bytes: int = 32 * 1024**2):
+        self.piece_bytes = piece_bytes
+        self._states: List = [hashlib.sha256()]
+        self.crcs: List[int] = []
+        self.rewind(0)
+
+    def reset(self):
+        """From byte 0 again: a plain GET restarted the file"""
+        self.rewind(0)
+
+    def rewind(self, piece: int):
+        """Back to the start of `piece`: everything after it gets hashed again"""
+        self._sha = self._states[piece].copy()
+        del self._states[piece + 1:]
+        del self.crcs[piece:]
+        self._crc = 0
+        self.offset = piece * self.piece_bytes
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            # Never across a piece boundary: each piece has its own state and CRC
+            room = self.piece_bytes - self.offset % self.piece_bytes
+            part, view = view[:room], view[room:]
+            self._sha.update(part)
+            self._crc = zlib.crc32(part, self._crc)
+            self.offset += len(part)
+            if self.offset % self.piece_bytes == 0:
+                self.crcs.append(self._crc)
+                self._states.append(self._sha.copy())
+                self._crc = 0
+
+    def piece_crc(self, piece: int) -> int:
+        """CRC32 of a piece hashed so far (the last one may be partial)"""
+        return self.crcs[piece] if piece < len(self.crcs) else self._crc
+
+    def hexdigest(self) -> str:
+        return self._sha.hexdigest()
@@ -0,0 +1,15 @@
+"""Metrics of the model download server, scraped from GET /metrics"""
+from action_zone.utils.metrics import Counter, Gauge
+
+DOWNLOAD_BYTES = Counter("sse_download_bytes_total", "Bytes downloaded, rate() of it is the download speed", ["method"])
+DOWNLOAD_SPEED = Gauge("sse_download_speed_bytes", "Last reported speed of each active download", ["model_id"])
+DOWNLOADS_ACTIVE = Gauge("sse_downloads_active", "Downloads in progress")
+DOWNLOADS_QUEUED = Gauge("sse_downloads_queued", "Downloads waiting for a free slot")
+DOWNLOADS_TOTAL = Counter("sse_downloads_total", "Finished downloads by outcome", ["outcome"])
+RETRIES = Counter("sse_download_retries_total", "Attempts that failed and moved on to the next method or mirror", ["method"])
+STALLS = Counter("sse_download_stalls_total", "Downloads killed for making no progress within stall_timeout")
+DOWNLOAD_BUFFER_BYTES = Gauge("sse_download_buffer_bytes", "Memory held by the write-behind buffer pools of active downloads")
+WRITE_WAITS = Counter("sse_download_write_waits_total", "Chunks that waited for a free buffer: the disk is slower than the network")
+MIRROR_SWITCHES = Counter("sse_download_mirror_switches_total", "Segments moved off a mirror that fell behind another one")
+INTEGRITY_FAILURES = Counter("sse_download_integrity_failures_total", "Downloads whose SHA-256 or GGUF header did not check out", ["check"])
+PIECES_REFETCHED = Counter("sse_download_pieces_refetched_total", "Pieces fetched again after a SHA-256 mismatch")
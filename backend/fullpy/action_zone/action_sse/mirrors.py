@@ -0,0 +1,188 @@
+"""Mirrors of one download: raced with small Range probes, ranked by a throughput EWMA kept between runs"""
+import json
+import time
+import asyncio
+from pathlib import Path
+from urllib.parse import urlparse
+from typing import Dict, List, Optional, Sequence
+import aiohttp
+from action_zone.action_sse import logger
+
+
+class Mirror:
+    """One URL of the file and how fast it has been"""
+    __slots__ = ('origin', 'url', 'host', 'speed', 'samples', 'failures', 'size', 'ranged', 'etag', 'alive')
+
+    def __init__(self, origin: str, speed: float = 0.0):
+        self.origin = origin
+        # url: AFTER REDIRECTS, speed: EWMA OF BYTES/S OVER ONE CONNECTION
+        self.url = origin
+        self.host = urlparse(origin).netloc.lower()
+        self.speed = speed
+        self.samples = 0
+        self.failures = 0
+        self.size: Optional[int] = None
+        self.ranged = False
+        self.etag: Optional[str] = None
+        self.alive = True
+
+    def observe(self, nbytes: int, seconds: float, alpha: float):
+        if seconds <= 0 or nbytes <= 0:
+            return
+        rate = nbytes / seconds
+        self.speed = rate if not self.speed else alpha * rate + (1 - alpha) * self.speed
+        self.samples += 1
+        self.failures = 0
+
+
+class MirrorStats:
+    """Throughput EWMA of each host, saved to a JSON file so the next run starts from it"""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.hosts: Dict[str, dict] = {}
+        if path:
+            try:
+                self.hosts = json.loads(Path(path).read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self.hosts = {}
+
+    def speed(self, host: str) -> float:
+        return float(self.hosts.get(host, {}).get("speed", 0.0))
+
+    def record(self, mirror: Mirror):
+        if mirror.samples:
+            self.hosts[mirror.host] = {"speed": round(mirror.speed), "failures": mirror.failures, "updated": int(time.time())}
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            tmp = Path(self.path).with_name(Path(self.path).name + ".tmp")
+            tmp.write_text(json.dumps(self.hosts, indent=2), encoding="utf-8")
+            tmp.replace(self.path)
+        except OSError as e:
+            logger.warning(f"[MIRRORS] Could not save {self.path}: {e}")
+
+
+class MirrorSet:
+    """
+    Every URL of one file. race() probes them all at once with a small
+    Range request: the probe gives each mirror its final URL, size and Range
+    support, and a first throughput sample blended into the speed saved
+    from earlier runs. Mirrors that fail the probe, or serve another size
+    than the fastest one, are left out.
+
+    best() is the mirror the next segment goes to. Every chunk updates its
+    mirror's EWMA; a mirror slower than `degraded_ratio` of another one,
+    or failing `max_failures` times in a row, gives its remaining segments
+    to the others.
+    """
+
+    def __init__(self, urls: Sequence[str], stats: Optional[MirrorStats] = None, probe_bytes: int = 256 * 1024,
+                 probe_timeout: float = 10.0, alpha: float = 0.3, degraded_ratio: float = 0.5, max_failures: int = 3):
+        self.stats = stats or MirrorStats()
+        self.mirrors = [Mirror(url, self.stats.speed(urlparse(url).netloc.lower())) for url in dict.fromkeys(urls)]
+        self.probe_bytes = probe_bytes
+        self.probe_timeout = probe_timeout
+        self.alpha = alpha
+        self.degraded_ratio = degraded_ratio
+        self.max_failures = max_failures
+        self.size: Optional[int] = None
+        self.ranged = False
+
+    @property
+    def alive(self) -> List[Mirror]:
+        return [m for m in self.mirrors if m.alive]
+
+    @property
+    def etags(self) -> Dict[str, str]:
+        return {m.host: m.etag for m in self.mirrors if m.etag}
+
+    async def race(self, session: aiohttp.ClientSession) -> Optional[Mirror]:
+        """Probes every mirror in parallel. Returns the fastest usable one, None when none answered"""
+        await asyncio.gather(*(self.probe(session, m) for m in self.mirrors))
+
+        # RANGES BEAT A FASTER SINGLE STREAM: ONLY A FILE WITHOUT ANY RANGED MIRROR IS FETCHED WITH ONE GET
+        self.ranged = any(m.ranged for m in self.alive)
+        first = max((m for m in self.alive if m.ranged or not self.ranged), key=lambda m: m.speed, default=None)
+        if first is None:
+            return None
+        self.size = first.size
+        for mirror in self.alive:
+            if mirror.size != self.size or (self.ranged and not mirror.ranged):
+                mirror.alive = False
+                logger.warning(f"[MIRRORS] Leaving out {mirror.host}: {mirror.size} bytes, ranges {mirror.ranged}")
+        logger.info("[MIRRORS] " + ", ".join(f"{m.host} {m.speed / 1024**2:.1f} MB/s" for m in self.alive))
+        return first
+
+    async def probe(self, session: aiohttp.ClientSession, mirror: Mirror, nbytes: Optional[int] = None):
+        """First bytes of the file through the redirects"""
+        began = time.monotonic()
+        try:
+            received = await asyncio.wait_for(self._probe(session, mirror, nbytes or self.probe_bytes), self.probe_timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            mirror.alive = False
+            mirror.failures += 1
+            logger.warning(f"[MIRRORS] Probe of {mirror.host} failed: {type(e).__name__}: {e}")
+            return
+        mirror.alive = True
+        mirror.observe(received, time.monotonic() - began, self.alpha)
+
+    async def _probe(self, session: aiohttp.ClientSession, mirror: Mirror, nbytes: int) -> int:
+        async with session.get(mirror.origin, headers={"Range": f"bytes=0-{nbytes - 1}"}) as response:
+            if response.status == 206:
+                total = response.headers.get("Content-Range", "").rpartition("/")[2]
+                mirror.size = int(total) if total.isdigit() else None
+                mirror.ranged = mirror.size is not None
+            elif response.status == 200:
+                mirror.size = response.content_length
+                mirror.ranged = False
+            else:
+                raise ValueError(f"HTTP {response.status}")
+            mirror.url = str(response.url)
+            mirror.etag = response.headers.get("ETag")
+
+            received = 0
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                received += len(chunk)
+                if received >= nbytes:
+                    break
+            return received
+
+    async def resolve(self, session: aiohttp.ClientSession, mirror: Mirror):
+        """Follows the redirects again for an expired signed URL. Only url/etag change: liveness is left to failed()"""
+        try:
+            await asyncio.wait_for(self._resolve(session, mirror), self.probe_timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"[MIRRORS] Could not resolve {mirror.host} again: {type(e).__name__}: {e}")
+
+    async def _resolve(self, session: aiohttp.ClientSession, mirror: Mirror):
+        async with session.get(mirror.origin, headers={"Range": "bytes=0-0"}) as response:
+            if response.status not in (200, 206):
+                raise ValueError(f"HTTP {response.status}")
+            mirror.url = str(response.url)
+            mirror.etag = response.headers.get("ETag")
+
+    def best(self) -> Optional[Mirror]:
+        return max(self.alive, key=lambda m: m.speed, default=None)
+
+    def degraded(self, mirror: Mirror) -> Optional[Mirror]:
+        """A mirror clearly faster than `mirror`, once `mirror` has enough samples to judge"""
+        if mirror.samples < 3:
+            return None
+        other = max((m for m in self.alive if m is not mirror), key=lambda m: m.speed, default=None)
+        if other is not None and mirror.speed < self.degraded_ratio * other.speed:
+            return other
+        return None
+
+    def failed(self, mirror: Mirror):
+        mirror.failures += 1
+        if mirror.failures >= self.max_failures and mirror.alive and len(self.alive) > 1:
+            mirror.alive = False
+            logger.warning(f"[MIRRORS] {mirror.host} failed {mirror.failures} times in a row, moving to the others")
+
+    def save(self):
+        for mirror in self.mirrors:
+            self.stats.record(mirror)
+        self.stats.save()
@@ -0,0 +1,151 @@
+"""Download scheduling: a priority queue over a few download slots, and one bandwidth budget for all of them"""
+import time
+import asyncio
+import itertools
+from typing import Awaitable, Callable, Dict, List, Optional
+from action_zone.action_sse import logger
+
+# JOB STATES
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+PAUSED = "paused"
+DONE = "done"
+
+
+class TokenBucket:
+    """
+    Bytes per second shared by every download; 0 is unlimited. A reader
+    takes what it read and sleeps off any debt, so concurrent readers
+    split the rate between them. The rate can change at any time.
+    """
+
+    def __init__(self, rate: float = 0.0, burst_seconds: float = 0.5):
+        self.burst_seconds = burst_seconds
+        self.rate = 0.0
+        self._tokens = 0.0
+        self._at = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        self.rate = max(0.0, rate)
+        # Whatever was saved or owed under the old rate does not carry over
+        self._tokens = 0.0
+        self._at = time.monotonic()
+
+    async def take(self, nbytes: int):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.rate * self.burst_seconds, self._tokens + (now - self._at) * self.rate) - nbytes
+        self._at = now
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class DownloadJob:
+    __slots__ = ('model_id', 'priority', 'seq', 'state', 'task')
+
+    def __init__(self, model_id: str, priority: int, seq: int):
+        self.model_id = model_id
+        self.priority = priority
+        self.seq = seq
+        self.state = QUEUED
+        self.task: Optional[asyncio.Task] = None
+
+
+class DownloadQueue:
+    """
+    Downloads waiting for one of `max_active` slots: highest priority
+    first, then oldest. `run(job)` starts in a task when a slot frees up.
+    Once it returns the job is gone, unless it was paused: a paused job
+    keeps its entry but no slot, until resume() queues it again.
+    `on_change()` runs after every change of state or position.
+    """
+
+    def __init__(self, run: Callable[[DownloadJob], Awaitable[None]], max_active: int = 1,
+                 on_change: Optional[Callable[[], None]] = None):
+        self.run = run
+        self.max_active = max(1, max_active)
+        self.on_change = on_change
+        self.jobs: Dict[str, DownloadJob] = {}
+        self._seq = itertools.count()
+
+    def get(self, model_id: str) -> Optional[DownloadJob]:
+        return self.jobs.get(model_id)
+
+    def waiting(self) -> List[DownloadJob]:
+        """Queued jobs in the order they will start"""
+        return sorted((j for j in self.jobs.values() if j.state == QUEUED and j.task is None), key=lambda j: (-j.priority, j.seq))
+
+    def position(self, model_id: str) -> int:
+        """1 for the next job to start, 0 when not queued"""
+        return next((i for i, j in enumerate(self.waiting(), 1) if j.model_id == model_id), 0)
+
+    def count(self, state: str) -> int:
+        return sum(1 for j in self.jobs.values() if j.state == state)
+
+    def submit(self, model_id: str, priority: int = 0) -> DownloadJob:
+        job = DownloadJob(model_id, priority, next(self._seq))
+        self.jobs[model_id] = job
+        self._schedule()
+        return job
+
+    def set_priority(self, model_id: str, priority: int):
+        job = self.jobs.get(model_id)
+        if job and job.priority != priority:
+            job.priority = priority
+            self._schedule()
+
+    def set_max_active(self, max_active: int):
+        # Running jobs above a lowered limit finish; none starts until below it
+        self.max_active = max(1, max_active)
+        self._schedule()
+
+    def pause(self, model_id: str) -> Optional[str]:
+        """Marks the job paused. Returns the state it was in: the caller stops a running one"""
+        job = self.jobs.get(model_id)
+        if job is None or job.state not in (QUEUED, DOWNLOADING):
+            return None
+        previous, job.state = job.state, PAUSED
+        self._schedule()
+        return previous
+
+    def resume(self, model_id: str) -> bool:
+        job = self.jobs.get(model_id)
+        if job is None or job.state != PAUSED:
+            return False
+        # Back in line by priority, ahead of jobs queued after it first was. One
+        # resumed while still stopping is queued again once it has stopped
+        job.state = QUEUED
+        self._schedule()
+        return True
+
+    def remove(self, model_id: str) -> Optional[DownloadJob]:
+        """Drops a job that holds no slot"""
+        job = self.jobs.get(model_id)
+        if job is None or job.task is not None:
+            return None
+        del self.jobs[model_id]
+        self._schedule()
+        return job
+
+    def _schedule(self):
+        running = sum(1 for j in self.jobs.values() if j.task is not None)
+        for job in self.waiting()[:max(0, self.max_active - running)]:
+            job.state = DOWNLOADING
+            job.task = asyncio.create_task(self._run(job))
+            logger.info(f"[QUEUE] Starting {job.model_id} (priority {job.priority})")
+        if self.on_change:
+            self.on_change()
+
+    async def _run(self, job: DownloadJob):
+        try:
+            await self.run(job)
+        finally:
+            job.task = None
+            if job.state == PAUSED:
+                logger.info(f"[QUEUE] Paused {job.model_id}")
+            elif job.state != QUEUED:
+                job.state = DONE
+                self.jobs.pop(job.model_id, None)
+            self._schedule()
@@ -0,0 +1,498 @@
+"""Segmented HTTP download: byte ranges over parallel connections into one preallocated file"""
+import json
+import time
+import zlib
+import asyncio
+from pathlib import Path
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple, Union
+import aiohttp
+from action_zone.action_sse import logger
+from action_zone.action_sse import metrics
+from action_zone.action_sse.integrity import IntegrityError, StreamHasher
+from action_zone.action_sse.mirrors import Mirror, MirrorSet
+from action_zone.action_sse.scheduler import TokenBucket
+from action_zone.action_sse.writers import FileWriter
+
+# READ / WRITE GRANULARITY
+CHUNK_BYTES = 1024**2
+# DONE RANGES ARE SAVED NEXT TO THE TEMP FILE THIS OFTEN, FOR RESUME
+CHECKPOINT_SECONDS = 5.0
+# THE HASHER READS WRITTEN BYTES BACK THIS MUCH AT A TIME
+HASH_READ_BYTES = 8 * 1024**2
+
+
+class SegmentError(Exception):
+    """A byte range failed more times than allowed, or the server does not answer it"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class MirrorDegraded(Exception):
+    """The mirror of a segment fell behind another one: the rest of the segment moves"""
+
+
+class RangeSet:
+    """Sorted, merged [start, end) intervals: the bytes already on disk"""
+
+    def __init__(self, ranges: Optional[List[List[int]]] = None):
+        self.ranges: List[List[int]] = []
+        for start, end in ranges or ():
+            self.add(start, end)
+
+    def add(self, start: int, end: int):
+        if end <= start:
+            return
+        merged = []
+        for s, e in self.ranges:
+            if e < start or s > end:
+                merged.append([s, e])
+            else:
+                start, end = min(s, start), max(e, end)
+        merged.append([start, end])
+        self.ranges = sorted(merged)
+
+    def total(self) -> int:
+        return sum(e - s for s, e in self.ranges)
+
+    def end_from(self, offset: int) -> int:
+        """End of the range holding `offset`, `offset` itself when none does"""
+        for s, e in self.ranges:
+            if s <= offset < e:
+                return e
+        return offset
+
+    def pieces(self, piece_bytes: int) -> Set[int]:
+        """Indexes of the `piece_bytes` pieces these ranges touch"""
+        return {p for s, e in self.ranges for p in range(s // piece_bytes, (e - 1) // piece_bytes + 1)}
+
+    def missing(self, size: int) -> List[Tuple[int, int]]:
+        gaps, at = [], 0
+        for s, e in self.ranges:
+            if s > at:
+                gaps.append((at, s))
+            at = max(at, e)
+        if at < size:
+            gaps.append((at, size))
+        return gaps
+
+
+class Segment:
+    __slots__ = ('start', 'pos', 'received', 'end', 'attempts')
+
+    def __init__(self, start: int, end: Optional[int], attempts: int = 0):
+        self.start = start
+        # pos: WRITTEN UP TO, received: READ FROM THE SOCKET UP TO, end: MAY SHRINK WHEN ANOTHER WORKER STEALS THE TAIL
+        self.pos = start
+        self.received = start
+        self.end = end
+        self.attempts = attempts
+
+
+class SegmentedDownloader:
+    """
+    Fetches one file over `connections` parallel Range requests. Each worker
+    takes the next segment sized so it lasts about `segment_seconds` at that
+    worker's measured speed (between min and max segment bytes); when nothing
+    is left to take, an idle worker splits the largest segment still in
+    flight, so the last bytes do not arrive over a single connection.
+
+    Segments go to the fastest mirror of `mirrors` (see MirrorSet); one
+    that falls behind another mirror hands the rest of its range over.
+    A segment that fails is retried from the byte it reached. Done ranges
+    are checkpointed to `<temp>.parts`: a later run resumes instead of
+    starting over. Files no mirror serves in ranges get one plain GET.
+
+    `make_writer(path, size)` builds the writer of the temp file once the
+    size is known: FileWriter by default, a WriteBehindWriter to stage
+    chunks in memory.
+
+    SHA-256 runs alongside: the contiguous prefix written so far is read
+    back and hashed, so the digest is ready right after the last byte. On a
+    mismatch with `sha256`, pieces are fetched again (the ones from dropped
+    or odd mirrors and retried segments first) and only what changed is
+    hashed again; IntegrityError when the file still does not match.
+
+    Every chunk read is taken from `limiter`, when given: the bandwidth cap
+    shared by all downloads.
+    """
+
+    def __init__(self, mirrors: Union[str, Sequence[str], MirrorSet], path: Path, connections: int = 8,
+                 min_segment: int = 4 * 1024**2, max_segment: int = 64 * 1024**2,
+                 segment_seconds: float = 4.0, retries: int = 5, read_timeout: float = 30.0,
+                 make_writer: Callable[[Path, Optional[int]], FileWriter] = FileWriter,
+                 sha256: Optional[str] = None, piece_bytes: int = 32 * 1024**2,
+                 limiter: Optional[TokenBucket] = None):
+        self.mirrors = mirrors if isinstance(mirrors, MirrorSet) else MirrorSet([mirrors] if isinstance(mirrors, str) else mirrors)
+        self.path = Path(path)
+        self.parts_path = self.path.with_name(self.path.name + ".parts")
+        self.connections = max(1, connections)
+        self.min_segment = min_segment
+        self.max_segment = max(min_segment, max_segment)
+        self.segment_seconds = segment_seconds
+        self.retries = retries
+        self.read_timeout = read_timeout
+        self.make_writer = make_writer
+        self.expected_sha256 = sha256.lower() if sha256 else None
+        self.limiter = limiter
+
+        self.size: Optional[int] = None
+        self.ranged = False
+        self.done = RangeSet()
+        # BYTES ON DISK (RESUMED INCLUDED) AND BYTES FETCHED BY THIS RUN
+        self.downloaded = 0
+        self.fetched = 0
+        self.started_at = 0.0
+        self.active = 0
+        self.hasher = StreamHasher(piece_bytes)
+        self.sha256: Optional[str] = None
+        # "download", THEN "verify" ONCE EVERY BYTE IS IN AND "repair" WHILE PIECES ARE FETCHED AGAIN
+        self.phase = "download"
+        self.refetched = 0
+
+        self._pending: Deque[Segment] = deque()
+        self._flight: List[Segment] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._writer: Optional[FileWriter] = None
+        self._written = asyncio.Event()
+        self._rehash = False
+        # WHO WROTE WHAT: SUSPECTS WHEN THE HASH DOES NOT MATCH
+        self._sources: Dict[str, RangeSet] = {}
+        self._retried = RangeSet()
+
+    @property
+    def complete(self) -> bool:
+        return self.size is not None and self.downloaded >= self.size
+
+    @property
+    def activity(self) -> int:
+        """Moves as long as work goes on: bytes downloaded, hashed, and fetched again by a repair"""
+        return self.downloaded + self.hasher.offset + self.refetched
+
+    async def run(self) -> int:
+        """Downloads into `path`. Returns the file size; raises when a segment gives up"""
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=self.read_timeout)
+        connector = aiohttp.TCPConnector(limit_per_host=self.connections + 1)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector, auto_decompress=False) as session:
+            self._session = session
+            await self._resolve()
+            self._plan()
+            self._writer = self.make_writer(self.path, self.size)
+            await self._writer.open()
+            self.started_at = time.monotonic()
+
+            workers = [asyncio.create_task(self._worker()) for _ in range(self.connections if self.ranged else 1)]
+            checkpoints = asyncio.create_task(self._checkpoint_loop())
+            hashing = asyncio.create_task(self._hash_loop())
+            try:
+                await asyncio.gather(*workers)
+                if self.size is None:
+                    self.size = self.downloaded
+                if self.complete:
+                    # From here on the checkpoint would claim a file that may not verify: a later
+                    # run would only repeat the same repair. A failure now starts from scratch
+                    self.phase = "verify"
+                    checkpoints.cancel()
+                    await asyncio.gather(checkpoints, return_exceptions=True)
+                    self.parts_path.unlink(missing_ok=True)
+                    self._written.set()
+                    await hashing
+                    await self._verify()
+            except BaseException:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+            finally:
+                checkpoints.cancel()
+                hashing.cancel()
+                await asyncio.gather(hashing, return_exceptions=True)
+                await self._finish()
+
+        if not self.complete:
+            raise SegmentError(f"Incomplete: {self.downloaded} of {self.size} bytes")
+        self.parts_path.unlink(missing_ok=True)
+        return self.size
+
+    # PLAN
+    async def _resolve(self):
+        # Every mirror at once: final URLs, size, Range support and a first speed sample
+        if await self.mirrors.race(self._session) is None:
+            raise SegmentError("No mirror answered")
+        self.size, self.ranged = self.mirrors.size, self.mirrors.ranged
+
+    def _plan(self):
+        saved = self._load_parts()
+        if saved and self.ranged and self.path.exists():
+            self.done = RangeSet(saved["done"])
+        else:
+            self.done = RangeSet()
+            self.parts_path.unlink(missing_ok=True)
+        self.downloaded = self.done.total()
+
+        if not self.ranged:
+            # NO RANGES: ONE STREAM FROM THE START, NOTHING TO RESUME
+            self.done, self.downloaded = RangeSet(), 0
+            self.path.unlink(missing_ok=True)
+            self._pending = deque([Segment(0, self.size)])
+            return
+        self._pending = deque(Segment(start, end) for start, end in self.done.missing(self.size))
+        if self.downloaded:
+            logger.info(f"[DOWNLOAD] Resuming {self.path.name}: {self.downloaded} of {self.size} bytes already on disk")
+
+    def _load_parts(self) -> Optional[dict]:
+        try:
+            saved = json.loads(self.parts_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if saved.get("size") != self.size:
+            return None
+        # A mirror that now serves another version of the file invalidates what was saved
+        etags = self.mirrors.etags
+        if any(host in etags and etags[host] != etag for host, etag in saved.get("etags", {}).items()):
+            return None
+        return saved
+
+    def _take(self, speed: float) -> Optional[Segment]:
+        if self._pending:
+            segment = self._pending.popleft()
+            if not self.ranged or segment.attempts:
+                return segment
+            # SIZE FROM THIS CONNECTION'S SPEED, NEVER MORE THAN A FAIR SHARE OF WHAT IS LEFT
+            left = segment.end - segment.start + sum(s.end - s.start for s in self._pending)
+            size = min(self.max_segment, max(self.min_segment, int(speed * self.segment_seconds)))
+            size = min(size, max(self.min_segment, left // self.connections))
+            if segment.end - segment.start > size:
+                self._pending.appendleft(Segment(segment.start + size, segment.end))
+                segment.end = segment.start + size
+            return segment
+
+        if not self.ranged:
+            return None
+        # NOTHING QUEUED: SPLIT THE LARGEST SEGMENT STILL IN FLIGHT
+        victim = max(self._flight, key=lambda s: s.end - s.received, default=None)
+        if victim is None or victim.end is None or victim.end - victim.received < 2 * self.min_segment:
+            return None
+        middle = victim.received + (victim.end - victim.received) // 2
+        stolen = Segment(middle, victim.end)
+        victim.end = middle
+        return stolen
+
+    # FETCH
+    async def _worker(self):
+        speed = 0.0
+        while True:
+            segment = self._take(speed)
+            if segment is None:
+                return
+            mirror = self.mirrors.best()
+            if mirror is None:
+                raise SegmentError("No mirror left")
+            self._flight.append(segment)
+            self.active += 1
+            began, at = time.monotonic(), segment.pos
+            try:
+                await self._fetch(segment, mirror)
+            except MirrorDegraded as e:
+                metrics.MIRROR_SWITCHES.inc()
+                logger.info(f"[DOWNLOAD] {self.path.name} bytes {segment.pos}-{segment.end}: {e}")
+                self._pending.appendleft(Segment(segment.pos, segment.end, segment.attempts))
+            except (aiohttp.ClientError, asyncio.TimeoutError, SegmentError) as e:
+                segment.attempts += 1
+                metrics.RETRIES.labels("segment").inc()
+                self.mirrors.failed(mirror)
+                self._retried.add(at, segment.pos)
+                if segment.attempts > self.retries:
+                    raise SegmentError(f"Bytes {segment.pos}-{segment.end} failed {segment.attempts} times: {e}")
+                logger.warning(f"[DOWNLOAD] {self.path.name} bytes {segment.pos}-{segment.end} from {mirror.host}: {type(e).__name__}: {e}, retry {segment.attempts}")
+                if getattr(e, "status", None) in (401, 403, 410):
+                    # Signed CDN URLs expire: follow the redirects again
+                    await self.mirrors.resolve(self._session, mirror)
+                if self.mirrors.best() is mirror:
+                    # Same mirror again: back off. Another one is tried right away
+                    await asyncio.sleep(min(2 ** segment.attempts, 30))
+                if not self.ranged:
+                    # A plain GET cannot continue where it stopped
+                    self.downloaded, self.done = 0, RangeSet()
+                    self._sources, self._rehash = {}, True
+                    segment.pos = 0
+                retry = Segment(segment.pos, segment.end, segment.attempts)
+                if retry.end is None or retry.pos < retry.end:
+                    self._pending.appendleft(retry)
+            finally:
+                self._flight.remove(segment)
+                self.active -= 1
+
+            elapsed = time.monotonic() - began
+            if elapsed > 0 and segment.pos > at:
+                speed = (segment.pos - at) / elapsed
+
+    async def _fetch(self, segment: Segment, mirror: Mirror):
+        headers = {"Range": f"bytes={segment.pos}-{segment.end - 1}"} if self.ranged else {}
+        last = time.monotonic()
+        async with self._session.get(mirror.url, headers=headers) as response:
+            expected = 206 if self.ranged else 200
+            if response.status != expected:
+                raise SegmentError(f"HTTP {response.status}", response.status)
+            if self.ranged and not response.headers.get("Content-Range", "").startswith(f"bytes {segment.pos}-"):
+                raise SegmentError(f"Unexpected Content-Range {response.headers.get('Content-Range')}")
+
+            buffer = bytearray()
+            async for chunk in response.content.iter_chunked(CHUNK_BYTES):
+                if self.limiter:
+                    await self.limiter.take(len(chunk))
+                buffer += chunk
+                segment.received += len(chunk)
+                # THE TAIL MAY HAVE BEEN HANDED TO ANOTHER WORKER MEANWHILE
+                if segment.end is not None and segment.pos + len(buffer) >= segment.end:
+                    del buffer[segment.end - segment.pos:]
+                    break
+                if len(buffer) >= CHUNK_BYTES:
+                    now = time.monotonic()
+                    mirror.observe(len(buffer), now - last, self.mirrors.alpha)
+                    last = now
+                    await self._write(segment, buffer, mirror)
+                    buffer = bytearray()
+                    # Without ranges, leaving would mean starting over
+                    faster = self.ranged and self.mirrors.degraded(mirror)
+                    if faster:
+                        raise MirrorDegraded(f"{mirror.host} at {mirror.speed / 1024**2:.1f} MB/s, moving to {faster.host} at {faster.speed / 1024**2:.1f} MB/s")
+            if buffer:
+                await self._write(segment, buffer, mirror)
+
+        if segment.end is not None and segment.pos < segment.end:
+            raise SegmentError(f"Connection closed at byte {segment.pos}")
+
+    async def _write(self, segment: Segment, data: bytearray, mirror: Mirror):
+        await self._writer.write(segment.pos, data)
+        self.done.add(segment.pos, segment.pos + len(data))
+        self._sources.setdefault(mirror.host, RangeSet()).add(segment.pos, segment.pos + len(data))
+        segment.pos += len(data)
+        self.downloaded += len(data)
+        self.fetched += len(data)
+        metrics.DOWNLOAD_BYTES.labels("segmented").inc(len(data))
+        self._written.set()
+
+    # INTEGRITY
+    async def _hash_loop(self):
+        loop = asyncio.get_running_loop()
+        while self.size is None or self.hasher.offset < self.size:
+            if self._rehash:
+                self.hasher.reset()
+                self._rehash = False
+            at = self.hasher.offset
+            end = self.done.end_from(at)
+            if end <= at:
+                self._written.clear()
+                await self._written.wait()
+                continue
+            data = await self._writer.read(at, min(end - at, HASH_READ_BYTES))
+            if not data:
+                raise SegmentError(f"Short read at byte {at} of {self.path.name}")
+            if not self._rehash:
+                await loop.run_in_executor(None, self.hasher.update, data)
+
+    async def _verify(self):
+        self.sha256 = self.hasher.hexdigest()
+        if not self.expected_sha256 or self.sha256 == self.expected_sha256:
+            return
+        metrics.INTEGRITY_FAILURES.labels("sha256").inc()
+        logger.warning(f"[DOWNLOAD] {self.path.name}: SHA-256 {self.sha256}, expected {self.expected_sha256}")
+        if self.ranged:
+            await self._repair()
+        if self.sha256 != self.expected_sha256:
+            raise IntegrityError(f"SHA-256 of {self.path.name} is {self.sha256}, expected {self.expected_sha256}")
+
+    async def _repair(self):
+        self.phase = "repair"
+        count = -(-self.size // self.hasher.piece_bytes)
+        suspects = self._suspect_pieces()
+        semaphore = asyncio.Semaphore(self.connections)
+
+        async def refetch(piece: int) -> bool:
+            async with semaphore:
+                return await self._refetch_piece(piece)
+
+        # Suspects first: most of the time the rest of the file is never fetched again
+        for batch in (sorted(suspects), [p for p in range(count) if p not in suspects]):
+            changed = [p for p, differs in zip(batch, await asyncio.gather(*(refetch(p) for p in batch))) if differs]
+            logger.info(f"[DOWNLOAD] {self.path.name}: {len(changed)} of {len(batch)} pieces fetched again differed")
+            if not changed:
+                continue
+            self.hasher.rewind(min(changed))
+            await self._hash_loop()
+            self.sha256 = self.hasher.hexdigest()
+            if self.sha256 == self.expected_sha256:
+                return
+
+    def _suspect_pieces(self) -> Set[int]:
+        """Pieces from retried segments, dropped mirrors, or mirrors serving another ETag than most"""
+        etags = [m.etag for m in self.mirrors.mirrors if m.etag]
+        # On a tie, the ETag of the mirror listed first
+        common = max(etags, key=etags.count) if etags else None
+        hosts = {m.host for m in self.mirrors.mirrors if not m.alive or (m.etag and m.etag != common)}
+        pieces = self._retried.pieces(self.hasher.piece_bytes)
+        for host in hosts & self._sources.keys():
+            pieces |= self._sources[host].pieces(self.hasher.piece_bytes)
+        return pieces
+
+    async def _refetch_piece(self, piece: int) -> bool:
+        """Writes a fresh copy of a piece, from a mirror that did not write it when there is one. True when it differed"""
+        start = piece * self.hasher.piece_bytes
+        end = min(start + self.hasher.piece_bytes, self.size)
+        local = self.hasher.piece_crc(piece)
+        writers = {host for host, ranges in self._sources.items() if any(s < end and e > start for s, e in ranges.ranges)}
+        for mirror in sorted(self.mirrors.alive, key=lambda m: (m.host in writers, -m.speed)):
+            pos, crc = start, 0
+            try:
+                async with self._session.get(mirror.url, headers={"Range": f"bytes={start}-{end - 1}"}) as response:
+                    if response.status != 206:
+                        raise SegmentError(f"HTTP {response.status}", response.status)
+                    async for chunk in response.content.iter_chunked(CHUNK_BYTES):
+                        if self.limiter:
+                            await self.limiter.take(len(chunk))
+                        chunk = chunk[:end - pos]
+                        crc = zlib.crc32(chunk, crc)
+                        await self._writer.write(pos, chunk)
+                        pos += len(chunk)
+                        self.refetched += len(chunk)
+                        if pos >= end:
+                            break
+                if pos < end:
+                    raise SegmentError(f"Connection closed at byte {pos}")
+            except (aiohttp.ClientError, asyncio.TimeoutError, SegmentError) as e:
+                logger.warning(f"[DOWNLOAD] Piece {piece} of {self.path.name} from {mirror.host}: {type(e).__name__}: {e}")
+                continue
+            metrics.PIECES_REFETCHED.inc()
+            return crc != local
+        raise SegmentError(f"Piece {piece} of {self.path.name} could not be fetched again")
+
+    # CHECKPOINTS
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(CHECKPOINT_SECONDS)
+            await self._checkpoint()
+
+    async def _checkpoint(self):
+        if not self.ranged or not self._writer or self._writer.fd < 0:
+            return
+        done = [list(r) for r in self.done.ranges]
+        # Data first, then the claim that it is there
+        await self._writer.sync()
+        tmp = self.parts_path.with_name(self.parts_path.name + ".tmp")
+        tmp.write_text(json.dumps({"size": self.size, "etags": self.mirrors.etags, "done": done}), encoding="utf-8")
+        tmp.replace(self.parts_path)
+
+    async def _finish(self):
+        self.mirrors.save()
+        if not self._writer:
+            return
+        try:
+            if not self.complete:
+                await self._checkpoint()
+            else:
+                await self._writer.sync()
+        finally:
+            await self._writer.close()
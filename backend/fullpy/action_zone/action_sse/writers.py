@@ -0,0 +1,233 @@
+"""Writers of a download's temp file: positioned writes straight to disk, or staged through a bounded buffer pool"""
+import os
+import asyncio
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+from action_zone.action_sse import logger
+from action_zone.action_sse import metrics
+
+_seek_lock = threading.Lock()
+
+
+def pwrite(fd: int, data, offset: int):
+    """os.pwrite where it exists, seek + write under a lock elsewhere (Windows)"""
+    view = memoryview(data)
+    if hasattr(os, "pwrite"):
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view, offset = view[written:], offset + written
+        return
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while view:
+            view = view[os.write(fd, view):]
+
+
+def pread(fd: int, size: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+class FileWriter:
+    """Positioned writes into a preallocated temp file, off the event loop"""
+    tier = "direct"
+
+    def __init__(self, path: Path, size: Optional[int]):
+        self.path = path
+        self.size = size
+        self.fd = -1
+
+    async def open(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._open_sync)
+
+    def _open_sync(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        if self.size and os.fstat(self.fd).st_size != self.size:
+            os.ftruncate(self.fd, self.size)
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    # Real blocks up front: no ENOSPC halfway through, less fragmentation
+                    os.posix_fallocate(self.fd, 0, self.size)
+                except OSError as e:
+                    logger.warning(f"[DOWNLOAD] Could not preallocate {self.path}: {e}")
+
+    async def write(self, offset: int, data):
+        await asyncio.get_running_loop().run_in_executor(None, pwrite, self.fd, data, offset)
+
+    async def read(self, offset: int, size: int) -> bytes:
+        """Bytes already written, back from the page cache while they are still there"""
+        return await asyncio.get_running_loop().run_in_executor(None, pread, self.fd, size, offset)
+
+    async def sync(self):
+        await asyncio.get_running_loop().run_in_executor(None, os.fsync, self.fd)
+
+    async def close(self):
+        if self.fd >= 0:
+            fd, self.fd = self.fd, -1
+            await asyncio.get_running_loop().run_in_executor(None, os.close, fd)
+
+
+class _Buffer:
+    __slots__ = ('data', 'offset', 'fill')
+
+    def __init__(self, size: int):
+        self.data = bytearray(size)
+        self.offset = 0
+        self.fill = 0
+
+
+class WriteBehindWriter(FileWriter):
+    """
+    Same interface as FileWriter, but write() only copies the chunk into a
+    buffer from a pool of `buffers` reusable ones and returns; `flushers`
+    background tasks write full buffers to disk. Chunks that continue a
+    buffer's range are appended to it, so the disk sees `buffer_bytes`
+    writes whatever the network chunk size.
+
+    The network waits for the disk only when every buffer is taken, which
+    caps the memory of a download at `buffers * buffer_bytes`. A pool as
+    large as the file never waits: the whole model sits in RAM while the
+    disk catches up. sync() and close() flush everything first, so a
+    checkpoint never claims bytes that are still in memory.
+    """
+
+    def __init__(self, path: Path, size: Optional[int], buffers: int, buffer_bytes: int, flushers: int = 2):
+        super().__init__(path, size)
+        self.buffers = max(1, buffers)
+        self.buffer_bytes = buffer_bytes
+        self.flushers = max(1, flushers)
+        self.tier = "ram" if size and self.buffers * buffer_bytes >= size else "buffered"
+        self.stats = {"flushes": 0, "waits": 0, "evictions": 0}
+
+        self._allocated = 0
+        self._free: List[_Buffer] = []
+        self._returned = asyncio.Event()
+        self._dirty: asyncio.Queue = asyncio.Queue()
+        # BUFFERS BEING FILLED, KEYED BY THE OFFSET THEIR NEXT BYTE GOES TO, OLDEST FIRST
+        self._open: Dict[int, _Buffer] = {}
+        # FILLED OR BEING FILLED, NOT ON DISK YET
+        self._unflushed: Set[_Buffer] = set()
+        self._flushing = 0
+        self._waiting = 0
+        self._tasks: List[asyncio.Task] = []
+        self._error: Optional[BaseException] = None
+
+    async def open(self):
+        await super().open()
+        self._tasks = [asyncio.create_task(self._flush_loop()) for _ in range(self.flushers)]
+
+    async def write(self, offset: int, data):
+        self._raise()
+        view = memoryview(data)
+        while view:
+            buffer = self._open.pop(offset, None)
+            if buffer is None:
+                buffer = await self._acquire()
+                buffer.offset, buffer.fill = offset, 0
+                self._unflushed.add(buffer)
+            count = min(len(view), len(buffer.data) - buffer.fill)
+            buffer.data[buffer.fill:buffer.fill + count] = view[:count]
+            buffer.fill += count
+            offset += count
+            view = view[count:]
+            if buffer.fill == len(buffer.data):
+                self._flush(buffer)
+            else:
+                self._open[offset] = buffer
+
+    async def read(self, offset: int, size: int) -> bytes:
+        # Copy what is still in memory first: a buffer flushed meanwhile is on disk before the pread below
+        end = offset + size
+        staged = [(max(offset, b.offset), bytes(b.data[max(offset, b.offset) - b.offset:min(end, b.offset + b.fill) - b.offset]))
+                  for b in self._unflushed if b.offset < end and b.offset + b.fill > offset]
+        data = await super().read(offset, size)
+        if not staged:
+            return data
+        data = bytearray(data.ljust(size, b"\x00"))
+        for start, chunk in staged:
+            data[start - offset:start - offset + len(chunk)] = chunk
+        return data
+
+    async def sync(self):
+        await self._drain()
+        await super().sync()
+
+    async def close(self):
+        try:
+            if self.fd >= 0 and self._error is None:
+                await self._drain()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+            # Drop the pool: its memory goes back as soon as the download ends
+            metrics.DOWNLOAD_BUFFER_BYTES.dec(self._allocated * self.buffer_bytes)
+            self._allocated = 0
+            self._open.clear()
+            self._unflushed.clear()
+            self._free = []
+            await super().close()
+
+    async def _acquire(self) -> _Buffer:
+        if self._free:
+            return self._free.pop()
+        if self._allocated < self.buffers:
+            self._allocated += 1
+            metrics.DOWNLOAD_BUFFER_BYTES.inc(self.buffer_bytes)
+            return _Buffer(self.buffer_bytes)
+
+        # POOL EXHAUSTED: THE DISK IS BEHIND THE NETWORK, OR HALF-FILLED BUFFERS HOLD THE POOL
+        self.stats["waits"] += 1
+        metrics.WRITE_WAITS.inc()
+        self._waiting += 1
+        try:
+            while not self._free:
+                self._raise()
+                # One buffer on its way back per waiter: the oldest half-filled ones (tails of finished segments) go first
+                while self._flushing < self._waiting and self._open:
+                    self.stats["evictions"] += 1
+                    self._flush(self._open.pop(next(iter(self._open))))
+                self._returned.clear()
+                await self._returned.wait()
+            return self._free.pop()
+        finally:
+            self._waiting -= 1
+
+    def _flush(self, buffer: _Buffer):
+        self._flushing += 1
+        self._dirty.put_nowait(buffer)
+
+    async def _drain(self):
+        for buffer in self._open.values():
+            self._flush(buffer)
+        self._open.clear()
+        await self._dirty.join()
+        self._raise()
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            buffer = await self._dirty.get()
+            try:
+                if self._error is None:
+                    await loop.run_in_executor(None, pwrite, self.fd, memoryview(buffer.data)[:buffer.fill], buffer.offset)
+                    self.stats["flushes"] += 1
+            except Exception as e:
+                # Raised by the next write() or sync(): the download fails instead of losing bytes silently
+                logger.error(f"[DOWNLOAD] Write-behind to {self.path} failed: {e}")
+                self._error = e
+            finally:
+                self._unflushed.discard(buffer)
+                self._free.append(buffer)
+                self._flushing -= 1
+                self._returned.set()
+                self._dirty.task_done()
+
+    def _raise(self):
+        if self._error is not None:
+            raise self._error
@@ -17,6 +17,20 @@ MODEL_FORMATS = {
     "phi-3-mini-4k-instruct.Q4_K_M.gguf": "chatml"
 }
 
+def resolve_model(model_name: str) -> dict:
+    """Path and chat format of a model from the models directory"""
+    # PATH IS SIMILAR TO YOUR EXAMPLE
+    base_dir = Path(__file__).resolve().parent.parent.parent.parent.parent
+    model_path = str(base_dir / "llama.cpp" / "models" / model_name)
+    # GET THE CORRECT FORMAT
+    chat_format = MODEL_FORMATS.get(model_name, "chatml")
+
+    return {
+        "model_path": model_path,
+        "chat_format": chat_format,
+        "name_of_model": model_name
+    }
+
 def load_config():
     """Loads JSON configuration"""
     
@@ -31,21 +45,10 @@ def load_config():
         config = json.load(f)
     
     model_name = config.get("model_name")
-    name_of_model = config.get("model_name")
     if not model_name:
         raise ValueError("model_name not found in JSON")
-    
-    # PATH IS SIMILAR TO YOUR EXAMPLE
-    base_dir = Path(__file__).resolve().parent.parent.parent.parent.parent
-    model_path = str(base_dir / "llama.cpp" / "models" / model_name)    
-    # GET THE CORRECT FORMAT
-    chat_format = MODEL_FORMATS.get(model_name, "chatml")
-    
-    return {
-        "model_path": model_path,
-        "chat_format": chat_format,
-        "name_of_model": name_of_model
-    }
+
+    return resolve_model(model_name)
 
 # LOAD CONFIGURATION
 try:
@@ -59,5 +62,87 @@ except Exception as e:
 
 PROMPT_SYSTEM_PATH = Path("/dev/shm/prompt_system.txt")
 
+# SESSION KV-STATE CACHE
+KV_CACHE_RAM_BYTES = 2 * 1024**3
+KV_CACHE_DISK_BYTES = 8 * 1024**3
+KV_CACHE_DIR = Path(__file__).resolve().parents[3] / "cache" / "kv_state"
+
+# PROMPT SCHEDULER (ONE RUNNING PROMPT PER MODEL CONTEXT)
+SCHEDULER_CONCURRENCY = 1
+SCHEDULER_MAX_QUEUED = 32
+
+# TOKEN FRAMES: FLUSH EVERY N MS OR N TOKENS, WHICHEVER COMES FIRST
+FLUSH_INTERVAL_MS = 15
+FLUSH_MAX_TOKENS = 16
+
+# OUTBOUND BUFFER PER PROMPT: PAST N WAITING FRAMES NEW TOKENS MERGE INTO THE LAST ONE;
+# A CLIENT THAT TAKES NO FRAME FOR N SECONDS, OR LETS N BYTES PILE UP, IS DISCONNECTED
+SEND_QUEUE_MAX_FRAMES = 64
+SEND_QUEUE_MAX_BYTES = 4 * 1024**2
+SEND_STALL_SECONDS = 30
+
+# CONTEXT WINDOW: "oldest_first" OR "keep_first_user_turn"
+CONTEXT_DROP_POLICY = "oldest_first"
+
+# MODEL POOL: MODELS KEPT LOADED AND FREE RAM TO LEAVE AFTER A LOAD
+MODEL_POOL_MAX_MODELS = 2
+MODEL_POOL_RAM_RESERVE_BYTES = 2 * 1024**3
+MODEL_SWITCH_TIMEOUT = 120
+
+# SPECULATIVE DECODING: DRAFT MODEL FOR speculative_mode = "draft_model" (MUST SHARE THE TARGET VOCABULARY)
+SPECULATIVE_DRAFT_MODEL = "tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf"
+
+# SHARED PREFIX CACHE (PER MODEL): STATE BUDGET, SHORTEST PREFIX WORTH A SNAPSHOT,
+# AND TOKENS OF PROMPT HEADS REMEMBERED TO SPOT THE NEXT SHARED PREFIX
+PREFIX_CACHE_BYTES = 512 * 1024**2
+PREFIX_CACHE_MIN_TOKENS = 32
+PREFIX_CACHE_TREE_TOKENS = 256 * 1024
+
+# CONTINUOUS BATCHING (OPT-IN): CONCURRENT PROMPTS DECODED TOGETHER IN A SECOND CONTEXT WITH N SEQUENCES.
+# OFF (SLOTS < 2), PROMPTS RUN ONE AT A TIME ON THE MAIN CONTEXT WITH SESSION KV STATES, THE SHARED PREFIX CACHE,
+# SPECULATIVE DECODING AND MID-DECODE ABORT; BATCHED SEQUENCES HAVE NONE OF THESE. ON, EVERY SLOT GETS
+# CONTINUOUS_BATCHING_SLOT_CTX TOKENS AND THE MAIN CONTEXT SHRINKS TO CONTINUOUS_BATCHING_MAIN_CTX, WITHOUT A DRAFT
+CONTINUOUS_BATCHING_SLOTS = 1
+CONTINUOUS_BATCHING_SLOT_CTX = 8000
+CONTINUOUS_BATCHING_MAIN_CTX = 512
+
+# OFFLINE BATCH JOBS: MANIFESTS OF PENDING/RUNNING JOBS ARE RESUMED AT STARTUP
+BATCH_JOBS_DIR = Path(__file__).resolve().parents[3] / "cache" / "batch_jobs"
+# INPUT AND OUTPUT FILES OF BATCH JOBS: CLIENTS NAME THEM RELATIVE TO THIS DIRECTORY, NOTHING OUTSIDE IT IS READ OR WRITTEN
+BATCH_FILES_DIR = BATCH_JOBS_DIR / "files"
+
+# DURABLE SESSIONS: HISTORIES IN SQLITE, IDLE ONES EXPIRE AFTER THE TTL, OLDEST GO FIRST PAST THE SIZE CAP
+SESSION_STORE_PATH = Path(__file__).resolve().parents[3] / "cache" / "sessions.sqlite"
+SESSION_TTL_SECONDS = 7 * 24 * 3600
+SESSION_STORE_MAX_BYTES = 64 * 1024**2
+SESSION_GC_INTERVAL = 3600
+
+# RESPONSE CACHE (OPT-IN): ANSWERS OF DETERMINISTIC PROMPTS, LRU-EVICTED PAST THE SIZE CAP
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_DIR = Path(__file__).resolve().parents[3] / "cache" / "responses"
+RESPONSE_CACHE_BYTES = 256 * 1024**2
+
+# EMBEDDINGS: A GGUF EMBEDDING MODEL FROM THE MODELS DIRECTORY (E.G. nomic-embed-text-v1.5.Q8_0.gguf),
+# NONE EMBEDS WITH THE ACTIVE CHAT MODEL. TEXTS PACKED INTO ONE DECODE, UP TO N TOKENS / N SEQUENCES
+EMBEDDING_MODEL = None
+EMBEDDING_BATCH_TOKENS = 2048
+EMBEDDING_MAX_SEQUENCES = 32
+
+# LONG-TERM MEMORY (OPT-IN): TURNS BEFORE THE LAST N ARE NOT RESENT, THE TOP-K MOST SIMILAR MESSAGES ARE RECALLED
+MEMORY_ENABLED = False
+MEMORY_DIR = Path(__file__).resolve().parents[3] / "cache" / "memory"
+MEMORY_RECENT_TURNS = 4
+MEMORY_TOP_K = 4
+MEMORY_SNIPPET_CHARS = 1000
+
+# LOAD PARAMETERS: PROFILES FROM "python -m action_zone.action_ws.autotune <model>", PER MODEL AND MACHINE
+# (WITH AUTOTUNE_ON_FIRST_LOAD A MODEL WITHOUT A PROFILE IS TUNED BEFORE ITS FIRST LOAD)
+AUTOTUNE_PROFILES_PATH = Path(__file__).resolve().parents[3] / "cache" / "autotune_profiles.json"
+AUTOTUNE_ON_FIRST_LOAD = False
+
+# STARTUP: READ THE GGUF INTO THE PAGE CACHE BEFORE LOADING, ONE DECODE BEFORE REPORTING READY
+STARTUP_PREFETCH = True
+STARTUP_WARMUP = True
+
 # PORTS
 FALLBACK_PORTS_WEBSOCKET = [8765, 8766, 8767, 8768, 8769, 8770, 8771, 8772]
@@ -0,0 +1,69 @@
+"""Abort flag for llama_decode, polled by ggml between graph nodes"""
+import sys
+import ctypes
+import threading
+from typing import Any, Optional
+import llama_cpp
+
+
+def _native_callback() -> Optional["llama_cpp.ggml_abort_callback"]:
+    # strlen(data) != 0 is exactly "is the flag byte set": the byte after it is always NUL
+    try:
+        libc = ctypes.cdll.msvcrt if sys.platform == "win32" else ctypes.CDLL(None)
+        return llama_cpp.ggml_abort_callback(ctypes.cast(libc.strlen, ctypes.c_void_p).value)
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+@llama_cpp.ggml_abort_callback
+def _read_flag(data: int) -> bool:
+    # Fallback without libc: takes the GIL at every graph node
+    return bool(data) and ctypes.c_bool.from_address(data).value
+
+
+# ONE CALLBACK FOR EVERY CONTEXT: IT ONLY READS THE BYTE IT IS GIVEN
+ABORT_CALLBACK = _native_callback() or _read_flag
+
+
+class AbortFlag:
+    """
+    One byte that makes llama_decode return 2 at the next graph node.
+    ggml's CPU backend calls the abort callback after every node, thousands
+    of times per decode; a Python callback would take the GIL each time and
+    queue behind the event loop, so the callback is libc's strlen over the
+    byte (the buffer keeps a NUL after it) when the platform has one.
+
+    The flag is armed for an owner (a prompt, a batch step) and only that
+    owner can set it: a cancel that arrives after its decode ended never
+    aborts the next one.
+    """
+
+    def __init__(self):
+        self._buffer = ctypes.create_string_buffer(2)
+        self._data = ctypes.cast(self._buffer, ctypes.c_void_p)
+        self._lock = threading.Lock()
+        self.owner: Any = None
+
+    def attach(self, ctx):
+        """Installs the callback on a llama_context pointer"""
+        llama_cpp.llama_set_abort_callback(ctx, ABORT_CALLBACK, self._data)
+
+    def arm(self, owner: Any):
+        with self._lock:
+            self.owner = owner
+            self._buffer[0] = b"\x00"
+
+    def disarm(self):
+        with self._lock:
+            self.owner = None
+            self._buffer[0] = b"\x00"
+
+    def abort(self, owner: Any) -> bool:
+        with self._lock:
+            if owner is None or self.owner != owner:
+                return False
+            self._buffer[0] = b"\x01"
+            return True
+
+    def is_set(self) -> bool:
+        return self._buffer[0] != b"\x00"
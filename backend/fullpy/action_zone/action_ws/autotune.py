@@ -0,0 +1,256 @@
+"""Load parameters tuned to this machine: threads, batch size, mlock/mmap and GPU offload"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+import psutil
+import llama_cpp
+from llama_cpp import Llama, _internals
+from action_zone.action_ws import logger, resolve_model, AUTOTUNE_PROFILES_PATH
+
+# RAM LEFT FOR THE KV CACHE, THE OS AND THE APP WHEN THE WEIGHTS ARE LOCKED
+MLOCK_HEADROOM_BYTES = 2 * 1024**3
+BATCH_CANDIDATES = (256, 512, 1024)
+# PROMPT TOKENS EVALUATED BEFORE THE TIMED DECODE RUN
+DECODE_PROMPT_TOKENS = 32
+
+
+def machine_info() -> Dict[str, object]:
+    """What the profile depends on; a profile tuned elsewhere is not reused"""
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    return {
+        "cpu": cpu,
+        "physical_cores": psutil.cpu_count(logical=False) or psutil.cpu_count() or 1,
+        "logical_cores": psutil.cpu_count() or 1,
+        "ram_gb": round(psutil.virtual_memory().total / 1024**3),
+        "gpu_offload": bool(llama_cpp.llama_supports_gpu_offload()),
+    }
+
+
+def machine_key(info: Dict[str, object]) -> str:
+    return f"{info['cpu']}|{info['physical_cores']}c{info['logical_cores']}t|{info['ram_gb']}gb|{'gpu' if info['gpu_offload'] else 'cpu'}"
+
+
+def mlock_limit() -> Optional[int]:
+    """RLIMIT_MEMLOCK in bytes, None when unlimited or unknown (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
+def memory_policy(model_path: str, gpu_offload: bool) -> Dict[str, object]:
+    """
+    Decided at every load from the RAM free right now:
+    - GPU: all layers offloaded, nothing to lock on the host.
+    - CPU: lock the weights only when they fit next to the headroom and under
+      RLIMIT_MEMLOCK; otherwise locking fails or pushes everything else to swap.
+    mmap stays on: without mlock the kernel can page weights back in instead of failing.
+    """
+    model_bytes = os.path.getsize(model_path)
+    available = psutil.virtual_memory().available
+    limit = mlock_limit()
+    use_mlock = (
+        not gpu_offload
+        and model_bytes + MLOCK_HEADROOM_BYTES < available
+        and (limit is None or limit >= model_bytes)
+    )
+    if model_bytes > available:
+        logger.warning(f"[AUTOTUNE] {Path(model_path).name} ({model_bytes / 1024**3:.1f} GB) exceeds free RAM "
+                       f"({available / 1024**3:.1f} GB), weights will be paged from disk")
+    return {"n_gpu_layers": -1 if gpu_offload else 0, "use_mlock": use_mlock, "use_mmap": True}
+
+
+def memory_kwargs(model_path: str) -> Dict[str, object]:
+    """memory_policy() for this machine: every model the process loads goes through it"""
+    return memory_policy(model_path, bool(llama_cpp.llama_supports_gpu_offload()))
+
+
+def thread_candidates(info: Dict[str, object]) -> List[int]:
+    physical, logical = info["physical_cores"], info["logical_cores"]
+    return sorted({max(1, physical // 2), max(1, physical - 1), physical, logical})
+
+
+class ProfileStore:
+    """Tuned profiles in one JSON file, keyed by model name and machine"""
+
+    def __init__(self, path: Path = AUTOTUNE_PROFILES_PATH):
+        self.path = Path(path)
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, model_name: str, model_path: str) -> Optional[dict]:
+        profile = self._read().get(f"{model_name}@{machine_key(machine_info())}")
+        # A RE-DOWNLOADED FILE OF ANOTHER SIZE (OTHER QUANT) IS TUNED AGAIN
+        if profile and profile.get("model_bytes") == os.path.getsize(model_path):
+            return profile
+        return None
+
+    def put(self, model_name: str, profile: dict):
+        profiles = self._read()
+        profiles[f"{model_name}@{profile['machine_key']}"] = profile
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(profiles, indent=2), encoding="utf-8")
+        tmp.replace(self.path)
+
+
+def _context(llm: Llama, n_ctx: int, n_batch: int, n_threads: int) -> "_internals.LlamaContext":
+    params = llama_cpp.llama_context_default_params()
+    params.n_ctx = n_ctx
+    params.n_batch = n_batch
+    params.n_ubatch = n_batch
+    params.n_threads = n_threads
+    params.n_threads_batch = n_threads
+    return _internals.LlamaContext(model=llm._model, params=params, verbose=False)
+
+
+def _decode(ctx: "_internals.LlamaContext", batch: "_internals.LlamaBatch", tokens: List[int], start: int, n_batch: int):
+    for offset in range(0, len(tokens), n_batch):
+        chunk = tokens[offset:offset + n_batch]
+        batch.batch.n_tokens = 0
+        for i, token in enumerate(chunk):
+            batch.batch.token[i] = token
+            batch.batch.pos[i] = start + offset + i
+            batch.batch.seq_id[i][0] = 0
+            batch.batch.n_seq_id[i] = 1
+            batch.batch.logits[i] = i == len(chunk) - 1
+        batch.batch.n_tokens = len(chunk)
+        if llama_cpp.llama_decode(ctx.ctx, batch.batch) != 0:
+            raise RuntimeError("llama_decode failed during the benchmark")
+
+
+def check_lengths(prefill_tokens: int, decode_tokens: int) -> Optional[str]:
+    """Why a benchmark of these lengths cannot run, None when it can"""
+    if decode_tokens < 1:
+        return "decode must be at least 1 token"
+    # The prefill must fit the smallest batch candidate and hold the decode prompt and tokens
+    needed = max(min(BATCH_CANDIDATES), DECODE_PROMPT_TOKENS + decode_tokens)
+    if prefill_tokens < needed:
+        return f"prefill must be at least {needed} tokens with decode {decode_tokens}"
+    return None
+
+
+def tune(model_name: str, model_path: str, prefill_tokens: int = 512, decode_tokens: int = 32) -> dict:
+    """
+    Loads the weights once, then times a prefill for each (n_batch, batch threads)
+    pair and a decode for each thread count, on contexts created over those
+    weights. The fastest values make the profile, which is saved and returned.
+    """
+    problem = check_lengths(prefill_tokens, decode_tokens)
+    if problem:
+        raise ValueError(problem)
+    info = machine_info()
+    policy = memory_policy(model_path, info["gpu_offload"])
+    threads = thread_candidates(info)
+    start = time.perf_counter()
+    logger.info(f"[AUTOTUNE] Tuning {model_name}: threads {threads}, n_batch {list(BATCH_CANDIDATES)}")
+
+    llm = Llama(model_path=model_path, n_ctx=512, n_gpu_layers=policy["n_gpu_layers"], use_mmap=True, verbose=False)
+    rng = np.random.default_rng(0)
+    n_vocab = llm.n_vocab()
+    prompt = [llm.token_bos()] + rng.integers(3, n_vocab, prefill_tokens - 1).tolist()
+    n_ctx = prefill_tokens + decode_tokens + 8
+
+    # PREFILL: BATCH SIZE x BATCH THREADS
+    prefill = []
+    for n_batch in BATCH_CANDIDATES:
+        if n_batch > prefill_tokens:
+            continue
+        ctx = _context(llm, n_ctx, n_batch, max(threads))
+        batch = _internals.LlamaBatch(n_tokens=n_batch, embd=0, n_seq_max=1, verbose=False)
+        # FIRST PASS PAGES THE WEIGHTS IN, NOT TIMED
+        _decode(ctx, batch, prompt[:n_batch], 0, n_batch)
+        for n_threads in threads:
+            llama_cpp.llama_set_n_threads(ctx.ctx, n_threads, n_threads)
+            llama_cpp.llama_memory_clear(ctx.memory, True)
+            t = time.perf_counter()
+            _decode(ctx, batch, prompt, 0, n_batch)
+            prefill.append((prefill_tokens / (time.perf_counter() - t), n_batch, n_threads))
+        batch.close()
+        ctx.close()
+    prefill_tps, best_batch, best_batch_threads = max(prefill)
+
+    # DECODE: ONE TOKEN AT A TIME AFTER A SHORT PROMPT, PER THREAD COUNT
+    decode = []
+    ctx = _context(llm, n_ctx, best_batch, best_batch_threads)
+    batch = _internals.LlamaBatch(n_tokens=best_batch, embd=0, n_seq_max=1, verbose=False)
+    for n_threads in threads:
+        llama_cpp.llama_set_n_threads(ctx.ctx, n_threads, best_batch_threads)
+        llama_cpp.llama_memory_clear(ctx.memory, True)
+        _decode(ctx, batch, prompt[:DECODE_PROMPT_TOKENS], 0, best_batch)
+        t = time.perf_counter()
+        for i in range(decode_tokens):
+            position = DECODE_PROMPT_TOKENS + i
+            _decode(ctx, batch, [prompt[position]], position, best_batch)
+        decode.append((decode_tokens / (time.perf_counter() - t), n_threads))
+    batch.close()
+    ctx.close()
+    llm.close()
+    decode_tps, best_threads = max(decode)
+
+    profile = {
+        "n_threads": best_threads,
+        "n_threads_batch": best_batch_threads,
+        "n_batch": best_batch,
+        # Measured with n_ubatch = n_batch: Llama() would otherwise keep its default of 512
+        "n_ubatch": best_batch,
+        "prefill_tokens_per_s": round(prefill_tps, 1),
+        "decode_tokens_per_s": round(decode_tps, 2),
+        "model_bytes": os.path.getsize(model_path),
+        "machine": info,
+        "machine_key": machine_key(info),
+        "tuned_at": time.time(),
+        "tune_seconds": round(time.perf_counter() - start, 1),
+    }
+    ProfileStore().put(model_name, profile)
+    logger.info(f"[AUTOTUNE] {model_name}: {profile}")
+    return profile
+
+
+def load_kwargs(model_name: str, model_path: str, tune_if_missing: bool = False) -> dict:
+    """Llama() keyword arguments: the saved profile (if any) plus the memory policy for the RAM free now"""
+    profile = ProfileStore().get(model_name, model_path)
+    if profile is None and tune_if_missing:
+        try:
+            profile = tune(model_name, model_path)
+        except Exception as e:
+            logger.error(f"[AUTOTUNE] Tuning {model_name} failed, loading with defaults: {e}")
+
+    kwargs = memory_kwargs(model_path)
+    if profile:
+        kwargs.update(n_threads=profile["n_threads"], n_threads_batch=profile["n_threads_batch"], n_batch=profile["n_batch"],
+                      n_ubatch=profile.get("n_ubatch", profile["n_batch"]))
+    return kwargs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks load parameters for a model and saves the best profile")
+    parser.add_argument("model", help="Model file name in the models directory")
+    parser.add_argument("--prefill", type=int, default=512, help="Prompt tokens per prefill run")
+    parser.add_argument("--decode", type=int, default=32, help="Tokens per decode run")
+    args = parser.parse_args()
+    problem = check_lengths(args.prefill, args.decode)
+    if problem:
+        parser.error(problem)
+
+    path = resolve_model(args.model)["model_path"]
+    if not os.path.exists(path):
+        sys.exit(f"Model not found: {path}")
+    print(json.dumps(tune(args.model, path, args.prefill, args.decode), indent=2))
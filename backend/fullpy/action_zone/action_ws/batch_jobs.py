@@ -0,0 +1,345 @@
+"""Offline batch jobs: a JSONL file of prompts in, a JSONL file of results out"""
+import os
+import json
+import time
+import uuid
+import asyncio
+from pathlib import Path
+from contextlib import closing
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from action_zone.action_ws import logger
+from action_zone.action_ws.scheduler import PromptJob, QueueFull
+from action_zone.action_ws.prefix_cache import PrefixStateCache
+
+# MANIFEST STATUSES
+PENDING, RUNNING, COMPLETED, CANCELED, FAILED = "pending", "running", "completed", "canceled", "failed"
+
+
+class BatchJob:
+    """
+    One job. Input lines are {"id"?, "prompt" | "messages", "system"?, "max_tokens"?}.
+    The manifest and the output file are the whole state: on restart the ids
+    already in the output are skipped, so a crash loses at most the item in flight.
+    """
+
+    def __init__(self, job_id: str, input_path: str, output_path: str,
+                 system_prompt: Optional[str] = None, max_tokens: Optional[int] = None,
+                 status: str = PENDING, created_at: Optional[float] = None, error: Optional[str] = None):
+        self.job_id = job_id
+        self.input_path = Path(input_path)
+        self.output_path = Path(output_path)
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.status = status
+        self.created_at = created_at or time.time()
+        self.error = error
+
+        # PROGRESS, REBUILT FROM THE OUTPUT FILE ON RESUME
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.started_at = 0.0
+        self.done_at_start = 0
+        self.tokens_at_start = 0
+        self.canceled = False
+
+    # MANIFEST
+    def to_manifest(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "input_path": str(self.input_path),
+            "output_path": str(self.output_path),
+            "system_prompt": self.system_prompt,
+            "max_tokens": self.max_tokens,
+            "status": self.status,
+            "created_at": self.created_at,
+            "error": self.error,
+        }
+
+    @classmethod
+    def load(cls, manifest_path: Path) -> "BatchJob":
+        return cls(**json.loads(manifest_path.read_text(encoding="utf-8")))
+
+    def save(self, jobs_dir: Path):
+        # WRITE THEN RENAME, A CRASH NEVER LEAVES HALF A MANIFEST
+        jobs_dir.mkdir(parents=True, exist_ok=True)
+        tmp = jobs_dir / f"{self.job_id}.json.tmp"
+        tmp.write_text(json.dumps(self.to_manifest(), indent=2), encoding="utf-8")
+        tmp.replace(jobs_dir / f"{self.job_id}.json")
+
+    # INPUT / OUTPUT
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        with open(self.input_path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError as e:
+                    item = {"error": f"Invalid JSON: {e}"}
+                if not isinstance(item, dict):
+                    item = {"error": "Line is not a JSON object"}
+                yield str(item.get("id", line_no)), item
+
+    def count_items(self) -> int:
+        return sum(1 for _ in self.items())
+
+    def scan_output(self) -> Set[str]:
+        """Ids already written. Drops a last line cut short by a crash and rebuilds the counters"""
+        done: Set[str] = set()
+        if not self.output_path.exists():
+            return done
+
+        with open(self.output_path, "rb+") as f:
+            data = f.read()
+            complete = data[:data.rfind(b"\n") + 1]
+            if len(complete) != len(data):
+                f.truncate(len(complete))
+                logger.warning(f"[BATCH] {self.job_id}: dropped a partial line at the end of {self.output_path}")
+
+        for line in complete.decode("utf-8").splitlines():
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done.add(str(result.get("id")))
+            if "error" in result:
+                self.failed += 1
+            self.prompt_tokens += result.get("prompt_tokens", 0)
+            self.completion_tokens += result.get("completion_tokens", 0)
+        self.done = len(done)
+        return done
+
+    def messages(self, item: dict) -> List[dict]:
+        if "messages" in item:
+            return item["messages"]
+        if not isinstance(item.get("prompt"), str) or not item["prompt"].strip():
+            raise ValueError("Item has no prompt")
+        system = item.get("system") or self.system_prompt
+        return ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": item["prompt"]}]
+
+    # REPORT
+    def report(self) -> dict:
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        processed = self.done - self.done_at_start
+        items_per_s = processed / elapsed if elapsed else 0.0
+        return {
+            "jobId": self.job_id,
+            "status": self.status,
+            "input": str(self.input_path),
+            "output": str(self.output_path),
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "progress": round(self.done / self.total * 100, 1) if self.total else 0.0,
+            "elapsed_seconds": round(elapsed, 1),
+            "items_per_s": round(items_per_s, 3),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "completion_tokens_per_s": round((self.completion_tokens - self.tokens_at_start) / elapsed, 1) if elapsed else 0.0,
+            "eta_seconds": round((self.total - self.done) / items_per_s) if items_per_s else None,
+            "error": self.error,
+        }
+
+
+class BatchRunner:
+    """
+    Runs batch jobs on the server's loaded model. Each item goes through the
+    prompt scheduler under its own "batch:<job>" session, so the round-robin
+    interleaves it with interactive prompts instead of starving them. Items
+    run without token streaming and without a session KV state to save
+    (through the continuous batcher when it is enabled).
+
+    Clients name their input and output files relative to `files_dir`:
+    anything that resolves outside of it is rejected, so a client never
+    reads or appends to a file of the host.
+    """
+
+    def __init__(self, server, jobs_dir: Path, files_dir: Path):
+        self.server = server
+        self.jobs_dir = jobs_dir
+        self.files_dir = files_dir
+        self.jobs: Dict[str, BatchJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, input_path: str, output_path: Optional[str] = None,
+               system_prompt: Optional[str] = None, max_tokens: Optional[int] = None) -> BatchJob:
+        source = self.job_file(input_path, "Input")
+        if not source.is_file():
+            raise FileNotFoundError(f"Input not found: {input_path}")
+        target = self.job_file(output_path, "Output") if output_path else source.with_suffix(".out.jsonl")
+        if target == source:
+            raise ValueError("Output must differ from the input")
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        job = BatchJob(uuid.uuid4().hex[:12], str(source), str(target), system_prompt, max_tokens)
+        job.save(self.jobs_dir)
+        self._start(job)
+        return job
+
+    def job_file(self, name: str, what: str = "File") -> Path:
+        """`name` resolved under files_dir; ValueError for absolute paths and anything that escapes it"""
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError(f"{what} must be a file name")
+        if Path(name).is_absolute() or Path(name).drive:
+            raise ValueError(f"{what} must be relative to the batch files directory")
+        root = self.files_dir.resolve()
+        # resolve() follows symlinks too: a link pointing out of the directory is rejected like "../"
+        path = (root / name).resolve()
+        if path == root or not path.is_relative_to(root):
+            raise ValueError(f"{what} is outside the batch files directory")
+        return path
+
+    def _confined(self, job: BatchJob) -> bool:
+        root = self.files_dir.resolve()
+        return all(p.resolve().is_relative_to(root) for p in (job.input_path, job.output_path))
+
+    def resume(self):
+        """Restarts the jobs a previous process left pending or running"""
+        if not self.jobs_dir.exists():
+            return
+        for manifest in sorted(self.jobs_dir.glob("*.json")):
+            try:
+                job = BatchJob.load(manifest)
+            except Exception as e:
+                logger.error(f"[BATCH] Unreadable manifest {manifest}: {e}")
+                continue
+            if job.status in (PENDING, RUNNING) and not self._confined(job):
+                # Left by a version that took any path from the client
+                job.status, job.error = FAILED, "Input or output outside the batch files directory"
+                job.save(self.jobs_dir)
+                logger.warning(f"[BATCH] Not resuming job {job.job_id}: {job.error}")
+            if job.status in (PENDING, RUNNING):
+                logger.info(f"[BATCH] Resuming job {job.job_id}")
+                self._start(job)
+            else:
+                self.jobs[job.job_id] = job
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if not job or job.status not in (PENDING, RUNNING):
+            return False
+        # THE ITEM IN FLIGHT FINISHES AND IS WRITTEN, NOTHING AFTER IT STARTS
+        job.canceled = True
+        return True
+
+    def status(self, job_id: Optional[str] = None) -> List[dict]:
+        if job_id:
+            return [self.jobs[job_id].report()] if job_id in self.jobs else []
+        return [job.report() for job in self.jobs.values()]
+
+    def _start(self, job: BatchJob):
+        self.jobs[job.job_id] = job
+        self._tasks[job.job_id] = asyncio.create_task(self._run_job(job))
+
+    async def _run_job(self, job: BatchJob):
+        loop = asyncio.get_running_loop()
+        try:
+            done = await loop.run_in_executor(None, job.scan_output)
+            job.total = await loop.run_in_executor(None, job.count_items)
+            job.done_at_start = job.done
+            job.tokens_at_start = job.completion_tokens
+            job.started_at = time.time()
+            job.status = RUNNING
+            job.save(self.jobs_dir)
+            logger.info(f"[BATCH] Job {job.job_id} started: {job.total} items, {job.done} already done")
+
+            with closing(job.items()) as items, open(job.output_path, "a", encoding="utf-8") as out:
+                while not job.canceled:
+                    # Lines are read on a worker thread: a slow disk never blocks the event loop
+                    entry = await loop.run_in_executor(None, next, items, None)
+                    if entry is None:
+                        break
+                    item_id, item = entry
+                    if item_id in done:
+                        continue
+                    result = await self._run_item(job, item_id, item)
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+
+                    done.add(item_id)
+                    job.done += 1
+                    job.failed += "error" in result
+                    job.prompt_tokens += result.get("prompt_tokens", 0)
+                    job.completion_tokens += result.get("completion_tokens", 0)
+                os.fsync(out.fileno())
+
+            job.status = CANCELED if job.canceled else COMPLETED
+        except asyncio.CancelledError:
+            # SERVER SHUTDOWN: THE MANIFEST STAYS "running" SO THE JOB RESUMES
+            raise
+        except Exception as e:
+            job.status, job.error = FAILED, str(e)
+            logger.error(f"[BATCH] Job {job.job_id} failed: {type(e).__name__}: {e}")
+        finally:
+            self._tasks.pop(job.job_id, None)
+
+        job.save(self.jobs_dir)
+        logger.info(f"[BATCH] Job {job.job_id} {job.status}: {job.report()}")
+
+    async def _run_item(self, job: BatchJob, item_id: str, item: dict) -> dict:
+        if "error" in item:
+            return {"id": item_id, "error": item["error"]}
+        try:
+            messages = job.messages(item)
+        except ValueError as e:
+            return {"id": item_id, "error": str(e)}
+
+        params = self.server.sampling
+        max_tokens = item.get("max_tokens") or job.max_tokens or params.tokens
+        finished: asyncio.Future = asyncio.get_running_loop().create_future()
+
+        async def run():
+            try:
+                if self.server.batcher:
+                    result = await self.server.batcher.complete(messages, max_tokens, params)
+                else:
+                    result = await self.server.engine.run(self._complete_sync, messages, max_tokens, params)
+            except Exception as e:
+                if not finished.done():
+                    finished.set_exception(e)
+                return
+            # THE JOB TASK MAY HAVE BEEN CANCELLED (SHUTDOWN) WHILE THE ITEM RAN
+            if not finished.done():
+                finished.set_result(result)
+
+        prompt_job = PromptJob(f"batch-{job.job_id}-{item_id}", f"batch:{job.job_id}", run=run)
+        while True:
+            try:
+                self.server.scheduler.submit(prompt_job)
+                break
+            except QueueFull:
+                # INTERACTIVE PROMPTS FILLED THE QUEUE, WAIT FOR ROOM
+                await asyncio.sleep(1)
+
+        try:
+            response, seconds = await finished
+        except Exception as e:
+            return {"id": item_id, "error": f"{type(e).__name__}: {e}"}
+
+        choice = response["choices"][0]
+        usage = response.get("usage") or {}
+        return {
+            "id": item_id,
+            "output": choice["message"].get("content") or "",
+            "finish_reason": choice.get("finish_reason"),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "seconds": round(seconds, 3),
+        }
+
+    def _complete_sync(self, messages: List[dict], max_tokens: int, params) -> Tuple[dict, float]:
+        # Runs on the decode thread, one full completion without streaming
+        llm = self.server.llm
+        start = time.perf_counter()
+        response = llm.create_chat_completion(messages, max_tokens=max_tokens, stream=False, **params.completion_kwargs())
+        seconds = time.perf_counter() - start
+
+        # Items of one job usually share their instructions: keep that prefix for the next ones
+        if isinstance(llm.cache, PrefixStateCache):
+            llm.cache.pop_last_state()
+            llm.cache.materialize(llm)
+        return response, seconds
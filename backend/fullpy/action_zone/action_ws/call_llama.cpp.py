@@ -1,151 +1,581 @@
+import os
 import time
 import json
 import uuid
 import asyncio
+import threading
 import websockets
-from llama_cpp import Llama, LlamaCache
-from typing import List, Dict, Optional, Set
+from pathlib import Path
+from llama_cpp import Llama
+from urllib.parse import urlparse, parse_qs
+from typing import Iterator, List, Dict, Optional, Set, Tuple
 from get_prompt_system import get_prompt_system
 from websockets.exceptions import ConnectionClosedOK
 from action_zone.action_sqlite.control_config import ControlConfig
-from action_zone.action_ws import MODEL_PATH, CHAT_FORMAT, logger, FALLBACK_PORTS_WEBSOCKET, NAME_OF_MODEL, PROMPT_SYSTEM_PATH
+from action_zone.action_ws.kv_cache import SessionStateCache
+from action_zone.action_ws.scheduler import PromptScheduler, PromptJob, QueueFull
+from action_zone.action_ws.engine import GenerationEngine, GenerationError
+from action_zone.action_ws.context_window import ContextWindow
+from action_zone.action_ws.model_pool import ModelPool
+from action_zone.action_ws.live_config import SamplingParams
+from action_zone.action_ws.prefix_cache import PrefixStateCache
+from action_zone.action_ws.speculative import CountingDraft, SpeculativeStats, build_draft_model
+from action_zone.action_ws.batch_jobs import BatchRunner
+from action_zone.action_ws.continuous_batching import ContinuousBatcher, BatchRequest
+from action_zone.action_ws.abort import AbortFlag
+from action_zone.action_ws.outbox import Outbox
+from action_zone.action_ws.session_store import SessionStore
+from action_zone.action_ws.response_cache import ResponseCache
+from action_zone.action_ws.embeddings import Embedder
+from action_zone.action_ws.memory_index import MemoryIndex
+from action_zone.action_ws import autotune
+from action_zone.action_ws.startup import Startup, prefetch
+from action_zone.action_ws import metrics
+from action_zone.utils.metrics import monitor_event_loop_lag
+from action_zone.action_ws import resolve_model, MODEL_PATH, logger, FALLBACK_PORTS_WEBSOCKET, NAME_OF_MODEL, PROMPT_SYSTEM_PATH
+from action_zone.action_ws import KV_CACHE_RAM_BYTES, KV_CACHE_DISK_BYTES, KV_CACHE_DIR, SCHEDULER_CONCURRENCY, SCHEDULER_MAX_QUEUED
+from action_zone.action_ws import FLUSH_INTERVAL_MS, FLUSH_MAX_TOKENS, CONTEXT_DROP_POLICY
+from action_zone.action_ws import MODEL_POOL_MAX_MODELS, MODEL_POOL_RAM_RESERVE_BYTES, SPECULATIVE_DRAFT_MODEL
+from action_zone.action_ws import PREFIX_CACHE_BYTES, PREFIX_CACHE_MIN_TOKENS, PREFIX_CACHE_TREE_TOKENS, BATCH_JOBS_DIR, BATCH_FILES_DIR
+from action_zone.action_ws import CONTINUOUS_BATCHING_SLOTS, CONTINUOUS_BATCHING_SLOT_CTX, CONTINUOUS_BATCHING_MAIN_CTX
+from action_zone.action_ws import SESSION_STORE_PATH, SESSION_TTL_SECONDS, SESSION_STORE_MAX_BYTES, SESSION_GC_INTERVAL
+from action_zone.action_ws import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_DIR, RESPONSE_CACHE_BYTES
+from action_zone.action_ws import EMBEDDING_MODEL, EMBEDDING_BATCH_TOKENS, EMBEDDING_MAX_SEQUENCES, MEMORY_ENABLED, MEMORY_DIR
+from action_zone.action_ws import MEMORY_RECENT_TURNS, MEMORY_TOP_K, MEMORY_SNIPPET_CHARS, AUTOTUNE_ON_FIRST_LOAD
+from action_zone.action_ws import STARTUP_PREFETCH, STARTUP_WARMUP
+from action_zone.action_ws import SEND_QUEUE_MAX_FRAMES, SEND_QUEUE_MAX_BYTES, SEND_STALL_SECONDS
 
 CONTEXT_SIZE = 8000
 
 
 class LlamaChatServer:
-    # Cache for dynamic configuration
-    _config_cache = None
-    _cache_time = 0
-
-    @classmethod
-    def get_config(cls):
-        now = time.time()
-        if not cls._config_cache or (now - cls._cache_time) > 5:
-            cls._config_cache = ControlConfig({"id_model": NAME_OF_MODEL}).get()
-            cls._cache_time = now
-        return cls._config_cache
-
-    def __init__(self, model_path: str, system_prompt: Optional[str] = None):
-        # Default LLM parameters
-        self.temperature = 0.7
-        self.top_p = 0.9
-        self.top_k = 40
-        self.tokens = 512
-        self.repeat_penalty = 1.1
-        self.frequency_penalty = 0.0
-        self.presence_penalty = 0.0
-        self.min_p = 0.05
-        self.tfs_z = 1.0
-        self.mirostat_tau = 5.0
-        self.seed = None
-        self.stop = None
-
-        # Initialize LLaMA model
-        self.llm = Llama(
-            model_path=model_path,
-            n_ctx=CONTEXT_SIZE,
-            n_gpu_layers=-1,
-            seed=self.seed,
-            verbose=False,
-            chat_format=CHAT_FORMAT,
-            use_mlock=True,
-            use_mmap=True
-        )
-        self.llm.set_cache(LlamaCache())
+    def __init__(self, model_name: str = NAME_OF_MODEL, system_prompt: Optional[str] = None):
+        # Sampling snapshot, replaced (never mutated) when the config is pushed
+        self.sampling = SamplingParams.load(model_name)
+
+        # Initialize LLaMA model through the pool so later switches are hot
+        self.model_name = model_name
+        self.speculative_stats = SpeculativeStats()
+        # SET BY A CANCEL, STOPS THE MAIN CONTEXT'S llama_decode AT THE NEXT GRAPH NODE
+        self.abort = AbortFlag()
+        self.pool = ModelPool(self._create_llm, MODEL_POOL_MAX_MODELS, MODEL_POOL_RAM_RESERVE_BYTES)
+        self.llm = self.pool.activate(model_name)
+        # ONE KV STATE PER SESSION INSTEAD OF A GLOBAL PREFIX CACHE
+        self.kv_cache = SessionStateCache(KV_CACHE_RAM_BYTES, KV_CACHE_DISK_BYTES, KV_CACHE_DIR, model_name)
+        # HISTORIES OUTLIVE THE CONNECTION: A CLIENT RECONNECTS WITH ITS sessionId
+        self.sessions = SessionStore(SESSION_STORE_PATH, SESSION_TTL_SECONDS, SESSION_STORE_MAX_BYTES)
+        self.connections: Dict[str, int] = {}
+
+        self.batcher = self._create_batcher()
+        # OPT-IN: ANSWERS OF DETERMINISTIC PROMPTS (SEED SET OR TEMPERATURE 0) ARE REPLAYED
+        self.response_cache = ResponseCache(RESPONSE_CACHE_DIR, RESPONSE_CACHE_BYTES) if RESPONSE_CACHE_ENABLED else None
+        self.model_fingerprint = ResponseCache.fingerprint(getattr(self.llm, "model_path", model_name))
+        # EMBEDDING CONTEXT CREATED ON FIRST USE; OLDER TURNS ARE RECALLED BY SIMILARITY WHEN MEMORY IS ON
+        self.embedder: Optional[Embedder] = None
+        self.embedding_fingerprint = ""
+        self._embedder_lock = threading.Lock()
+        self.memory = MemoryIndex(MEMORY_DIR)
 
         self.active_prompts: Set[str] = set()
-        self.session_history: Dict[str, List[Dict[str, str]]] = {}
+        # WHO TO STOP ON A CANCEL OR A DISCONNECT
+        self.prompt_owners: Dict[str, websockets.WebSocketServerProtocol] = {}
+        self.batch_requests: Dict[str, BatchRequest] = {}
+        self.canceled_at: Dict[str, float] = {}
+        # OUTBOUND BUFFERS OF THE PROMPTS EACH CONNECTION IS RECEIVING
+        self.outboxes: Dict[websockets.WebSocketServerProtocol, Set[Outbox]] = {}
+        # WITH BATCHING, ONE RUNNING PROMPT PER SLOT
+        concurrency = CONTINUOUS_BATCHING_SLOTS if self.batcher else SCHEDULER_CONCURRENCY
+        self.scheduler = PromptScheduler(concurrency, SCHEDULER_MAX_QUEUED)
+        self.engine = GenerationEngine(FLUSH_INTERVAL_MS / 1000, FLUSH_MAX_TOKENS)
+        self.batch = BatchRunner(self, BATCH_JOBS_DIR, BATCH_FILES_DIR)
+        self.session_history: Dict[str, ContextWindow] = {}
+        self.context_stats = {"requests": 0, "trimmed_requests": 0, "trimmed_tokens": 0}
         self.__path_system_prompt = PROMPT_SYSTEM_PATH
         self.system_prompt = system_prompt or "You are a helpful, knowledgeable, and professional AI assistant."
 
-    def update_live_config(self):
-        # Update LLM parameters from database
-        config = self.get_config()
-        if config:
-            for key, value in config.items():
-                setattr(self, key, value)
-            logger.info(f"CONFIGPARAMS: {config}")
+    def _create_llm(self, model_name: str, model_path: str, chat_format: str) -> Llama:
+        # Speculative decoding is a load-time option, read from this model's config
+        config = ControlConfig({"id_model": model_name}).get() or {}
+        batching = CONTINUOUS_BATCHING_SLOTS >= 2
+        draft = self._build_draft(config, model_path)
+        # Threads / n_batch / n_ubatch from this machine's tuned profile, mlock and offload from the RAM free now
+        load = autotune.load_kwargs(model_name, model_path, AUTOTUNE_ON_FIRST_LOAD)
+        logger.info(f"[AUTOTUNE] Loading {model_name} with {load}")
+
+        llm = Llama(
+            model_path=model_path,
+            n_ctx=CONTINUOUS_BATCHING_MAIN_CTX if batching else CONTEXT_SIZE,
+            seed=config.get("seed"),
+            verbose=False,
+            chat_format=chat_format,
+            draft_model=draft,
+            **load
+        )
+
+        self.abort.attach(llm._ctx.ctx)
+        # Shared system-prompt/template prefixes, one tree per model
+        llm.set_cache(PrefixStateCache(PREFIX_CACHE_BYTES, PREFIX_CACHE_MIN_TOKENS, max_tree_tokens=PREFIX_CACHE_TREE_TOKENS))
+        # WHAT THE DRAFT WAS BUILT FROM: reload_config() ACTS ONLY WHEN IT CHANGES
+        llm.draft_settings = self._draft_settings(config)
+        if draft:
+            logger.info(f"[SPECULATIVE] {model_name}: {draft.mode}, {draft.tokens} draft tokens")
+        return llm
+
+    @staticmethod
+    def _draft_settings(config: dict) -> tuple:
+        # With batching, prompts decode in the batch context: the main one needs no draft
+        if CONTINUOUS_BATCHING_SLOTS >= 2 or not config.get("speculative_mode"):
+            return None, None
+        return config["speculative_mode"], config.get("draft_tokens") or 10
+
+    def _build_draft(self, config: dict, model_path: str) -> Optional[CountingDraft]:
+        mode, tokens = self._draft_settings(config)
+        return build_draft_model(mode, tokens, SPECULATIVE_DRAFT_MODEL, model_path) if mode else None
+
+    def _create_batcher(self) -> Optional[ContinuousBatcher]:
+        if CONTINUOUS_BATCHING_SLOTS < 2:
+            return None
+        return ContinuousBatcher(self.llm, self.llm.chat_format, CONTINUOUS_BATCHING_SLOTS,
+                                 CONTINUOUS_BATCHING_SLOTS * CONTINUOUS_BATCHING_SLOT_CTX, self.llm.n_batch)
+
+    def _activate_model(self, model_name: str, rebuilt: Optional[Llama] = None):
+        # Runs on the decode thread, so no prompt is mid-generation on the main context
+        llm = self.pool.activate(model_name) if rebuilt is None else rebuilt
+        if self.batcher:
+            # The batch context lives on the old weights
+            self.batcher.close()
+        with self._embedder_lock:
+            # So does the embedding context, unless it has a model of its own
+            if self.embedder and self.embedder.llm is self.llm:
+                self.embedder.close()
+                self.embedder = None
+        previous, self.llm = self.llm, llm
+        if rebuilt is not None:
+            # Same model built again: the old instance leaves the pool and frees its memory
+            self.pool.replace(model_name, rebuilt)
+            if previous.draft_model:
+                previous.draft_model.close()
+            previous.close()
+        self.batcher = self._create_batcher()
+        self.model_name = model_name
+        self.model_fingerprint = ResponseCache.fingerprint(getattr(llm, "model_path", model_name))
+        self.sampling = SamplingParams.load(model_name)
+        # KV states belong to the previous model
+        self.kv_cache.clear(model_name)
+
+    async def warmup(self):
+        """One short decode on the context prompts will use, so the first prompt does not pay for its setup"""
+        if self.batcher:
+            await self.batcher.complete([{"role": "user", "content": "Hi"}], 1, self.sampling)
         else:
-            logger.warning("CONFIGPARAMS DEFAULTS USED")
+            await self.engine.run(self._warmup_sync)
+
+    def _warmup_sync(self):
+        self.llm.eval([self.llm.token_bos()])
+        self.llm.reset()
+
+    async def switch_model(self, model_name: str) -> float:
+        """Loads (or reuses) a model from the pool and makes it active, returns seconds taken"""
+        if not model_name or Path(model_name).name != model_name:
+            raise ValueError(f"Invalid model name: {model_name}")
+
+        start = time.perf_counter()
+        await asyncio.wrap_future(self.pool.preload(model_name))
+        await self.engine.run(self._activate_model, model_name)
 
-    def get_session_history(self, session_id: str) -> List[Dict[str, str]]:
+        for window in self.session_history.values():
+            window.set_tokenizer(self.llm)
+        logger.info(f"Model switched to {model_name} in {time.perf_counter() - start:.2f}s. Pool: {self.pool.get_stats()}")
+        return time.perf_counter() - start
+
+    async def reload_config(self, model_name: str):
+        # Pushed by the HTTP /configs routes; the DB read stays off the event loop
+        if model_name != self.model_name:
+            return
+        loop = asyncio.get_running_loop()
+        self.sampling = await loop.run_in_executor(None, SamplingParams.load, model_name)
+        await self._reload_draft(model_name)
+        if self.response_cache:
+            # Answers computed under the previous config are not reused
+            await loop.run_in_executor(None, self.response_cache.invalidate, model_name)
+        logger.info(f"CONFIGPARAMS reloaded for {model_name}: {self.sampling}")
+
+    async def _reload_draft(self, model_name: str):
+        """speculative_mode / draft_tokens are load-time options: a change drops, swaps or rebuilds the draft"""
+        loop = asyncio.get_running_loop()
+        config = await loop.run_in_executor(None, lambda: ControlConfig({"id_model": model_name}).get() or {})
+        settings = self._draft_settings(config)
+        if settings == getattr(self.llm, "draft_settings", (None, None)):
+            return
+
+        if settings[0] is None or self.llm._logits_all:
+            # The context already keeps the logits of every position a draft needs verified
+            draft = await loop.run_in_executor(None, self._build_draft, config, self.llm.model_path)
+            await self.engine.run(self._set_draft, draft, settings)
+            logger.info(f"[SPECULATIVE] {model_name}: draft {'off' if draft is None else f'{draft.mode}, {draft.tokens} tokens'}")
+            return
+
+        # Drafting needs logits for every position, set when the context is created: build the model again
+        logger.info(f"[SPECULATIVE] {model_name}: rebuilding the model for {settings[0]}")
+        info = resolve_model(model_name)
+        llm = await loop.run_in_executor(None, self._create_llm, model_name, info["model_path"], info["chat_format"])
+        await self.engine.run(self._activate_model, model_name, llm)
+        for window in self.session_history.values():
+            window.set_tokenizer(self.llm)
+
+    def _set_draft(self, draft: Optional[CountingDraft], settings: tuple):
+        # Runs on the decode thread: no generation is reading draft_model meanwhile
+        previous, self.llm.draft_model = self.llm.draft_model, draft
+        self.llm.draft_settings = settings
+        if previous:
+            previous.close()
+
+    def get_session_history(self, session_id: str) -> ContextWindow:
         # Retrieve or initialize session conversation
-        prompt_system = get_prompt_system(self.__path_system_prompt) or self.system_prompt
         if session_id not in self.session_history:
-            self.session_history[session_id] = [{"role": "system", "content": prompt_system}]
+            prompt_system = get_prompt_system(self.__path_system_prompt) or self.system_prompt
+            self.session_history[session_id] = ContextWindow(prompt_system, self.llm, CONTEXT_DROP_POLICY)
         return self.session_history[session_id]
 
-    def cleanup_session(self, session_id: str):
+    def fit_history(self, session_id: str, prompt_text: str, tokens: int, skip: List[int] = ()):
+        # Fit the history plus the new prompt into n_ctx - max_tokens
+        n_ctx = self.batcher.slot_ctx if self.batcher else self.llm.n_ctx()
+        max_tokens = min(tokens, n_ctx // 2)
+        history, stats = self.get_session_history(session_id).build(prompt_text, n_ctx - max_tokens, skip)
+
+        self.context_stats["requests"] += 1
+        if stats["trimmed_tokens"]:
+            self.context_stats["trimmed_requests"] += 1
+            self.context_stats["trimmed_tokens"] += stats["trimmed_tokens"]
+            logger.info(f"CONTEXT: session {session_id} trimmed {stats['trimmed_tokens']} tokens ({stats['dropped_turns']} turns dropped)")
+        return history, max_tokens
+
+    def _get_embedder(self) -> Embedder:
+        # Runs on executor threads
+        with self._embedder_lock:
+            if self.embedder is None:
+                llm = self._load_embedding_model() or self.llm
+                self.embedder = Embedder(llm, EMBEDDING_BATCH_TOKENS, EMBEDDING_MAX_SEQUENCES)
+                self.embedding_fingerprint = ResponseCache.fingerprint(getattr(llm, "model_path", self.model_name))
+            return self.embedder
+
+    def _load_embedding_model(self) -> Optional[Llama]:
+        # A dedicated embedding model: narrower vectors, faster search, kept across chat model switches
+        if not EMBEDDING_MODEL:
+            return None
+        model_path = resolve_model(EMBEDDING_MODEL)["model_path"]
+        if not os.path.exists(model_path):
+            logger.warning(f"[EMBEDDINGS] {model_path} not found, embedding with the chat model")
+            return None
+        return Llama(model_path=model_path, embedding=True, n_ctx=256, verbose=False, **autotune.memory_kwargs(model_path))
+
+    async def embed(self, texts: List[str]):
+        """Normalized embeddings of `texts` from the active model, one row per text"""
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self._get_embedder().embed(texts))
+
+    async def recall(self, session_id: str, prompt_text: str) -> Tuple[str, List[int]]:
+        """
+        The prompt with the most relevant older messages put in front of it,
+        and the older messages it replaces in the history sent to the model.
+        """
+        window = self.get_session_history(session_id)
+        older = window.older_messages(MEMORY_RECENT_TURNS)
+        if not older:
+            return prompt_text, []
+        messages = {i: dict(window.messages[i]) for i in older}
+        try:
+            hits = await asyncio.get_running_loop().run_in_executor(None, self._recall_sync, session_id, messages, prompt_text)
+        except Exception as e:
+            logger.warning(f"MEMORY: recall failed for {session_id}, sending the history instead: {e}")
+            return prompt_text, []
+        if not hits:
+            return prompt_text, older
+        snippets = "\n".join(f"{messages[i]['role']}: {messages[i]['content'][:MEMORY_SNIPPET_CHARS]}" for i in sorted(hits))
+        return f"Relevant earlier conversation:\n{snippets}\n\n{prompt_text}", older
+
+    def _recall_sync(self, session_id: str, messages: Dict[int, dict], prompt_text: str) -> List[int]:
+        # Embeds the older messages not indexed yet together with the prompt, then searches the session's vectors
+        embedder = self._get_embedder()
+        memory = self.memory.open(session_id, embedder.dim, self.embedding_fingerprint)
+        with memory.lock:
+            missing = sorted(set(messages) - memory.indexed)
+            vectors = embedder.embed([messages[i]["content"] for i in missing] + [prompt_text])
+            if missing:
+                memory.add(vectors[:-1], missing)
+            start = time.perf_counter()
+            hits = memory.search(vectors[-1], MEMORY_TOP_K)
+            logger.info(f"MEMORY: session {session_id} indexed {len(missing)} messages, "
+                        f"searched {len(memory.messages)} in {(time.perf_counter() - start) * 1000:.3f} ms")
+        return [i for i, _ in hits]
+
+    async def open_session(self, requested: Optional[str]) -> Tuple[str, bool]:
+        """Session of a new connection: the requested one if it is still stored, a new one otherwise"""
+        if SessionStore.valid_id(requested):
+            if requested in self.session_history:
+                return requested, True
+            messages = await asyncio.get_running_loop().run_in_executor(None, self.sessions.load, requested)
+            if messages:
+                if requested not in self.session_history:
+                    self.session_history[requested] = ContextWindow.restore(messages, self.llm, CONTEXT_DROP_POLICY)
+                return requested, True
+        return uuid.uuid4().hex, False
+
+    async def save_session(self, session_id: str):
+        window = self.session_history.get(session_id)
+        if window is None:
+            return
+        messages = [dict(m) for m in window.messages]
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.sessions.save, session_id, messages)
+        except Exception as e:
+            logger.warning(f"Could not save session {session_id}: {e}")
+
+    def cancel_prompt(self, prompt_id: str):
+        """Stops a prompt where it is: dropped from the queue, or its decode aborted mid-step"""
+        self.active_prompts.discard(prompt_id)
+        self.prompt_owners.pop(prompt_id, None)
+        if self.scheduler.cancel(prompt_id) or prompt_id not in self.scheduler.running:
+            return
+        self.canceled_at.setdefault(prompt_id, time.perf_counter())
+        request = self.batch_requests.get(prompt_id)
+        if request:
+            request.cancel()
+            if self.batcher:
+                self.batcher.interrupt()
+        else:
+            self.abort.abort(prompt_id)
+
+    async def cleanup_session(self, session_id: str, websocket: Optional[websockets.WebSocketServerProtocol] = None):
+        for prompt_id in self.scheduler.cancel_session(session_id):
+            self.active_prompts.discard(prompt_id)
+        # Nobody reads the answers of this connection any more
+        for prompt_id in [p for p, owner in self.prompt_owners.items() if owner is websocket]:
+            self.cancel_prompt(prompt_id)
+        self.outboxes.pop(websocket, None)
+        self.connections[session_id] -= 1
+        if self.connections[session_id] > 0:
+            return
+        del self.connections[session_id]
+
+        # Keep the history and the KV state on disk until the client comes back or the session expires.
+        # A client may reconnect during any await below: its live connection keeps what is still in memory
+        await self.save_session(session_id)
+        if session_id in self.connections:
+            logger.info(f"Session {session_id} reconnected while saving, kept in memory")
+            return
         self.session_history.pop(session_id, None)
+        await asyncio.get_running_loop().run_in_executor(None, self.kv_cache.spill, session_id)
+        if session_id in self.connections:
+            logger.info(f"Session {session_id} reconnected while spilling its KV state")
+            return
+        self.memory.close(session_id)
         logger.info(f"Session cleanup complete for {session_id}")
 
-    async def handle_prompt(self, prompt_id: str, prompt_text: str, session_id: str, websocket: websockets.WebSocketServerProtocol):
-        self.update_live_config()
+    async def collect_sessions(self):
+        """Expires stored sessions (TTL, then size cap) and the KV states of sessions no longer stored"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self._collect_sessions_sync, set(self.session_history))
+                logger.info(f"SESSIONS: {self.sessions.get_stats()}")
+            except Exception as e:
+                logger.error(f"Session garbage collection failed: {e}")
+            await asyncio.sleep(SESSION_GC_INTERVAL)
+
+    def _collect_sessions_sync(self, connected: Set[str]):
+        self.sessions.gc()
+        keep = self.sessions.session_ids() | connected
+        for session_id in self.kv_cache.session_ids() - keep:
+            self.kv_cache.drop(session_id)
+        for session_id in self.memory.session_ids() - keep:
+            self.memory.drop(session_id)
+
+    async def handle_prompt(self, prompt_id: str, prompt_text: str, session_id: str, websocket: websockets.WebSocketServerProtocol, submitted: Optional[float] = None):
+        params = self.sampling
+        submitted = submitted or time.perf_counter()
         logger.info(f"Processing prompt {prompt_id} for session {session_id}")
 
-        history = self.get_session_history(session_id).copy()
-        history.append({"role": "user", "content": prompt_text})
+        if MEMORY_ENABLED:
+            sent_text, recalled = await self.recall(session_id, prompt_text)
+            history, max_tokens = self.fit_history(session_id, sent_text, params.tokens, recalled)
+        else:
+            history, max_tokens = self.fit_history(session_id, prompt_text, params.tokens)
+        draft = self.llm.draft_model if not self.batcher and isinstance(self.llm.draft_model, CountingDraft) else None
+        timing = {}
 
-        loop = asyncio.get_event_loop()
+        cache_key = cached = None
+        if self.response_cache and ResponseCache.deterministic(params):
+            cache_key = ResponseCache.key(self.model_fingerprint, self.llm.chat_format, params, max_tokens, history)
+            cached = await asyncio.get_running_loop().run_in_executor(None, self.response_cache.get, cache_key)
 
         def get_stream_sync():
+            # Runs on the decode thread. Restore this session's KV state so only the new message is evaluated
+            state = self.kv_cache.get(session_id)
+            if state is not None:
+                self.llm.load_state(state)
+            if isinstance(self.llm.cache, PrefixStateCache):
+                self.llm.cache.pop_last_state()
+            if draft:
+                timing["draft"] = draft.snapshot()
+            timing["start"] = time.perf_counter()
             # Synchronous LLM call wrapped for executor
-            return self.llm.create_chat_completion(
+            return self._abortable(prompt_id, self.llm.create_chat_completion(
                 history,
-                max_tokens=self.tokens,
+                max_tokens=max_tokens,
                 stream=True,
-                temperature=self.temperature,
-                top_p=self.top_p,
-                top_k=self.top_k,
-                repeat_penalty=self.repeat_penalty,
-                frequency_penalty=self.frequency_penalty,
-                presence_penalty=self.presence_penalty,
-                min_p=self.min_p,
-                tfs_z=self.tfs_z,
-                mirostat_tau=self.mirostat_tau,
-                stop=self.stop
-            )
+                **params.completion_kwargs()
+            ))
+
+        def finish_sync():
+            timing["end"] = time.perf_counter()
+            self._save_session_state(session_id)
+
+        should_stop = lambda: prompt_id not in self.active_prompts
+        request = None
+        if cached is not None:
+            # Same inputs, same answer: stream it back without touching the model
+            frames = self.engine.replay(cached)
+        elif self.batcher:
+            # Decoded in the same steps as the other sessions' prompts
+            request = self.batcher.submit(history, max_tokens, params, should_stop)
+            self.batch_requests[prompt_id] = request
+            frames = self.engine.frames(request.queue)
+        else:
+            frames = self.engine.stream(get_stream_sync, should_stop=should_stop, after=finish_sync)
 
+        # Frames leave through a bounded buffer: a slow client never holds the decode back
+        outbox = self._open_outbox(websocket, prompt_id)
         try:
-            stream = await loop.run_in_executor(None, get_stream_sync)
             response_tokens = []
 
-            for chunk in stream:
-                await asyncio.sleep(0)  # yield control for cancellation
-
+            async for batch in frames:
+                if outbox.dead:
+                    # Nobody left to read the answer
+                    self.cancel_prompt(prompt_id)
                 if prompt_id not in self.active_prompts:
-                    await websocket.send(json.dumps({"promptId": prompt_id, "complete": True, "type": "complete"}))
-                    return
-
-                token = chunk["choices"][0]["delta"].get("content", "")
-                if token:
-                    response_tokens.append(token)
-                    await websocket.send(json.dumps({"promptId": prompt_id, "token": token, "type": "token"}))
+                    break
+                if not response_tokens:
+                    metrics.TTFT_SECONDS.observe(time.perf_counter() - submitted)
+                response_tokens.extend(batch)
+                metrics.TOKENS_TOTAL.inc(len(batch))
+                outbox.token("".join(batch))
+
+            if prompt_id not in self.active_prompts:
+                # Confirm once the decode has actually stopped
+                generated = len(response_tokens)
+                try:
+                    async for batch in frames:
+                        generated += len(batch)
+                except GenerationError:
+                    pass
+                self._record_cancel(prompt_id, max_tokens, request.n_generated if request else generated)
+                metrics.PROMPTS_TOTAL.labels("disconnected" if outbox.dead else "canceled").inc()
+                outbox.frame({"promptId": prompt_id, "complete": True, "type": "complete"})
+                return
+
+            if request:
+                timing.update(start=request.started_at, end=request.finished_at)
 
             # Append final response to session
             if prompt_id in self.active_prompts:
                 self.active_prompts.remove(prompt_id)
                 assistant_response = "".join(response_tokens)
-                self.get_session_history(session_id).append({"role": "user", "content": prompt_text})
+                self.get_session_history(session_id).append("user", prompt_text)
                 if assistant_response:
-                    self.get_session_history(session_id).append({"role": "assistant", "content": assistant_response})
-                await websocket.send(json.dumps({"promptId": prompt_id, "complete": True, "type": "complete"}))
+                    self.get_session_history(session_id).append("assistant", assistant_response)
+                outbox.frame({"promptId": prompt_id, "complete": True, "type": "complete"})
+                await self.save_session(session_id)
+                metrics.PROMPTS_TOTAL.labels("completed").inc()
+                if cache_key and cached is None:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self.response_cache.put, cache_key, self.model_name, response_tokens
+                    )
+                if self.response_cache:
+                    logger.info(f"RESPONSE_CACHE: {'hit' if cached is not None else 'miss'} {self.response_cache.get_stats()}")
+                if "end" in timing and timing["end"] > timing["start"]:
+                    metrics.TOKENS_PER_SECOND.observe(len(response_tokens) / (timing["end"] - timing["start"]))
                 logger.info(f"Prompt {prompt_id} complete. History length: {len(self.get_session_history(session_id))}")
+                if self.batcher:
+                    logger.info(f"BATCHING: {self.batcher.get_stats()}")
+                else:
+                    logger.info(f"KV_CACHE: {self.kv_cache.get_stats()}")
+                if not self.batcher and isinstance(self.llm.cache, PrefixStateCache):
+                    logger.info(f"PREFIX_CACHE: {self.llm.cache.get_stats()}")
+                if draft and "end" in timing:
+                    report = self.speculative_stats.record(draft, timing["draft"], len(response_tokens), timing["end"] - timing["start"])
+                    logger.info(f"SPECULATIVE: {report}")
 
-        except ConnectionClosedOK:
-            self.active_prompts.discard(prompt_id)
         except Exception as e:
+            metrics.PROMPTS_TOTAL.labels("error").inc()
             logger.error(f"Fatal error during prompt {prompt_id}: {type(e).__name__}: {e}", exc_info=True)
-            await self._send_error(websocket, prompt_id, f"Server Error: {e}")
+            outbox.frame({"promptId": prompt_id, "error": f"Server Error: {e}", "type": "error"})
             self.active_prompts.discard(prompt_id)
+        finally:
+            outbox.close()
+            if request:
+                request.cancel()
+            self.batch_requests.pop(prompt_id, None)
+            self.prompt_owners.pop(prompt_id, None)
+            self.canceled_at.pop(prompt_id, None)
+
+    def _open_outbox(self, websocket, prompt_id: str) -> Outbox:
+        outbox = Outbox(websocket, prompt_id, SEND_QUEUE_MAX_FRAMES, SEND_QUEUE_MAX_BYTES, SEND_STALL_SECONDS, self._drop_slow_client)
+        outboxes = self.outboxes.get(websocket)
+        if outboxes is not None:
+            outboxes.add(outbox)
+            outbox.task.add_done_callback(lambda _: outboxes.discard(outbox))
+        outbox.task.add_done_callback(lambda _: metrics.SEND_MERGED_TOTAL.inc(outbox.stats["merged"]))
+        return outbox
+
+    def _drop_slow_client(self, outbox: Outbox):
+        # The client stopped reading: its prompts are canceled and it reconnects with its sessionId
+        metrics.SLOW_CLIENTS_DROPPED.inc()
+        for prompt_id in [p for p, owner in self.prompt_owners.items() if owner is outbox.websocket]:
+            self.cancel_prompt(prompt_id)
+        asyncio.create_task(outbox.websocket.close(1013, "Client too slow"))
+
+    def _abortable(self, prompt_id: str, stream: Iterator[dict]) -> Iterator[dict]:
+        # Runs on the decode thread: the abort flag belongs to this prompt while its stream runs
+        self.abort.arm(prompt_id)
+        try:
+            # A cancel that came before the flag was armed
+            if prompt_id not in self.active_prompts:
+                return
+            yield from stream
+        finally:
+            self.abort.disarm()
+
+    def _record_cancel(self, prompt_id: str, max_tokens: int, generated: int):
+        canceled_at = self.canceled_at.pop(prompt_id, None)
+        if canceled_at is None:
+            return
+        stopped = time.perf_counter() - canceled_at
+        saved = max(0, max_tokens - generated)
+        metrics.CANCEL_STOP_SECONDS.observe(stopped)
+        metrics.CANCEL_TOKENS_SAVED.inc(saved)
+        logger.info(f"Prompt {prompt_id} canceled: decode stopped after {stopped * 1000:.1f} ms, {saved} tokens not generated")
+
+    def _save_session_state(self, session_id: str):
+        # Reuse the state llama-cpp already saved into the prefix cache at the end of the completion
+        cache = self.llm.cache if isinstance(self.llm.cache, PrefixStateCache) else None
+        state = cache.pop_last_state() if cache else None
+        self.kv_cache.put(session_id, state or self.llm.save_state())
+        if cache:
+            cache.materialize(self.llm)
 
     async def handle_client(self, websocket: websockets.WebSocketServerProtocol, path: Optional[str] = None):
-        session_id = str(uuid.uuid4())[:8]
-        logger.info(f"New client connected: {websocket.remote_address} - Session: {session_id}")
+        # ws://host:port/?sessionId=<id> resumes a stored session
+        request = getattr(websocket, "request", None)
+        query = parse_qs(urlparse(path or (request.path if request else "")).query)
+        session_id, resumed = await self.open_session(query.get("sessionId", [None])[0])
+        self.connections[session_id] = self.connections.get(session_id, 0) + 1
+        outboxes = self.outboxes[websocket] = set()
+        connection = str(getattr(websocket, "id", id(websocket)))[:8]
+        metrics.SEND_QUEUE_FRAMES.labels(session_id, connection).set_function(lambda: sum(o.depth for o in outboxes))
+        logger.info(f"New client connected: {websocket.remote_address} - Session: {session_id}{' (resumed)' if resumed else ''}")
 
         try:
-            await websocket.send(json.dumps({"type": "ready", "message": "Model is ready", "sessionId": session_id}))
+            await websocket.send(json.dumps({"type": "ready", "message": "Model is ready", "sessionId": session_id, "resumed": resumed}))
             async for message in websocket:
                 await self._process_client_message(websocket, message, session_id)
         except ConnectionClosedOK:
@@ -154,7 +584,8 @@ class LlamaChatServer:
             logger.error(f"Client handler error: {e}")
             await self._send_error(websocket, None, f"Connection failure: {e}")
         finally:
-            self.cleanup_session(session_id)
+            metrics.SEND_QUEUE_FRAMES.remove(session_id, connection)
+            await self.cleanup_session(session_id, websocket)
 
     async def _process_client_message(self, websocket, message, session_id):
         try:
@@ -166,6 +597,17 @@ class LlamaChatServer:
                 await self._handle_cancel_action(websocket, data)
             elif action == "clear_history":
                 await self._handle_clear_history_action(websocket, session_id)
+            elif action == "switch_model":
+                await self._handle_switch_model_action(websocket, data)
+            elif action == "preload_model":
+                await self._handle_preload_model_action(websocket, data)
+            elif action in ("batch_submit", "batch_status", "batch_cancel"):
+                await self._handle_batch_action(websocket, action, data)
+            elif action == "embed":
+                await self._handle_embed_action(websocket, data)
+            elif action == "reload_config":
+                await self.reload_config(data.get("model"))
+                await websocket.send(json.dumps({"model": data.get("model"), "status": "reloaded", "type": "config_reloaded"}))
             else:
                 await self._send_error(websocket, None, f"Unknown action: {action}")
         except Exception as e:
@@ -178,23 +620,98 @@ class LlamaChatServer:
             return
 
         prompt_id = data.get("promptId") or str(uuid.uuid4())
-        if len(self.active_prompts) > 5:
-            await self._send_error(websocket, prompt_id, "Too many active prompts. Wait for current ones to finish.")
+        submitted = time.perf_counter()
+        job = PromptJob(
+            prompt_id,
+            session_id,
+            run=lambda: self.handle_prompt(prompt_id, prompt_text, session_id, websocket, submitted),
+            on_position=lambda position: self._send_queued(websocket, prompt_id, session_id, position)
+        )
+        busy = len(self.scheduler.running) >= self.scheduler.concurrency
+
+        try:
+            position = self.scheduler.submit(job)
+        except QueueFull as e:
+            await self._send_error(websocket, prompt_id, f"{e}. Wait for current ones to finish.")
             return
 
         self.active_prompts.add(prompt_id)
-        asyncio.create_task(self.handle_prompt(prompt_id, prompt_text, prompt_text, websocket))
+        self.prompt_owners[prompt_id] = websocket
         await websocket.send(json.dumps({"promptId": prompt_id, "sessionId": session_id, "status": "started", "type": "started"}))
+        if busy:
+            await self._send_queued(websocket, prompt_id, session_id, position)
+
+    async def _send_queued(self, websocket, prompt_id, session_id, position):
+        try:
+            await websocket.send(json.dumps({"promptId": prompt_id, "sessionId": session_id, "status": "queued", "position": position, "type": "status"}))
+        except Exception as e:
+            logger.warning(f"Could not send queue position for {prompt_id}: {e}")
 
     async def _handle_cancel_action(self, websocket, data):
         prompt_id = data.get("promptId")
         if prompt_id:
-            self.active_prompts.discard(prompt_id)
+            self.cancel_prompt(prompt_id)
             await websocket.send(json.dumps({"promptId": prompt_id, "status": "canceled", "type": "status"}))
 
+    async def _handle_switch_model_action(self, websocket, data):
+        model_name = data.get("model")
+        try:
+            seconds = await self.switch_model(model_name)
+        except Exception as e:
+            logger.error(f"Model switch to {model_name} failed: {e}")
+            await self._send_error(websocket, None, f"Model switch failed: {e}")
+            return
+        await websocket.send(json.dumps({"model": model_name, "status": "ready", "seconds": round(seconds, 3), "type": "model_switched"}))
+
+    async def _handle_preload_model_action(self, websocket, data):
+        model_name = data.get("model")
+        if not model_name or Path(model_name).name != model_name:
+            await self._send_error(websocket, None, f"Invalid model name: {model_name}")
+            return
+        try:
+            await asyncio.wrap_future(self.pool.preload(model_name))
+        except Exception as e:
+            await self._send_error(websocket, None, f"Model preload failed: {e}")
+            return
+        await websocket.send(json.dumps({"model": model_name, "status": "loaded", "type": "model_preloaded"}))
+
+    async def _handle_batch_action(self, websocket, action, data):
+        job_id = data.get("jobId")
+        try:
+            if action == "batch_submit":
+                job_id = self.batch.submit(data.get("input"), data.get("output"), data.get("system"), data.get("maxTokens")).job_id
+            elif action == "batch_cancel" and not self.batch.cancel(job_id):
+                await self._send_error(websocket, None, f"No running batch job {job_id}")
+                return
+        except (OSError, ValueError, TypeError) as e:
+            await self._send_error(websocket, None, f"Batch job rejected: {e}")
+            return
+        await websocket.send(json.dumps({"jobs": self.batch.status(job_id), "type": "batch_status"}))
+
+    async def _handle_embed_action(self, websocket, data):
+        texts = data.get("texts")
+        if not isinstance(texts, list) or not texts or not all(isinstance(t, str) for t in texts):
+            await self._send_error(websocket, None, "embed needs a non-empty list of strings in 'texts'")
+            return
+        start = time.perf_counter()
+        try:
+            vectors = await self.embed(texts)
+        except Exception as e:
+            await self._send_error(websocket, None, f"Embedding failed: {e}")
+            return
+        await websocket.send(json.dumps({
+            "model": EMBEDDING_MODEL if self.embedder.llm is not self.llm else self.model_name, "dim": vectors.shape[1], "embeddings": vectors.tolist(),
+            "seconds": round(time.perf_counter() - start, 3), "type": "embeddings"
+        }))
+
     async def _handle_clear_history_action(self, websocket, session_id):
         # Reset session conversation
-        self.session_history[session_id] = [{"role": "system", "content": "You are a helpful and polite assistant. Always respond in the user's language."}]
+        self.session_history[session_id] = ContextWindow(
+            "You are a helpful and polite assistant. Always respond in the user's language.", self.llm, CONTEXT_DROP_POLICY
+        )
+        self.kv_cache.drop(session_id)
+        self.memory.drop(session_id)
+        await self.save_session(session_id)
         await websocket.send(json.dumps({"sessionId": session_id, "status": "history_cleared", "type": "memory_cleared"}))
         logger.info(f"Session history reset for {session_id}")
 
@@ -210,27 +727,21 @@ class LlamaChatServer:
     def _updateSystemPrompt(self, session_id, new_prompt):
         # Update system prompt for a session
         if session_id in self.session_history:
-            for msg in self.session_history[session_id]:
-                if msg.get("role") == "system":
-                    msg["content"] = new_prompt
-                    return
-            self.session_history[session_id].insert(0, {"role": "system", "content": new_prompt})
+            self.session_history[session_id].set_system(new_prompt)
 
 async def main():
-    logger.info("Initializing LLaMA model...")
-    try:
-        server = LlamaChatServer(MODEL_PATH)
-    except Exception as e:
-        logger.error(f"FATAL: Failed to load LLaMA model at {MODEL_PATH}: {e}")
-        return
+    # Bind first: the supervisor sees the port at once and clients get "loading" frames while the model loads
+    startup = Startup()
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag(metrics.EVENT_LOOP_LAG))
 
     ws_server = None
     for port in FALLBACK_PORTS_WEBSOCKET:
         try:
             ws_server = await websockets.serve(
-                server.handle_client, "0.0.0.0", port, ping_interval=20, ping_timeout=10, close_timeout=10
+                startup.handle_client, "0.0.0.0", port, ping_interval=20, ping_timeout=10, close_timeout=10,
+                process_request=metrics.process_request
             )
-            logger.info(f"WebSocket LLaMA server running on ws://0.0.0.0:{port}")
+            logger.info(f"WebSocket LLaMA server running on ws://0.0.0.0:{port} (metrics: http://127.0.0.1:{port}/metrics)")
             break
         except OSError as e:
             logger.error(f"WebSocket error: {e}")
@@ -239,10 +750,41 @@ async def main():
         logger.error("WebSocket server failed to start.")
         return
 
+    def load_sync() -> LlamaChatServer:
+        if STARTUP_PREFETCH and os.path.exists(MODEL_PATH):
+            startup.enter("prefetch")
+            prefetch(MODEL_PATH, lambda progress: setattr(startup, "progress", progress))
+        startup.enter("load")
+        return LlamaChatServer(NAME_OF_MODEL)
+
+    logger.info("Initializing LLaMA model...")
+    try:
+        server = await asyncio.get_running_loop().run_in_executor(None, load_sync)
+        if STARTUP_WARMUP:
+            startup.enter("warmup")
+            await server.warmup()
+    except Exception as e:
+        logger.error(f"FATAL: Failed to load LLaMA model at {MODEL_PATH}: {e}")
+        startup.fail(str(e))
+        lag_monitor.cancel()
+        ws_server.close()
+        await ws_server.wait_closed()
+        return
+
+    server.scheduler.start()
+    server.batch.resume()
+    metrics.bind_server(server)
+    session_gc = asyncio.create_task(server.collect_sessions())
+    startup.finish(server)
+    for phase, seconds in startup.timings.items():
+        metrics.STARTUP_SECONDS.labels(phase).set(seconds)
+
     try:
         await asyncio.Future()
     except KeyboardInterrupt:
         logger.info("Server shutting down...")
+        lag_monitor.cancel()
+        session_gc.cancel()
         ws_server.close()
         await ws_server.wait_closed()
 
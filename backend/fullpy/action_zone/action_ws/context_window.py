@@ -0,0 +1,144 @@
+"""Token-budgeted conversation history"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# ROLE HEADERS / SEPARATORS ADDED BY THE CHAT TEMPLATE AROUND EACH MESSAGE
+MESSAGE_OVERHEAD_TOKENS = 8
+
+
+def drop_oldest_first(turns: List[List[int]]) -> List[int]:
+    """Drops turns from the oldest to the newest"""
+    return list(range(len(turns)))
+
+
+def drop_keep_first_user_turn(turns: List[List[int]]) -> List[int]:
+    """Keeps the first turn (usually the task statement), then drops oldest first"""
+    return list(range(1, len(turns)))
+
+
+DROP_POLICIES: Dict[str, Callable[[List[List[int]]], List[int]]] = {
+    "oldest_first": drop_oldest_first,
+    "keep_first_user_turn": drop_keep_first_user_turn,
+}
+
+
+class ContextWindow:
+    """
+    Conversation history of one session.
+    Each message keeps its token count from the moment it is appended, so
+    fitting the history into `n_ctx - max_tokens` never re-tokenizes it.
+    The system prompt is pinned; older turns (a user message plus the
+    assistant replies after it) are dropped by the configured policy and,
+    when nothing else is left to drop, the newest message is truncated.
+    """
+
+    def __init__(self, system_prompt: str, tokenizer, policy: str = "oldest_first"):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.tokenizer = tokenizer
+        self.policy = policy
+        self.messages: List[Dict[str, str]] = []
+        self.counts: List[int] = []
+        self.last_stats: Dict[str, int] = {}
+        self.append("system", system_prompt)
+
+    @classmethod
+    def restore(cls, messages: List[Dict[str, str]], tokenizer, policy: str = "oldest_first") -> "ContextWindow":
+        """Rebuilds a saved history, counting its messages with the current model's tokenizer"""
+        window = cls(messages[0]["content"] if messages and messages[0]["role"] == "system" else "", tokenizer, policy)
+        start = 1 if messages and messages[0]["role"] == "system" else 0
+        for message in messages[start:]:
+            window.append(message["role"], message["content"])
+        return window
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def _tokens(self, text: str) -> List[int]:
+        return self.tokenizer.tokenize(text.encode("utf-8"), add_bos=False, special=False)
+
+    def count(self, text: str) -> int:
+        return len(self._tokens(text)) + MESSAGE_OVERHEAD_TOKENS
+
+    def append(self, role: str, content: str):
+        self.messages.append({"role": role, "content": content})
+        self.counts.append(self.count(content))
+
+    def set_tokenizer(self, tokenizer):
+        """Recounts every message with another model's tokenizer"""
+        self.tokenizer = tokenizer
+        self.counts = [self.count(m["content"]) for m in self.messages]
+
+    def set_system(self, content: str):
+        if self.messages and self.messages[0]["role"] == "system":
+            self.messages[0]["content"] = content
+            self.counts[0] = self.count(content)
+        else:
+            self.messages.insert(0, {"role": "system", "content": content})
+            self.counts.insert(0, self.count(content))
+
+    def _turns(self, start: int) -> List[List[int]]:
+        # GROUP MESSAGE INDEXES INTO TURNS STARTING AT EACH USER MESSAGE
+        turns: List[List[int]] = []
+        for i in range(start, len(self.messages)):
+            if self.messages[i]["role"] == "user" or not turns:
+                turns.append([i])
+            else:
+                turns[-1].append(i)
+        return turns
+
+    def older_messages(self, recent_turns: int) -> List[int]:
+        """Indexes of the messages before the last `recent_turns` turns (the system prompt excluded)"""
+        pinned = 1 if self.messages and self.messages[0]["role"] == "system" else 0
+        turns = self._turns(pinned)
+        return [i for turn in turns[:max(len(turns) - recent_turns, 0)] for i in turn]
+
+    def build(self, prompt_text: str, budget: int, skip: Iterable[int] = ()) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """
+        Returns the messages to send for a new user prompt, fitted into `budget` tokens.
+        Messages in `skip` are left out before fitting (already recalled into the prompt).
+        """
+        pinned = 1 if self.messages and self.messages[0]["role"] == "system" else 0
+        keep = [True] * len(self.messages)
+        for i in skip:
+            keep[i] = False
+        prompt_count = self.count(prompt_text)
+        total = sum(c for c, k in zip(self.counts, keep) if k) + prompt_count
+
+        dropped_turns = 0
+        trimmed = 0
+
+        if total > budget:
+            turns = self._turns(pinned)
+            for turn_index in DROP_POLICIES[self.policy](turns):
+                if total <= budget:
+                    break
+                if not any(keep[i] for i in turns[turn_index]):
+                    continue
+                for i in turns[turn_index]:
+                    if keep[i]:
+                        keep[i] = False
+                        total -= self.counts[i]
+                        trimmed += self.counts[i]
+                dropped_turns += 1
+
+        messages = [dict(m) for m, k in zip(self.messages, keep) if k]
+        truncated = 0
+
+        # NOTHING LEFT TO DROP: KEEP ONLY THE TAIL OF THE NEW MESSAGE
+        if total > budget:
+            tokens = self._tokens(prompt_text)
+            room = max(len(tokens) - (total - budget), 0)
+            truncated = len(tokens) - room
+            prompt_text = self.tokenizer.detokenize(tokens[-room:] if room else []).decode("utf-8", errors="ignore")
+            trimmed += truncated
+            total -= truncated
+
+        messages.append({"role": "user", "content": prompt_text})
+        self.last_stats = {
+            "budget": budget,
+            "prompt_tokens": total,
+            "trimmed_tokens": trimmed,
+            "dropped_turns": dropped_turns,
+            "truncated_tokens": truncated,
+        }
+        return messages, self.last_stats
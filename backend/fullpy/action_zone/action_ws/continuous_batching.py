@@ -0,0 +1,423 @@
+"""Continuous batching: concurrent prompts decoded together on one llama context"""
+import time
+import queue
+import codecs
+import asyncio
+import threading
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
+import llama_cpp
+from llama_cpp import _internals, llama_chat_format
+from action_zone.action_ws import logger
+from action_zone.action_ws.engine import DONE, GenerationError
+from action_zone.action_ws.abort import AbortFlag
+
+# CHAT FORMAT -> llama_chat_format FORMATTER (PROMPT TEXT + STOP STRINGS)
+CHAT_FORMATTERS = {
+    "llama-3": "format_llama3",
+    "chatml": "format_chatml",
+    "mistral-instruct": "format_mistral_instruct",
+}
+PENALTY_LAST_N = 64
+# A FREE SLOT IS REFILLED FROM ANOTHER SLOT'S KV WHEN THAT SHARES THIS MANY MORE TOKENS
+SHARE_MIN_TOKENS = 32
+
+
+class BatchRequest:
+    """One prompt in the batcher. Tokens go to `queue` from the decode thread, then DONE or a GenerationError"""
+
+    def __init__(self, messages: List[dict], max_tokens: int, params, should_stop: Callable[[], bool], loop: asyncio.AbstractEventLoop):
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.params = params
+        self.should_stop = should_stop
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+        self.tokens: List[int] = []
+        self.stop: List[str] = []
+        self.text = ""
+        self.sent = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.n_generated = 0
+        self.finish_reason: Optional[str] = None
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self.canceled = False
+
+    def cancel(self):
+        self.canceled = True
+
+    def push(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+class Slot:
+    __slots__ = ('seq_id', 'tokens', 'request', 'pending', 'next_token', 'sampler', 'last_used')
+
+    def __init__(self, seq_id: int):
+        self.seq_id = seq_id
+        # TOKENS WHOSE KV IS IN THIS SEQUENCE, KEPT AFTER THE REQUEST ENDS FOR THE NEXT TURN
+        self.tokens: List[int] = []
+        self.request: Optional[BatchRequest] = None
+        self.pending: List[int] = []
+        self.next_token: Optional[int] = None
+        self.sampler: Optional[_internals.LlamaSampler] = None
+        self.last_used = 0.0
+
+
+def common_prefix(a: List[int], b: List[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class ContinuousBatcher:
+    """
+    A second llama context on the loaded model's weights with `n_slots`
+    sequences in a unified KV cache. One decode thread runs steps: every
+    generating sequence contributes its next token, prompts being prefilled
+    fill the rest of the batch, and everything goes through one llama_decode.
+    Requests join a free slot between steps and leave when they finish.
+
+    A slot keeps its tokens after its request ends: the session's next turn
+    (or any prompt with the same system prompt) only evaluates what differs.
+    """
+
+    def __init__(self, llm, chat_format: str, n_slots: int = 4, n_ctx: int = 16384, n_batch: int = 512):
+        self.llm = llm
+        self.format = getattr(llama_chat_format, CHAT_FORMATTERS.get(chat_format, "format_chatml"))
+        self.n_slots = n_slots
+        self.n_batch = n_batch
+        # HISTORY BUDGET OF ONE CONVERSATION WHEN EVERY SLOT IS BUSY
+        self.slot_ctx = n_ctx // n_slots
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_ctx
+        params.n_batch = n_batch
+        params.n_ubatch = n_batch
+        params.n_seq_max = n_slots
+        params.kv_unified = True
+        params.n_threads = llm.context_params.n_threads
+        params.n_threads_batch = llm.context_params.n_threads_batch
+        self.ctx = _internals.LlamaContext(model=llm._model, params=params, verbose=False)
+        self.batch = _internals.LlamaBatch(n_tokens=n_batch, embd=0, n_seq_max=n_slots, verbose=False)
+        self.vocab = llm._model.vocab
+        self.n_ctx = self.ctx.n_ctx()
+        # A STEP WHOSE PROMPTS WERE ALL CANCELED STOPS MID-DECODE
+        self._abort = AbortFlag()
+        self._abort.attach(self.ctx.ctx)
+        self._current: Tuple[int, List[BatchRequest]] = (0, [])
+        self._step_id = 0
+
+        self.slots = [Slot(i) for i in range(n_slots)]
+        self._incoming: "queue.Queue[Optional[BatchRequest]]" = queue.Queue()
+        self._waiting: Deque[BatchRequest] = deque()
+        self._closed = False
+        self.stats = {"requests": 0, "steps": 0, "decoded_tokens": 0, "generated_tokens": 0,
+                      "prefill_tokens": 0, "reused_tokens": 0, "shared_tokens": 0, "max_active": 0,
+                      "aborted_steps": 0}
+
+        self._thread = threading.Thread(target=self._loop, name="llama-batch", daemon=True)
+        self._thread.start()
+
+    # EVENT LOOP SIDE
+    def submit(self, messages: List[dict], max_tokens: int, params, should_stop: Callable[[], bool] = lambda: False) -> BatchRequest:
+        request = BatchRequest(messages, max_tokens, params, should_stop, asyncio.get_running_loop())
+        if self._closed:
+            raise GenerationError("Batcher is closed")
+        self._incoming.put(request)
+        return request
+
+    async def complete(self, messages: List[dict], max_tokens: int, params) -> Tuple[dict, float]:
+        """Whole completion without streaming, shaped like create_chat_completion's response"""
+        request = self.submit(messages, max_tokens, params)
+        parts = []
+        try:
+            while True:
+                item = await request.queue.get()
+                if item is DONE:
+                    break
+                if isinstance(item, GenerationError):
+                    raise item
+                parts.append(item)
+        finally:
+            request.cancel()
+
+        response = {
+            "choices": [{"message": {"role": "assistant", "content": "".join(parts)}, "finish_reason": request.finish_reason}],
+            "usage": {"prompt_tokens": len(request.tokens), "completion_tokens": request.n_generated,
+                      "total_tokens": len(request.tokens) + request.n_generated},
+        }
+        return response, request.finished_at - request.started_at
+
+    def interrupt(self):
+        """Aborts the step being decoded if every prompt in it is canceled. Called after a cancel"""
+        step, requests = self._current
+        if requests and all(r.canceled or r.should_stop() for r in requests):
+            self._abort.abort(step)
+
+    def get_stats(self) -> dict:
+        steps = self.stats["steps"] or 1
+        return {**self.stats, "active": sum(1 for s in self.slots if s.request), "waiting": len(self._waiting),
+                "avg_batch_tokens": round(self.stats["decoded_tokens"] / steps, 2)}
+
+    def close(self):
+        """Stops the decode thread. Requests still running fail, the context is freed"""
+        self._closed = True
+        self._abort.abort(self._current[0])
+        self._incoming.put(None)
+        self._thread.join()
+        for slot in self.slots:
+            if slot.request:
+                self._finish(slot, error="Model switched")
+        while not self._incoming.empty():
+            self._waiting.append(self._incoming.get_nowait())
+        for request in filter(None, self._waiting):
+            request.push(GenerationError("Model switched"))
+        self._waiting.clear()
+        self.batch.close()
+        self.ctx.close()
+
+    # DECODE THREAD
+    def _loop(self):
+        while not self._closed:
+            try:
+                self._admit(block=not any(slot.request for slot in self.slots))
+                if self._closed:
+                    return
+                if any(slot.request for slot in self.slots):
+                    self._step()
+            except Exception as e:
+                logger.error(f"[BATCHING] Step failed: {type(e).__name__}: {e}", exc_info=True)
+                for slot in self.slots:
+                    if slot.request:
+                        self._finish(slot, error=f"{type(e).__name__}: {e}")
+                    self._forget(slot)
+
+    def _admit(self, block: bool):
+        while True:
+            try:
+                request = self._incoming.get(block=block and not self._waiting)
+            except queue.Empty:
+                break
+            if request is None:
+                return
+            self._waiting.append(request)
+            block = False
+
+        while self._waiting:
+            free = [slot for slot in self.slots if slot.request is None]
+            if not free:
+                return
+            request = self._waiting.popleft()
+            if request.canceled or request.should_stop():
+                request.push(DONE)
+                continue
+            try:
+                self._prepare(request)
+            except Exception as e:
+                request.push(GenerationError(f"{type(e).__name__}: {e}"))
+                continue
+            self._assign(request, free)
+
+    def _prepare(self, request: BatchRequest):
+        result = self.format(messages=request.messages)
+        request.tokens = self.llm.tokenize(result.prompt.encode("utf-8"), add_bos=not result.added_special, special=True)
+        if len(request.tokens) + request.max_tokens > self.n_ctx:
+            raise ValueError(f"Prompt of {len(request.tokens)} tokens + {request.max_tokens} does not fit the batch context ({self.n_ctx})")
+
+        stop = list(request.params.stop or [])
+        if result.stop:
+            stop += [result.stop] if isinstance(result.stop, str) else list(result.stop)
+        request.stop = stop
+        request.started_at = time.perf_counter()
+
+    def _assign(self, request: BatchRequest, free: List[Slot]):
+        tokens = request.tokens
+        # ALWAYS EVALUATE AT LEAST THE LAST PROMPT TOKEN, ITS LOGITS START GENERATION
+        limit = len(tokens) - 1
+
+        slot = max(free, key=lambda s: (min(common_prefix(s.tokens, tokens), limit), -s.last_used))
+        reused = min(common_prefix(slot.tokens, tokens), limit)
+
+        # ANOTHER SEQUENCE MAY HOLD A LONGER PREFIX (SAME SYSTEM PROMPT, OTHER SESSION)
+        donor = max(self.slots, key=lambda s: min(common_prefix(s.tokens, tokens), limit))
+        shared = min(common_prefix(donor.tokens, tokens), limit)
+        memory = self.ctx.memory
+
+        if donor is not slot and shared >= reused + SHARE_MIN_TOKENS:
+            llama_cpp.llama_memory_seq_rm(memory, slot.seq_id, -1, -1)
+            llama_cpp.llama_memory_seq_cp(memory, donor.seq_id, slot.seq_id, 0, shared)
+            slot.tokens = tokens[:shared]
+            self.stats["shared_tokens"] += shared
+        else:
+            llama_cpp.llama_memory_seq_rm(memory, slot.seq_id, reused, -1)
+            slot.tokens = slot.tokens[:reused]
+            self.stats["reused_tokens"] += reused
+
+        slot.request = request
+        slot.pending = tokens[len(slot.tokens):]
+        slot.next_token = None
+        slot.sampler = self._make_sampler(request.params)
+        self.stats["requests"] += 1
+        self.stats["max_active"] = max(self.stats["max_active"], sum(1 for s in self.slots if s.request))
+
+    def _make_sampler(self, params) -> "_internals.LlamaSampler":
+        # Same chain as Llama._init_sampler
+        sampler = _internals.LlamaSampler()
+        sampler.add_penalties(PENALTY_LAST_N, params.repeat_penalty, params.frequency_penalty, params.presence_penalty)
+        if params.temperature <= 0:
+            sampler.add_greedy()
+        else:
+            sampler.add_top_k(params.top_k)
+            sampler.add_top_p(params.top_p, 1)
+            sampler.add_min_p(params.min_p, 1)
+            sampler.add_temp(params.temperature)
+            sampler.add_dist(params.seed if params.seed is not None else llama_cpp.LLAMA_DEFAULT_SEED)
+        return sampler
+
+    def _step(self):
+        batch = self.batch.batch
+        batch.n_tokens = 0
+        sample_at: List[Tuple[Slot, int]] = []
+        generating: List[Slot] = []
+        prefilling: List[Tuple[Slot, List[int]]] = []
+
+        def add(slot: Slot, token: int, logits: bool):
+            i = batch.n_tokens
+            batch.token[i] = token
+            batch.pos[i] = len(slot.tokens)
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = slot.seq_id
+            batch.logits[i] = logits
+            batch.n_tokens += 1
+            slot.tokens.append(token)
+            if logits:
+                sample_at.append((slot, i))
+
+        for slot in self.slots:
+            request = slot.request
+            if request and (request.canceled or request.should_stop()):
+                self._finish(slot, reason="canceled")
+
+        # GENERATING SEQUENCES FIRST: ONE TOKEN EACH KEEPS THEIR LATENCY FLAT
+        for slot in self.slots:
+            if slot.request and slot.next_token is not None:
+                add(slot, slot.next_token, True)
+                generating.append(slot)
+                slot.next_token = None
+
+        # PROMPTS FILL THE REST OF THE BATCH (CHUNKED PREFILL)
+        for slot in self.slots:
+            room = self.n_batch - batch.n_tokens
+            if room <= 0:
+                break
+            if slot.request and slot.pending:
+                chunk, slot.pending = slot.pending[:room], slot.pending[room:]
+                for j, token in enumerate(chunk):
+                    add(slot, token, not slot.pending and j == len(chunk) - 1)
+                prefilling.append((slot, chunk))
+
+        if batch.n_tokens == 0:
+            return
+
+        self._step_id += 1
+        self._current = (self._step_id, [slot.request for slot in generating] + [slot.request for slot, _ in prefilling])
+        self._abort.arm(self._step_id)
+        try:
+            code = llama_cpp.llama_decode(self.ctx.ctx, batch)
+        finally:
+            self._abort.disarm()
+            self._current = (0, [])
+        if code == 2:
+            # ABORTED: THE CANCELED PROMPTS LEAVE AT THE NEXT STEP, ANY OTHER ONE RETRIES
+            self._rollback(generating, prefilling)
+            self.stats["aborted_steps"] += 1
+            return
+        if code == 1:
+            # KV CACHE FULL: DROP WHAT IDLE SLOTS KEEP FOR REUSE AND RETRY THE STEP
+            self._rollback(generating, prefilling)
+            if not self._free_idle_cache():
+                raise RuntimeError("KV cache full with every slot busy")
+            return
+        if code != 0:
+            raise RuntimeError(f"llama_decode returned {code}")
+
+        self.stats["steps"] += 1
+        self.stats["decoded_tokens"] += batch.n_tokens
+        self.stats["prefill_tokens"] += sum(len(chunk) for _, chunk in prefilling)
+
+        for slot, index in sample_at:
+            token = slot.sampler.sample(self.ctx, index)
+            self._emit(slot, token)
+
+    def _rollback(self, generating: List[Slot], prefilling: List[Tuple[Slot, List[int]]]):
+        # Undo a step llama_decode refused or aborted: tokens go back to where they came from
+        for slot in generating:
+            slot.next_token = slot.tokens.pop()
+        for slot, chunk in prefilling:
+            del slot.tokens[-len(chunk):]
+            slot.pending = chunk + slot.pending
+        for slot in self.slots:
+            llama_cpp.llama_memory_seq_rm(self.ctx.memory, slot.seq_id, len(slot.tokens), -1)
+
+    def _free_idle_cache(self) -> bool:
+        idle = sorted((s for s in self.slots if s.request is None and s.tokens), key=lambda s: s.last_used)
+        for slot in idle:
+            self._forget(slot)
+        return bool(idle)
+
+    def _forget(self, slot: Slot):
+        llama_cpp.llama_memory_seq_rm(self.ctx.memory, slot.seq_id, -1, -1)
+        slot.tokens = []
+
+    def _emit(self, slot: Slot, token: int):
+        request = slot.request
+        if llama_cpp.llama_vocab_is_eog(self.vocab, token):
+            self._finish(slot, reason="stop")
+            return
+
+        request.n_generated += 1
+        self.stats["generated_tokens"] += 1
+        request.text += request.decoder.decode(self.llm.detokenize([token]))
+
+        # STOP STRINGS: CUT AT THE MATCH, HOLD BACK A TAIL THAT COULD STILL BECOME ONE
+        for stop in request.stop:
+            at = request.text.find(stop, max(0, request.sent - len(stop)))
+            if at != -1:
+                request.text = request.text[:at]
+                self._finish(slot, reason="stop")
+                return
+        hold = max((n for stop in request.stop for n in range(len(stop) - 1, 0, -1) if request.text.endswith(stop[:n])), default=0)
+        if len(request.text) - hold > request.sent:
+            request.push(request.text[request.sent:len(request.text) - hold])
+            request.sent = len(request.text) - hold
+
+        if request.n_generated >= request.max_tokens:
+            self._finish(slot, reason="length")
+        else:
+            slot.next_token = token
+
+    def _finish(self, slot: Slot, reason: Optional[str] = None, error: Optional[str] = None):
+        request = slot.request
+        # A PROMPT CUT OFF MID-PREFILL LEAVES A SHORTER SEQUENCE, STILL A VALID PREFIX TO REUSE
+        slot.request = None
+        slot.pending = []
+        slot.next_token = None
+        slot.last_used = time.monotonic()
+        if slot.sampler:
+            slot.sampler.close()
+            slot.sampler = None
+
+        request.finished_at = time.perf_counter()
+        request.finish_reason = reason
+        if error:
+            request.push(GenerationError(error))
+            return
+        if reason != "canceled" and len(request.text) > request.sent:
+            request.push(request.text[request.sent:])
+        request.push(DONE)
@@ -0,0 +1,99 @@
+"""Sentence embeddings on the loaded model's weights"""
+import threading
+from typing import List
+import numpy as np
+import llama_cpp
+from llama_cpp import _internals
+from action_zone.action_ws import logger
+
+
+class Embedder:
+    """
+    A llama context in embedding mode on the loaded model's weights (no second
+    load). Texts are packed as separate sequences into one llama_decode, up to
+    `n_batch` tokens or `n_seq` texts per call, and each sequence is pooled
+    into one vector. Chat models declare no pooling of their own, so they get
+    mean pooling. Rows come back L2-normalized, so a dot product is the cosine.
+    """
+
+    def __init__(self, llm, n_batch: int = 2048, n_seq: int = 32):
+        self.llm = llm
+        self.n_batch = n_batch
+        self.n_seq = n_seq
+        self.dim = llm.n_embd()
+        self.ctx = self._create_context(llama_cpp.LLAMA_POOLING_TYPE_UNSPECIFIED)
+        if llama_cpp.llama_pooling_type(self.ctx.ctx) == llama_cpp.LLAMA_POOLING_TYPE_NONE:
+            self.ctx.close()
+            self.ctx = self._create_context(llama_cpp.LLAMA_POOLING_TYPE_MEAN)
+        self.batch = _internals.LlamaBatch(n_tokens=n_batch, embd=0, n_seq_max=n_seq, verbose=False)
+        # ONE CONTEXT, CALLED FROM EXECUTOR THREADS
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"texts": 0, "tokens": 0, "decodes": 0}
+
+    def _create_context(self, pooling_type: int) -> "_internals.LlamaContext":
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = self.n_batch
+        # POOLED SEQUENCES MUST FIT IN ONE UBATCH
+        params.n_batch = self.n_batch
+        params.n_ubatch = self.n_batch
+        params.n_seq_max = self.n_seq
+        params.embeddings = True
+        params.pooling_type = pooling_type
+        params.kv_unified = True
+        params.n_threads = self.llm.context_params.n_threads
+        params.n_threads_batch = self.llm.context_params.n_threads_batch
+        return _internals.LlamaContext(model=self.llm._model, params=params, verbose=False)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), dim) float32 matrix of normalized embeddings. Texts longer than n_batch tokens are cut"""
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        tokenized = [self.llm.tokenize(t.encode("utf-8"), add_bos=True, special=False)[:self.n_batch] or [self.llm.token_bos()]
+                     for t in texts]
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedder closed (model switched)")
+            start = 0
+            while start < len(tokenized):
+                # PACK AS MANY TEXTS AS FIT INTO ONE DECODE
+                end, n_tokens = start, 0
+                while end < len(tokenized) and end - start < self.n_seq and n_tokens + len(tokenized[end]) <= self.n_batch:
+                    n_tokens += len(tokenized[end])
+                    end += 1
+                self._decode(tokenized[start:end], out[start:end])
+                self.stats["tokens"] += n_tokens
+                start = end
+        self.stats["texts"] += len(texts)
+        return out
+
+    def _decode(self, sequences: List[List[int]], out: np.ndarray):
+        batch = self.batch.batch
+        batch.n_tokens = 0
+        for seq_id, tokens in enumerate(sequences):
+            for pos, token in enumerate(tokens):
+                i = batch.n_tokens
+                batch.token[i] = token
+                batch.pos[i] = pos
+                batch.seq_id[i][0] = seq_id
+                batch.n_seq_id[i] = 1
+                batch.logits[i] = True
+                batch.n_tokens += 1
+
+        llama_cpp.llama_memory_clear(self.ctx.memory, True)
+        if llama_cpp.llama_decode(self.ctx.ctx, batch) != 0:
+            raise RuntimeError("llama_decode failed while embedding")
+        self.stats["decodes"] += 1
+
+        for seq_id in range(len(sequences)):
+            ptr = llama_cpp.llama_get_embeddings_seq(self.ctx.ctx, seq_id)
+            out[seq_id] = np.ctypeslib.as_array(ptr, shape=(self.dim,))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self.batch.close()
+            self.ctx.close()
+            logger.info(f"[EMBEDDINGS] Context closed: {self.stats}")
@@ -0,0 +1,122 @@
+"""Generation engine: decode loop on a worker thread, coalesced frames on the event loop"""
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+from action_zone.action_ws import logger
+
+# QUEUE SENTINEL
+DONE = object()
+
+
+class GenerationError(Exception):
+    """Wraps an exception raised inside the decode thread"""
+
+
+class GenerationEngine:
+    """
+    Owns the thread that talks to llama.
+    The decode loop runs there and pushes tokens into an asyncio.Queue,
+    so the event loop only moves strings and never runs model compute.
+    """
+
+    def __init__(self, flush_interval: float = 0.015, flush_tokens: int = 16):
+        self.flush_interval = flush_interval
+        self.flush_tokens = flush_tokens
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llama-decode")
+
+    def run(self, fn: Callable, *args) -> "asyncio.Future":
+        """Runs a blocking model call on the decode thread"""
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def stream(self, make_stream: Callable[[], Iterator[dict]],
+                     should_stop: Callable[[], bool],
+                     after: Optional[Callable[[], None]] = None) -> AsyncIterator[List[str]]:
+        """
+        Yields batches of tokens, one batch per flush.
+        `make_stream` and `after` run on the decode thread; `should_stop` is
+        polled there between tokens, and an exception raised once it is true
+        (a decode aborted by a cancel) ends the stream like a stop.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        # SET WHEN THE CONSUMER GOES AWAY (SEND FAILURE, TASK CANCELLED)
+        detached = threading.Event()
+
+        def produce():
+            try:
+                stream = make_stream()
+                try:
+                    for chunk in stream:
+                        if detached.is_set() or should_stop():
+                            break
+                        token = chunk["choices"][0]["delta"].get("content", "")
+                        if token:
+                            loop.call_soon_threadsafe(queue.put_nowait, token)
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close:
+                        close()
+                if after:
+                    after()
+                loop.call_soon_threadsafe(queue.put_nowait, DONE)
+            except Exception as e:
+                # A decode aborted by a cancel raises too: that is a stop, not a failure
+                stopped = detached.is_set() or should_stop()
+                loop.call_soon_threadsafe(queue.put_nowait, DONE if stopped else GenerationError(f"{type(e).__name__}: {e}"))
+
+        producer = loop.run_in_executor(self._executor, produce)
+        try:
+            async for batch in self._coalesce(queue):
+                yield batch
+        finally:
+            detached.set()
+            await producer
+
+    async def frames(self, queue: asyncio.Queue) -> AsyncIterator[List[str]]:
+        """Same flushing for a queue fed by another producer: tokens, then DONE or a GenerationError"""
+        async for batch in self._coalesce(queue):
+            yield batch
+
+    async def replay(self, tokens: List[str]) -> AsyncIterator[List[str]]:
+        """Frames for tokens already known (a cached answer), as fast as the socket takes them"""
+        for i in range(0, len(tokens), self.flush_tokens):
+            yield tokens[i:i + self.flush_tokens]
+
+    async def _coalesce(self, queue: asyncio.Queue) -> AsyncIterator[List[str]]:
+        # WAIT FOR THE FIRST TOKEN, THEN GATHER UNTIL THE FLUSH DEADLINE OR TOKEN LIMIT
+        while True:
+            item = await queue.get()
+            if item is DONE:
+                return
+            if isinstance(item, GenerationError):
+                raise item
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            finished = None
+
+            while len(batch) < self.flush_tokens:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = queue.get_nowait() if not queue.empty() else await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is DONE or isinstance(item, GenerationError):
+                    finished = item
+                    break
+                batch.append(item)
+
+            yield batch
+
+            if finished is DONE:
+                return
+            if finished is not None:
+                logger.error(f"[ENGINE] Decode thread failed: {finished}")
+                raise finished
@@ -1,10 +1,27 @@
+import os
 from action_zone.action_ws import PROMPT_SYSTEM_PATH
+
+# PATH -> (MTIME_NS, SIZE, CONTENT)
+_prompt_cache = {}
+
 def get_prompt_system(prompt): 
+    """Content of the system prompt file, re-read only when its mtime or size changes"""
+    try:
+        stat = os.stat(prompt)
+    except OSError:
+        _prompt_cache.pop(str(prompt), None)
+        return ""
+
+    cached = _prompt_cache.get(str(prompt))
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
     try:
         with open(prompt, "r", encoding="utf-8") as f:
             content = f.read()
-            return content
     except:
         return ""
+    _prompt_cache[str(prompt)] = (stat.st_mtime_ns, stat.st_size, content)
+    return content
 
-print(f"Conteudo: {get_prompt_system(PROMPT_SYSTEM_PATH)}")
\ No newline at end of file
+print(f"Conteudo: {get_prompt_system(PROMPT_SYSTEM_PATH)}")
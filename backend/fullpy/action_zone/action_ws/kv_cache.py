@@ -0,0 +1,204 @@
+"""Session-keyed KV-state cache for the WebSocket server"""
+import pickle
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+from action_zone.action_ws import logger
+
+
+class SessionStateCache:
+    """
+    Keeps one llama state (Llama.save_state()) per chat session, so a session
+    that comes back after another one used the model only evaluates the new
+    tokens instead of re-prefilling its whole history.
+
+    Two tiers, both LRU and bounded in bytes:
+        RAM  -> states kept as LlamaState objects.
+        DISK -> states evicted from RAM are pickled to `disk_dir`.
+
+    The disk tier outlives the process: states saved for `model_name` are
+    indexed again at startup, so a session that reconnects after a restart
+    still skips its prefill.
+    """
+
+    def __init__(self, ram_bytes: int, disk_bytes: int, disk_dir: Path, model_name: str = ""):
+        self.ram_bytes = ram_bytes
+        self.disk_bytes = disk_bytes
+        self.disk_dir = Path(disk_dir)
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+        self._ram: "OrderedDict[str, tuple[Any, int]]" = OrderedDict()
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._ram_used = 0
+        self._disk_used = 0
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "ram_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "ram_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+        self._model_file = self.disk_dir / "MODEL"
+        self._load_disk(model_name)
+
+    @staticmethod
+    def state_size(state: Any) -> int:
+        # LlamaState implements __sizeof__ (input_ids + scores + llama_state)
+        return state.__sizeof__()
+
+    def _disk_file(self, session_id: str) -> Path:
+        # HEX OF THE ID: SAFE AS A FILE NAME AND REVERSIBLE AT STARTUP
+        return self.disk_dir / f"{session_id.encode('utf-8').hex()}.state"
+
+    def _load_disk(self, model_name: str):
+        # STATES FROM A PREVIOUS PROCESS ARE ONLY VALID FOR THE SAME MODEL
+        previous = self._model_file.read_text(encoding="utf-8") if self._model_file.exists() else None
+        files = sorted(self.disk_dir.glob("*.state"), key=lambda f: f.stat().st_mtime)
+        if previous != model_name:
+            for stale in files:
+                stale.unlink(missing_ok=True)
+            self._model_file.write_text(model_name, encoding="utf-8")
+            return
+
+        for file in files:
+            try:
+                session_id = bytes.fromhex(file.stem).decode("utf-8")
+            except ValueError:
+                file.unlink(missing_ok=True)
+                continue
+            self._disk[session_id] = file.stat().st_size
+            self._disk_used += self._disk[session_id]
+        while self._disk_used > self.disk_bytes and self._disk:
+            self._drop_disk(next(iter(self._disk)))
+        if self._disk:
+            logger.info(f"[KV_CACHE] {len(self._disk)} session states kept from the previous run")
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """Returns the cached state for a session, promoting disk hits to RAM"""
+        with self._lock:
+            entry = self._ram.get(session_id)
+            if entry is not None:
+                self._ram.move_to_end(session_id)
+                self.stats["ram_hits"] += 1
+                return entry[0]
+
+            if session_id not in self._disk:
+                self.stats["misses"] += 1
+                return None
+
+            file = self._disk_file(session_id)
+            try:
+                with open(file, "rb") as f:
+                    state = pickle.load(f)
+            except Exception as e:
+                logger.warning(f"[KV_CACHE] Could not read state for {session_id}: {e}")
+                self._drop_disk(session_id)
+                self.stats["misses"] += 1
+                return None
+
+            self._drop_disk(session_id)
+            self.stats["disk_hits"] += 1
+            self._put_ram(session_id, state, self.state_size(state))
+            return state
+
+    def put(self, session_id: str, state: Any):
+        """Stores the latest state of a session, replacing the previous one"""
+        size = self.state_size(state)
+        with self._lock:
+            self._drop_ram(session_id)
+            self._drop_disk(session_id)
+            self.stats["stores"] += 1
+
+            if size <= self.ram_bytes:
+                self._put_ram(session_id, state, size)
+            else:
+                self._put_disk(session_id, state, size)
+
+    def spill(self, session_id: str):
+        """Moves a session's state from RAM to disk (its client left, it may come back)"""
+        with self._lock:
+            entry = self._ram.get(session_id)
+            if entry is None:
+                return
+            self._drop_ram(session_id)
+            self._put_disk(session_id, *entry)
+
+    def session_ids(self) -> Set[str]:
+        with self._lock:
+            return set(self._ram) | set(self._disk)
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._drop_ram(session_id)
+            self._drop_disk(session_id)
+
+    def clear(self, model_name: Optional[str] = None):
+        """Drops every state; `model_name` tags the states saved from now on"""
+        with self._lock:
+            if model_name is not None:
+                self._model_file.write_text(model_name, encoding="utf-8")
+            for session_id in list(self._ram):
+                self._drop_ram(session_id)
+            for session_id in list(self._disk):
+                self._drop_disk(session_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                **self.stats,
+                "ram_entries": len(self._ram),
+                "ram_bytes": self._ram_used,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_used,
+            }
+
+    # TIERS (CALLED WITH THE LOCK HELD)
+    def _put_ram(self, session_id: str, state: Any, size: int):
+        self._ram[session_id] = (state, size)
+        self._ram_used += size
+
+        while self._ram_used > self.ram_bytes and len(self._ram) > 1:
+            old_id, (old_state, old_size) = self._ram.popitem(last=False)
+            self._ram_used -= old_size
+            self.stats["ram_evictions"] += 1
+            self._put_disk(old_id, old_state, old_size)
+
+    def _put_disk(self, session_id: str, state: Any, size: int):
+        # `size` is the in-memory estimate; the disk tier counts pickle bytes, as _load_disk() does
+        if size > self.disk_bytes:
+            return
+
+        self._evict_disk(size)
+        try:
+            with open(self._disk_file(session_id), "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+        except Exception as e:
+            logger.warning(f"[KV_CACHE] Could not write state for {session_id}: {e}")
+            self._disk_file(session_id).unlink(missing_ok=True)
+            return
+
+        self._evict_disk(size)
+        self._disk[session_id] = size
+        self._disk_used += size
+
+    def _evict_disk(self, incoming: int):
+        while self._disk_used + incoming > self.disk_bytes and self._disk:
+            self._drop_disk(next(iter(self._disk)))
+            self.stats["disk_evictions"] += 1
+
+    def _drop_ram(self, session_id: str):
+        entry = self._ram.pop(session_id, None)
+        if entry is not None:
+            self._ram_used -= entry[1]
+
+    def _drop_disk(self, session_id: str):
+        size = self._disk.pop(session_id, None)
+        if size is not None:
+            self._disk_used -= size
+            self._disk_file(session_id).unlink(missing_ok=True)
@@ -0,0 +1,59 @@
+"""Immutable sampling parameters, replaced when the config is pushed"""
+from dataclasses import dataclass, fields
+from typing import Optional, Tuple
+from action_zone.action_sqlite.control_config import ControlConfig
+
+
+@dataclass(frozen=True, slots=True)
+class SamplingParams:
+    """
+    Snapshot of one model's sampling config.
+    A prompt captures the current snapshot once, so a config push that lands
+    mid-generation only affects the prompts that start after it.
+    """
+    temperature: float = 0.7
+    top_p: float = 0.9
+    top_k: int = 40
+    tokens: int = 512
+    repeat_penalty: float = 1.1
+    frequency_penalty: float = 0.0
+    presence_penalty: float = 0.0
+    min_p: float = 0.05
+    tfs_z: float = 1.0
+    mirostat_tau: float = 5.0
+    seed: Optional[int] = None
+    stop: Optional[Tuple[str, ...]] = None
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> "SamplingParams":
+        """Builds a snapshot from a ControlConfig row, missing values fall back to SAFE_DEFAULTS"""
+        config = config or {}
+        values = {}
+        for field in fields(cls):
+            value = config.get(field.name)
+            if value is None:
+                value = ControlConfig.SAFE_DEFAULTS.get(field.name, field.default)
+            values[field.name] = value
+        if values["stop"] is not None:
+            values["stop"] = tuple(values["stop"])
+        return cls(**values)
+
+    @classmethod
+    def load(cls, model_name: str) -> "SamplingParams":
+        return cls.from_config(ControlConfig({"id_model": model_name}).get())
+
+    def completion_kwargs(self) -> dict:
+        """Keyword arguments for create_chat_completion (max_tokens is set by the caller)"""
+        return {
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "top_k": self.top_k,
+            "repeat_penalty": self.repeat_penalty,
+            "frequency_penalty": self.frequency_penalty,
+            "presence_penalty": self.presence_penalty,
+            "min_p": self.min_p,
+            "tfs_z": self.tfs_z,
+            "mirostat_tau": self.mirostat_tau,
+            "seed": self.seed,
+            "stop": list(self.stop) if self.stop else None,
+        }
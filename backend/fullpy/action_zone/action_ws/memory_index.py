@@ -0,0 +1,142 @@
+"""Long-term memory: embeddings of a session's older messages, searched instead of resent"""
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from action_zone.action_ws import logger
+
+
+class SessionMemory:
+    """
+    Vectors of one session's messages, one row each, in a float32 matrix
+    memory-mapped from `<stem>.f32`. `<stem>.json` holds the model they were
+    computed with, the row count and the message index of every row; it is
+    rewritten after the rows are flushed, so rows past `count` (a crash
+    mid-write) are simply ignored. The file grows by doubling.
+    """
+
+    INITIAL_ROWS = 256
+
+    def __init__(self, stem: Path, dim: int, model: str):
+        self.vectors_file = stem.with_suffix(".f32")
+        self.meta_file = stem.with_suffix(".json")
+        self.dim = dim
+        self.model = model
+        self.messages: List[int] = []
+        self.lock = threading.Lock()
+
+        meta = self._read_meta()
+        if meta and meta.get("model") == model and meta.get("dim") == dim and self.vectors_file.exists():
+            self.messages = meta["messages"]
+        self._map(max(self.INITIAL_ROWS, len(self.messages)))
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            return json.loads(self.meta_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _map(self, rows: int):
+        # CREATE OR GROW THE FILE, THEN MAP ALL OF IT
+        size = rows * self.dim * 4
+        with open(self.vectors_file, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self.capacity = rows
+        self.matrix = np.memmap(self.vectors_file, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    @property
+    def indexed(self) -> Set[int]:
+        return set(self.messages)
+
+    def add(self, vectors: np.ndarray, message_indexes: List[int]):
+        count = len(self.messages)
+        if count + len(vectors) > self.capacity:
+            self.matrix.flush()
+            self._map(max(self.capacity * 2, count + len(vectors)))
+        self.matrix[count:count + len(vectors)] = vectors
+        self.matrix.flush()
+        self.messages.extend(message_indexes)
+
+        tmp = self.meta_file.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"model": self.model, "dim": self.dim, "messages": self.messages}), encoding="utf-8")
+        tmp.replace(self.meta_file)
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """Top-k (message index, cosine) for a normalized query, best first"""
+        count = len(self.messages)
+        if not count or k <= 0:
+            return []
+        scores = self.matrix[:count] @ query
+        if k < count:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(count)
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(self.messages[i], float(scores[i])) for i in top]
+
+    def close(self):
+        self.matrix.flush()
+        del self.matrix
+
+
+class MemoryIndex:
+    """Open SessionMemory files by session, under `directory`"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._open: Dict[str, SessionMemory] = {}
+        self._lock = threading.Lock()
+
+    def _stem(self, session_id: str) -> Path:
+        return self.directory / session_id.encode("utf-8").hex()
+
+    def open(self, session_id: str, dim: int, model: str) -> SessionMemory:
+        """The session's memory; vectors from another model (or dimension) are discarded"""
+        with self._lock:
+            memory = self._open.get(session_id)
+            if memory is not None and memory.model == model and memory.dim == dim:
+                return memory
+            if memory is not None:
+                memory.close()
+            stem = self._stem(session_id)
+            meta = stem.with_suffix(".json")
+            if meta.exists() and not self._compatible(meta, dim, model):
+                # REBUILT FROM THE HISTORY ON THE NEXT RECALL
+                stem.with_suffix(".f32").unlink(missing_ok=True)
+                meta.unlink(missing_ok=True)
+                logger.info(f"[MEMORY] Reindexing session {session_id} for {model}")
+            memory = self._open[session_id] = SessionMemory(stem, dim, model)
+            return memory
+
+    @staticmethod
+    def _compatible(meta: Path, dim: int, model: str) -> bool:
+        try:
+            data = json.loads(meta.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        return data.get("model") == model and data.get("dim") == dim
+
+    def close(self, session_id: str):
+        with self._lock:
+            memory = self._open.pop(session_id, None)
+        if memory is not None:
+            with memory.lock:
+                memory.close()
+
+    def drop(self, session_id: str):
+        self.close(session_id)
+        stem = self._stem(session_id)
+        for suffix in (".f32", ".json", ".json.tmp"):
+            stem.with_suffix(suffix).unlink(missing_ok=True)
+
+    def session_ids(self) -> Set[str]:
+        ids = set()
+        for meta in self.directory.glob("*.json"):
+            try:
+                ids.add(bytes.fromhex(meta.stem).decode("utf-8"))
+            except ValueError:
+                continue
+        return ids
@@ -0,0 +1,65 @@
+"""Metrics of the WebSocket inference server, scraped from GET /metrics on the WS port"""
+from http import HTTPStatus
+from action_zone.utils.metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge, Histogram
+
+TTFT_SECONDS = Histogram(
+    "ws_ttft_seconds", "Time from prompt submission to the first token frame, queue wait included",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+)
+TOKENS_PER_SECOND = Histogram(
+    "ws_tokens_per_second", "Decode speed of each completed prompt",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)
+)
+TOKENS_TOTAL = Counter("ws_tokens_generated_total", "Tokens sent to clients")
+PROMPTS_TOTAL = Counter("ws_prompts_total", "Finished prompts by outcome", ["outcome"])
+PROMPTS_ACTIVE = Gauge("ws_prompts_active", "Prompts being generated")
+PROMPTS_QUEUED = Gauge("ws_prompts_queued", "Prompts waiting in the scheduler")
+SESSIONS = Gauge("ws_sessions", "Connected WebSocket sessions")
+CACHE_HITS = Counter("ws_cache_hits_total", "Cache hits by cache", ["cache"])
+CACHE_MISSES = Counter("ws_cache_misses_total", "Cache misses by cache", ["cache"])
+SEND_QUEUE_FRAMES = Gauge("ws_send_queue_frames", "Frames waiting to be written to each connection", ["session", "connection"])
+SEND_MERGED_TOTAL = Counter("ws_send_merged_total", "Token batches merged into a waiting frame because the client lagged")
+SLOW_CLIENTS_DROPPED = Counter("ws_slow_clients_dropped_total", "Connections closed because they stopped taking frames")
+CANCEL_STOP_SECONDS = Histogram(
+    "ws_cancel_stop_seconds", "Time from a cancel (or a disconnect) to the prompt's decode stopping",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+CANCEL_TOKENS_SAVED = Counter("ws_cancel_tokens_saved_total", "Completion tokens canceled prompts did not generate (max_tokens - generated)")
+EVENT_LOOP_LAG = Histogram(
+    "ws_event_loop_lag_seconds", "How late the event loop wakes up from a timer",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+STARTUP_SECONDS = Gauge("ws_startup_seconds", "Duration of each startup phase; phase=\"ready\" is the time to ready", ["phase"])
+
+
+def bind_server(server):
+    """Reads the stats the server components already keep, at scrape time"""
+    PROMPTS_ACTIVE.set_function(lambda: len(server.scheduler.running))
+    PROMPTS_QUEUED.set_function(lambda: server.scheduler.get_stats()["queued"])
+    SESSIONS.set_function(lambda: len(server.session_history))
+    CACHE_HITS.labels("kv_ram").set_function(lambda: server.kv_cache.stats["ram_hits"])
+    CACHE_HITS.labels("kv_disk").set_function(lambda: server.kv_cache.stats["disk_hits"])
+    CACHE_MISSES.labels("kv").set_function(lambda: server.kv_cache.stats["misses"])
+    CACHE_HITS.labels("prefix").set_function(lambda: _prefix_stats(server)["hits"])
+    CACHE_MISSES.labels("prefix").set_function(lambda: _prefix_stats(server)["misses"])
+    CACHE_HITS.labels("response").set_function(lambda: _response_stats(server)["hits"])
+    CACHE_MISSES.labels("response").set_function(lambda: _response_stats(server)["misses"])
+
+
+def _prefix_stats(server) -> dict:
+    cache = getattr(server.llm, "cache", None)
+    return cache.stats if hasattr(cache, "materialize") else {"hits": 0, "misses": 0}
+
+
+def _response_stats(server) -> dict:
+    return server.response_cache.stats if server.response_cache else {"hits": 0, "misses": 0}
+
+
+def process_request(connection, request):
+    """websockets hook: answers GET /metrics on the WS port, lets every other path upgrade"""
+    if request.path.split("?")[0] != "/metrics":
+        return None
+    response = connection.respond(HTTPStatus.OK, REGISTRY.render())
+    response.headers["Content-Type"] = CONTENT_TYPE
+    return response
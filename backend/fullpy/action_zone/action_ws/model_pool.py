@@ -0,0 +1,118 @@
+"""Pool of loaded models for hot switching"""
+import os
+import time
+import psutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from action_zone.action_ws import logger, resolve_model
+
+
+class ModelPool:
+    """
+    Keeps up to `max_models` models loaded (mmap), least recently used first
+    out. Before a load, models are evicted until the file fits in available
+    RAM while leaving `ram_reserve_bytes` free. The active model is never
+    evicted. Loads run on their own thread so generation keeps going while
+    the next model is preloaded.
+    """
+
+    def __init__(self, factory: Callable[[str, str, str], Any], max_models: int = 2, ram_reserve_bytes: int = 0):
+        # factory(model_name, model_path, chat_format) -> Llama
+        self.factory = factory
+        self.max_models = max_models
+        self.ram_reserve_bytes = ram_reserve_bytes
+        self.active: Optional[str] = None
+
+        self._models: "OrderedDict[str, Any]" = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        self.stats = {"loads": 0, "hits": 0, "evictions": 0, "load_seconds_total": 0.0}
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._models)
+
+    def preload(self, model_name: str) -> Future:
+        """Starts loading a model in the background, returns a future of the Llama object"""
+        with self._lock:
+            if model_name in self._models:
+                self._models.move_to_end(model_name)
+                self.stats["hits"] += 1
+                future: Future = Future()
+                future.set_result(self._models[model_name])
+                return future
+
+            if model_name not in self._loading:
+                self._loading[model_name] = self._loader.submit(self._load, model_name)
+            return self._loading[model_name]
+
+    def get(self, model_name: str) -> Any:
+        """Blocking load (or pool hit)"""
+        return self.preload(model_name).result()
+
+    def activate(self, model_name: str) -> Any:
+        llm = self.get(model_name)
+        self.active = model_name
+        return llm
+
+    def replace(self, model_name: str, llm: Any) -> Any:
+        """Puts a model built again (its load-time config changed) in place of the loaded one, returns the old one"""
+        with self._lock:
+            old = self._models.get(model_name)
+            self._models[model_name] = llm
+            return old
+
+    def evict(self, model_name: str) -> bool:
+        with self._lock:
+            if model_name == self.active or model_name not in self._models:
+                return False
+            llm = self._models.pop(model_name)
+            self.stats["evictions"] += 1
+
+        close = getattr(llm, "close", None)
+        if close:
+            close()
+        logger.info(f"[MODEL_POOL] Evicted {model_name}")
+        return True
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "active": self.active, "loaded": list(self._models), "loading": list(self._loading)}
+
+    def _make_room(self, needed: int):
+        while True:
+            with self._lock:
+                candidates = [name for name in self._models if name != self.active]
+                full = len(self._models) >= self.max_models
+            low_ram = psutil.virtual_memory().available - needed < self.ram_reserve_bytes
+
+            if not (full or low_ram) or not candidates:
+                if low_ram:
+                    logger.warning(f"[MODEL_POOL] Low RAM: loading needs {needed / 1024**3:.1f} GB with nothing left to evict")
+                return
+            self.evict(candidates[0])
+
+    def _load(self, model_name: str) -> Any:
+        try:
+            config = resolve_model(model_name)
+            if not os.path.exists(config["model_path"]):
+                raise FileNotFoundError(f"Model not found: {config['model_path']}")
+
+            self._make_room(os.path.getsize(config["model_path"]))
+
+            start = time.perf_counter()
+            llm = self.factory(model_name, config["model_path"], config["chat_format"])
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self._models[model_name] = llm
+                self.stats["loads"] += 1
+                self.stats["load_seconds_total"] += elapsed
+            logger.info(f"[MODEL_POOL] Loaded {model_name} in {elapsed:.2f}s")
+            return llm
+        finally:
+            with self._lock:
+                self._loading.pop(model_name, None)
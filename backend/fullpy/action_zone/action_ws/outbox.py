@@ -0,0 +1,115 @@
+"""Bounded outbound buffer of one prompt: generation never waits for the socket"""
+import json
+import asyncio
+from collections import deque
+from typing import Callable, Deque, Optional
+from websockets.protocol import State
+from websockets.exceptions import ConnectionClosed
+from action_zone.action_ws import logger
+
+
+class Outbox:
+    """
+    Frames of one prompt on their way to its WebSocket. The generation side
+    calls token() / frame() without awaiting; a sender task writes them as
+    fast as the socket drains. Once `max_frames` wait, new text is merged
+    into the last token frame: a lagging client gets fewer, larger frames
+    and the prompt still finishes (and frees its slot) at decode speed.
+
+    A client that takes no frame for `stall_seconds`, or lets more than
+    `max_bytes` of text pile up, is a stalled consumer: `on_stall` runs once
+    and the outbox drops whatever is left.
+    """
+
+    def __init__(self, websocket, prompt_id: str, max_frames: int = 64, max_bytes: int = 4 * 1024**2,
+                 stall_seconds: float = 30.0, on_stall: Optional[Callable[["Outbox"], None]] = None):
+        self.websocket = websocket
+        self.prompt_id = prompt_id
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.stall_seconds = stall_seconds
+        self.on_stall = on_stall
+
+        self._frames: Deque[dict] = deque()
+        self._bytes = 0
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self.stalled = False
+        self.disconnected = False
+        self.stats = {"frames": 0, "merged": 0, "max_depth": 0}
+        self.task = asyncio.create_task(self._run())
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    @property
+    def dead(self) -> bool:
+        """Nothing put from now on will reach the client"""
+        return self.stalled or self.disconnected or getattr(self.websocket, "state", State.OPEN) in (State.CLOSING, State.CLOSED)
+
+    def token(self, text: str):
+        if self.dead or not text:
+            return
+        last = self._frames[-1] if self._frames else None
+        if len(self._frames) >= self.max_frames and last is not None and "token" in last:
+            last["token"] += text
+            self.stats["merged"] += 1
+        else:
+            self._frames.append({"promptId": self.prompt_id, "token": text, "type": "token"})
+        self._bytes += len(text)
+        if self._bytes > self.max_bytes:
+            self._stall(f"{self._bytes} bytes pending")
+            return
+        self._notify()
+
+    def frame(self, frame: dict):
+        """A control frame (complete, error): sent after the tokens before it, never merged"""
+        if self.dead:
+            return
+        self._frames.append(frame)
+        self._notify()
+
+    def close(self):
+        """No more frames: the sender exits once the ones queued are out"""
+        self._closed = True
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            while not self._frames:
+                if self._closed or self.dead:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            frame = self._frames.popleft()
+            self._bytes -= len(frame.get("token", ""))
+            try:
+                await asyncio.wait_for(self.websocket.send(json.dumps(frame)), self.stall_seconds)
+            except asyncio.TimeoutError:
+                self._stall(f"no frame taken for {self.stall_seconds}s")
+                return
+            except ConnectionClosed:
+                self.disconnected = True
+                self._drop()
+                return
+            self.stats["frames"] += 1
+
+    def _notify(self):
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._frames))
+        self._wakeup.set()
+
+    def _stall(self, reason: str):
+        if self.dead:
+            return
+        self.stalled = True
+        logger.warning(f"[OUTBOX] Dropping the client of prompt {self.prompt_id}: {reason}")
+        self._drop()
+        self._wakeup.set()
+        if self.on_stall:
+            self.on_stall(self)
+
+    def _drop(self):
+        self._frames.clear()
+        self._bytes = 0
@@ -0,0 +1,219 @@
+"""Shared prefix (radix tree) KV cache across sessions"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from llama_cpp.llama_cache import BaseLlamaCache
+from action_zone.action_ws import logger
+
+
+class RadixNode:
+    __slots__ = ('edge', 'parent', 'children', 'state', 'size')
+
+    def __init__(self, edge: Tuple[int, ...] = (), parent: Optional["RadixNode"] = None):
+        self.edge = edge
+        self.parent = parent
+        self.children: Dict[int, "RadixNode"] = {}
+        self.state: Any = None
+        self.size = 0
+
+
+class PrefixStateCache(BaseLlamaCache):
+    """
+    Token radix tree of prompts seen by one model.
+    The point where two prompts diverge (system prompt + template header for
+    new sessions) becomes a shared prefix: it is evaluated once, snapshotted
+    with only those tokens in the KV cache, and loaded by every later prompt
+    that starts with it. Llama then evaluates only the remaining suffix.
+
+    Plugged in through Llama.set_cache(): llama-cpp calls __getitem__ with
+    the prompt tokens before evaluation and __setitem__ with the final state.
+    """
+
+    def __init__(self, capacity_bytes: int, min_prefix_tokens: int = 32, max_prefix_tokens: int = 2048,
+                 max_tree_tokens: int = 256 * 1024):
+        super().__init__(capacity_bytes)
+        self.min_prefix_tokens = min_prefix_tokens
+        # ONLY THE HEAD OF EACH PROMPT GOES INTO THE TREE, THAT IS WHERE PREFIXES ARE SHARED
+        self.max_prefix_tokens = max_prefix_tokens
+        # TOKENS ON ALL EDGES: PAST IT, THE LEAST RECENTLY SEEN STATELESS HEADS ARE PRUNED
+        self.max_tree_tokens = max_tree_tokens
+        self.root = RadixNode()
+        # NODES HOLDING A STATE, AND NODES WHERE A PROMPT HEAD ENDED: LEAST RECENTLY USED FIRST
+        self._stateful: "OrderedDict[RadixNode, None]" = OrderedDict()
+        self._heads: "OrderedDict[RadixNode, None]" = OrderedDict()
+        self._tokens = 0
+        self._lock = threading.Lock()
+        self._used = 0
+        self._pending: Optional[Tuple[int, ...]] = None
+        self._last_state: Any = None
+        self.stats = {"hits": 0, "misses": 0, "reused_tokens": 0, "prefixes": 0, "evictions": 0}
+
+    @property
+    def cache_size(self) -> int:
+        return self._used
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {**self.stats, "hit_rate": self.stats["hits"] / lookups if lookups else 0.0, "bytes": self._used, "tree_tokens": self._tokens}
+
+    # TREE
+    def _walk(self, tokens: Sequence[int]) -> Tuple[List[Tuple[RadixNode, int]], int]:
+        """Nodes along `tokens` with their depth, and how many tokens matched"""
+        node, depth, path = self.root, 0, []
+        while depth < len(tokens):
+            child = node.children.get(tokens[depth])
+            if child is None:
+                break
+            common = 0
+            for a, b in zip(child.edge, tokens[depth:]):
+                if a != b:
+                    break
+                common += 1
+            depth += common
+            if common < len(child.edge):
+                break
+            node = child
+            path.append((node, depth))
+        return path, depth
+
+    def _insert(self, tokens: Tuple[int, ...]) -> RadixNode:
+        node, depth = self.root, 0
+        while depth < len(tokens):
+            child = node.children.get(tokens[depth])
+            if child is None:
+                if node is not self.root and not node.children and node.state is None:
+                    # A conversation growing past its own stateless leaf extends that edge
+                    node.edge += tokens[depth:]
+                    self._tokens += len(tokens) - depth
+                    return node
+                self._tokens += len(tokens) - depth
+                leaf = RadixNode(tokens[depth:], node)
+                node.children[tokens[depth]] = leaf
+                return leaf
+            common = 0
+            for a, b in zip(child.edge, tokens[depth:]):
+                if a != b:
+                    break
+                common += 1
+            if common < len(child.edge):
+                # SPLIT THE EDGE AT THE DIVERGENCE POINT
+                middle = RadixNode(child.edge[:common], node)
+                child.edge = child.edge[common:]
+                child.parent = middle
+                middle.children[child.edge[0]] = child
+                node.children[tokens[depth]] = middle
+                child = middle
+            node = child
+            depth += common
+        return node
+
+    def _prune(self, node: RadixNode):
+        """Drops the stateless leaves above `node`, then merges a stateless node left with one child into it"""
+        while node is not self.root and node.state is None and not node.children:
+            del node.parent.children[node.edge[0]]
+            self._heads.pop(node, None)
+            self._tokens -= len(node.edge)
+            node = node.parent
+        if node is not self.root and node.state is None and len(node.children) == 1:
+            child = next(iter(node.children.values()))
+            child.edge = node.edge + child.edge
+            child.parent = node.parent
+            node.parent.children[child.edge[0]] = child
+            self._heads.pop(node, None)
+
+    def _trim(self):
+        # Heads inside the tree or holding a state are kept: only stateless leaves go
+        while self._tokens > self.max_tree_tokens and self._heads:
+            node, _ = self._heads.popitem(last=False)
+            if node.state is None and not node.children:
+                self._prune(node)
+
+    def _evict(self):
+        while self._used > self.capacity_bytes and self._stateful:
+            node, _ = self._stateful.popitem(last=False)
+            self._used -= node.size
+            node.state, node.size = None, 0
+            self._prune(node)
+            self.stats["evictions"] += 1
+            self.stats["prefixes"] -= 1
+
+    # LLAMA CACHE PROTOCOL
+    def _find_longest_prefix_key(self, key: Sequence[int]) -> Optional[Tuple[int, ...]]:
+        tokens = tuple(key)
+        path, _ = self._walk(tokens)
+        for node, depth in reversed(path):
+            if node.state is not None:
+                return tokens[:depth]
+        return None
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        with self._lock:
+            path, _ = self._walk(key)
+            return any(node.state is not None for node, _ in path)
+
+    def __getitem__(self, key: Sequence[int]) -> Any:
+        tokens = tuple(key)
+        head = tokens[:self.max_prefix_tokens]
+        with self._lock:
+            path, matched = self._walk(head)
+
+            # ENDING ON A LEAF IS THE SAME CONVERSATION GROWING, NOT TWO PROMPTS SHARING A PREFIX
+            continuation = bool(path) and path[-1][1] == matched and not path[-1][0].children
+            stored = any(d == matched and n.state is not None for n, d in path)
+
+            # A NEW DIVERGENCE POINT AFTER A LONG ENOUGH COMMON PREFIX IS A SHARED PREFIX
+            if self.min_prefix_tokens <= matched < len(head) and not continuation and not stored:
+                self._pending = head[:matched]
+            end = self._insert(head)
+            if end is not self.root:
+                self._heads[end] = None
+                self._heads.move_to_end(end)
+                self._trim()
+
+            for node, depth in reversed(path):
+                if node.state is not None and depth < len(tokens):
+                    self._stateful.move_to_end(node)
+                    self.stats["hits"] += 1
+                    self.stats["reused_tokens"] += depth
+                    return node.state
+
+            self.stats["misses"] += 1
+        raise KeyError(key)
+
+    def __setitem__(self, key: Sequence[int], value: Any):
+        # Full state after a completion: kept for the session cache, not stored in the tree
+        self._last_state = value
+
+    def pop_last_state(self) -> Any:
+        state, self._last_state = self._last_state, None
+        return state
+
+    def materialize(self, llm) -> bool:
+        """
+        Snapshots the pending shared prefix. Must run on the decode thread,
+        after the session state was saved: the context is cut back to the prefix.
+        """
+        with self._lock:
+            prefix, self._pending = self._pending, None
+        if not prefix or llm.input_ids[:len(prefix)].tolist() != list(prefix):
+            return False
+
+        llm.n_tokens = len(prefix)
+        llm._ctx.kv_cache_seq_rm(-1, len(prefix), -1)
+        state = llm.save_state()
+        size = state.__sizeof__()
+
+        with self._lock:
+            node = self._insert(prefix)
+            if node.state is None:
+                self.stats["prefixes"] += 1
+            else:
+                self._used -= node.size
+            node.state, node.size = state, size
+            self._stateful[node] = None
+            self._stateful.move_to_end(node)
+            self._used += size
+            self._evict()
+
+        logger.info(f"[PREFIX_CACHE] Shared prefix of {len(prefix)} tokens stored ({size / 1024**2:.1f} MB)")
+        return True
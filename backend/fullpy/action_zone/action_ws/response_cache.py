@@ -0,0 +1,74 @@
+"""Answers of deterministic prompts, replayed instead of recomputed"""
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional
+import diskcache
+from action_zone.action_ws import logger
+
+
+class ResponseCache:
+    """
+    Token lists of finished answers, keyed on a hash of everything that
+    decides them: the model file, the sampling snapshot, max_tokens and the
+    exact messages sent. Only deterministic requests (a fixed seed or
+    temperature 0) are cached. diskcache keeps the entries on disk with a
+    size cap and LRU eviction; entries are tagged with the model name so a
+    config change drops that model's answers at once.
+    """
+
+    def __init__(self, directory: Path, size_limit: int):
+        self._cache = diskcache.Cache(
+            str(directory), size_limit=size_limit, eviction_policy="least-recently-used", tag_index=True
+        )
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    @staticmethod
+    def deterministic(params) -> bool:
+        return params.seed is not None or params.temperature == 0
+
+    @staticmethod
+    def fingerprint(model_path: str) -> str:
+        """Identity of the model file: a re-downloaded or replaced file gets new keys"""
+        try:
+            stat = os.stat(model_path)
+        except OSError:
+            return model_path
+        return f"{model_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    @staticmethod
+    def key(fingerprint: str, chat_format: Optional[str], params, max_tokens: int, messages: List[Dict[str, str]]) -> str:
+        # CANONICAL JSON: SAME INPUTS, SAME BYTES, SAME HASH
+        canonical = json.dumps(
+            {
+                "model": fingerprint,
+                "chat_format": chat_format,
+                "params": params.completion_kwargs(),
+                "max_tokens": max_tokens,
+                "messages": messages,
+            },
+            sort_keys=True, ensure_ascii=False, separators=(",", ":")
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        tokens = self._cache.get(key)
+        self.stats["hits" if tokens is not None else "misses"] += 1
+        return tokens
+
+    def put(self, key: str, model_name: str, tokens: List[str]):
+        self._cache.set(key, tokens, tag=model_name)
+        self.stats["stores"] += 1
+
+    def invalidate(self, model_name: str):
+        removed = self._cache.evict(model_name)
+        self.stats["invalidations"] += removed
+        if removed:
+            logger.info(f"[RESPONSE_CACHE] Dropped {removed} answers of {model_name}")
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "entries": len(self._cache), "bytes": self._cache.volume()}
+
+    def close(self):
+        self._cache.close()
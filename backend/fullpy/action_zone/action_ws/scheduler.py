@@ -0,0 +1,177 @@
+"""Fair prompt scheduler in front of the model context"""
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from action_zone.action_ws import logger
+
+
+class QueueFull(Exception):
+    """Raised when the scheduler already holds `max_queued` prompts"""
+
+
+class PromptJob:
+    __slots__ = ('prompt_id', 'session_id', 'run', 'on_position', 'enqueued_at', 'started_at')
+
+    def __init__(self, prompt_id: str, session_id: str,
+                 run: Callable[[], Awaitable[None]],
+                 on_position: Optional[Callable[[int], Awaitable[None]]] = None):
+        self.prompt_id = prompt_id
+        self.session_id = session_id
+        self.run = run
+        self.on_position = on_position
+        self.enqueued_at = time.perf_counter()
+        self.started_at = 0.0
+
+
+class PromptScheduler:
+    """
+    Bounded queue with per-session round-robin.
+    Sessions take turns: a session with ten queued prompts does not
+    delay another session's single prompt by ten generations.
+    `concurrency` workers run jobs, one per model context.
+    """
+
+    def __init__(self, concurrency: int = 1, max_queued: int = 32):
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+
+        # SESSION -> ITS PENDING JOBS, ORDER OF THE DICT IS THE ROUND-ROBIN ORDER
+        self._sessions: "OrderedDict[str, Deque[PromptJob]]" = OrderedDict()
+        self._queued = 0
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self.running: Dict[str, PromptJob] = {}
+
+        self.stats = {
+            "submitted": 0,
+            "rejected": 0,
+            "completed": 0,
+            "canceled_in_queue": 0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "service_time_total": 0.0,
+            "service_time_max": 0.0,
+        }
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def submit(self, job: PromptJob) -> int:
+        """Queues a job and returns its 1-based position"""
+        if self._queued >= self.max_queued:
+            self.stats["rejected"] += 1
+            raise QueueFull(f"Queue is full ({self.max_queued} prompts)")
+
+        self._sessions.setdefault(job.session_id, deque()).append(job)
+        self._queued += 1
+        self.stats["submitted"] += 1
+        self._wakeup.set()
+        return self.positions().get(job.prompt_id, 0)
+
+    def cancel(self, prompt_id: str) -> bool:
+        """Removes a job that has not started yet"""
+        for session_id, jobs in self._sessions.items():
+            for job in jobs:
+                if job.prompt_id == prompt_id:
+                    jobs.remove(job)
+                    self._queued -= 1
+                    self.stats["canceled_in_queue"] += 1
+                    if not jobs:
+                        del self._sessions[session_id]
+                    self._notify_positions()
+                    return True
+        return False
+
+    def cancel_session(self, session_id: str) -> List[str]:
+        """Removes every queued job of a session, returns their prompt ids"""
+        jobs = self._sessions.pop(session_id, None)
+        if not jobs:
+            return []
+        self._queued -= len(jobs)
+        self.stats["canceled_in_queue"] += len(jobs)
+        self._notify_positions()
+        return [job.prompt_id for job in jobs]
+
+    def positions(self) -> Dict[str, int]:
+        """Position each queued prompt will be served in, following the round-robin"""
+        order: Dict[str, int] = {}
+        queues = [list(jobs) for jobs in self._sessions.values()]
+        depth = 0
+        while True:
+            layer = [jobs[depth] for jobs in queues if depth < len(jobs)]
+            if not layer:
+                return order
+            for job in layer:
+                order[job.prompt_id] = len(order) + 1
+            depth += 1
+
+    def get_stats(self) -> dict:
+        done = self.stats["completed"] or 1
+        return {
+            **self.stats,
+            "queued": self._queued,
+            "running": len(self.running),
+            "queue_wait_avg": self.stats["queue_wait_total"] / done,
+            "service_time_avg": self.stats["service_time_total"] / done,
+        }
+
+    def _next_job(self) -> Optional[PromptJob]:
+        if not self._sessions:
+            return None
+        session_id, jobs = next(iter(self._sessions.items()))
+        job = jobs.popleft()
+        self._queued -= 1
+
+        # THE SESSION GOES TO THE END OF THE ROTATION
+        del self._sessions[session_id]
+        if jobs:
+            self._sessions[session_id] = jobs
+        return job
+
+    def _notify_positions(self):
+        positions = self.positions()
+        for jobs in self._sessions.values():
+            for job in jobs:
+                if job.on_position:
+                    asyncio.create_task(job.on_position(positions[job.prompt_id]))
+
+    async def _worker(self, index: int):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            self._notify_positions()
+            job.started_at = time.perf_counter()
+            wait = job.started_at - job.enqueued_at
+            self.running[job.prompt_id] = job
+
+            try:
+                await job.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[SCHEDULER] Job {job.prompt_id} failed: {type(e).__name__}: {e}")
+            finally:
+                service = time.perf_counter() - job.started_at
+                self.running.pop(job.prompt_id, None)
+                self.stats["completed"] += 1
+                self.stats["queue_wait_total"] += wait
+                self.stats["queue_wait_max"] = max(self.stats["queue_wait_max"], wait)
+                self.stats["service_time_total"] += service
+                self.stats["service_time_max"] = max(self.stats["service_time_max"], service)
+                logger.info(f"[SCHEDULER] {job.prompt_id} worker={index} wait={wait:.3f}s service={service:.3f}s queued={self._queued}")
@@ -0,0 +1,116 @@
+"""Durable chat sessions: the history of each session on disk, so a client can reconnect to it"""
+import re
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+from action_zone.action_ws import logger
+
+# IDS THE SERVER HANDS OUT (uuid4 hex) AND ACCEPTS BACK FROM CLIENTS
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class SessionStore:
+    """
+    One row per session in a small sqlite file, the messages kept as
+    zlib-compressed JSON. Sessions idle for longer than `ttl_seconds` expire;
+    past `max_bytes` the least recently used ones go first.
+    Called from executor threads, so one connection is shared under a lock.
+    """
+
+    SCHEMA = """CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        messages BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        updated_at REAL NOT NULL)"""
+
+    def __init__(self, path: Path, ttl_seconds: float, max_bytes: int):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL + NORMAL: A WRITE PER ANSWERED PROMPT WITHOUT AN FSYNC EACH TIME
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(self.SCHEMA)
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)")
+        self._db.commit()
+
+    @staticmethod
+    def valid_id(session_id: Optional[str]) -> bool:
+        return isinstance(session_id, str) and bool(SESSION_ID_PATTERN.match(session_id))
+
+    def load(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """Messages of a session that has not expired, None otherwise"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT messages, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if not row or time.time() - row[1] > self.ttl_seconds:
+            return None
+        try:
+            return json.loads(zlib.decompress(row[0]))
+        except (zlib.error, ValueError) as e:
+            logger.warning(f"[SESSIONS] Unreadable history for {session_id}: {e}")
+            self.delete(session_id)
+            return None
+
+    def save(self, session_id: str, messages: List[Dict[str, str]]):
+        blob = zlib.compress(json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, messages, size, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, blob, len(blob), time.time())
+            )
+            self._db.commit()
+
+    def touch(self, session_id: str):
+        with self._lock:
+            self._db.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (time.time(), session_id))
+            self._db.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def session_ids(self) -> Set[str]:
+        with self._lock:
+            return {row[0] for row in self._db.execute("SELECT session_id FROM sessions")}
+
+    def gc(self) -> List[str]:
+        """Removes expired sessions, then the oldest ones until the store fits `max_bytes`. Returns their ids"""
+        removed: List[str] = []
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            removed += [row[0] for row in self._db.execute("SELECT session_id FROM sessions WHERE updated_at < ?", (cutoff,))]
+            self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM sessions").fetchone()[0]
+            if total > self.max_bytes:
+                for session_id, size in self._db.execute("SELECT session_id, size FROM sessions ORDER BY updated_at").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                    removed.append(session_id)
+                    total -= size
+            self._db.commit()
+
+        if removed:
+            logger.info(f"[SESSIONS] Removed {len(removed)} expired or evicted sessions")
+        return removed
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+        return {"sessions": count, "bytes": size}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
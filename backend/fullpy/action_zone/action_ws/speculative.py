@@ -0,0 +1,197 @@
+"""Speculative decoding: draft models for llama-cpp's draft_model hook"""
+import os
+import struct
+import hashlib
+import threading
+import numpy as np
+import numpy.typing as npt
+from typing import BinaryIO, Optional
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+from action_zone.action_ws import logger, resolve_model
+from action_zone.action_ws.autotune import memory_kwargs
+
+# GGUF METADATA VALUE TYPES: SCALAR FORMATS, STRINGS AND ARRAYS
+GGUF_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+GGUF_STRING = 8
+GGUF_ARRAY = 9
+# WHAT TWO MODELS MUST AGREE ON FOR DRAFT TOKEN IDS TO MEAN THE SAME THING
+TOKENIZER_KEYS = ("model", "pre", "tokens", "bos_token_id", "eos_token_id")
+
+
+def _read_value(f: BinaryIO, vtype: int, skip: bool = False):
+    if vtype == GGUF_STRING:
+        size, = struct.unpack("<Q", f.read(8))
+        if skip:
+            f.seek(size, os.SEEK_CUR)
+            return None
+        return f.read(size).decode("utf-8", "replace")
+    if vtype == GGUF_ARRAY:
+        itype, count = struct.unpack("<IQ", f.read(12))
+        if itype in GGUF_SCALARS:
+            f.seek(struct.calcsize(GGUF_SCALARS[itype]) * count, os.SEEK_CUR)
+        else:
+            for _ in range(count):
+                _read_value(f, itype, skip=True)
+        return None
+    if vtype not in GGUF_SCALARS:
+        raise ValueError(f"Unknown GGUF value type {vtype}")
+    data = f.read(struct.calcsize(GGUF_SCALARS[vtype]))
+    return None if skip else struct.unpack(GGUF_SCALARS[vtype], data)[0]
+
+
+def read_tokenizer_metadata(path: str) -> dict:
+    """
+    tokenizer.ggml.* metadata of a GGUF file, read from its header without
+    loading the model. The token list is reduced to its size and a digest.
+    """
+    meta = {}
+    with open(path, "rb") as f:
+        if f.read(4) != b"GGUF":
+            raise ValueError(f"{os.path.basename(path)} is not a GGUF file")
+        version, = struct.unpack("<I", f.read(4))
+        if version < 2:
+            raise ValueError(f"GGUF version {version} is not supported")
+        _, kv_count = struct.unpack("<QQ", f.read(16))
+        for _ in range(kv_count):
+            key = _read_value(f, GGUF_STRING)
+            vtype, = struct.unpack("<I", f.read(4))
+            name = key[len("tokenizer.ggml."):] if key.startswith("tokenizer.ggml.") else None
+            if name == "tokens" and vtype == GGUF_ARRAY:
+                itype, count = struct.unpack("<IQ", f.read(12))
+                digest = hashlib.sha1()
+                for _ in range(count):
+                    size, = struct.unpack("<Q", f.read(8))
+                    digest.update(f.read(size) + b"\0")
+                meta["tokens"] = (count, digest.hexdigest())
+            elif name in TOKENIZER_KEYS and vtype != GGUF_ARRAY:
+                meta[name] = _read_value(f, vtype)
+            else:
+                _read_value(f, vtype, skip=True)
+    return meta
+
+
+def tokenizer_mismatch(draft_path: str, target_path: str) -> Optional[str]:
+    """Why a draft model cannot propose tokens for the target, None when both use the same tokenizer"""
+    draft, target = read_tokenizer_metadata(draft_path), read_tokenizer_metadata(target_path)
+    if "tokens" not in target:
+        return "the target model has no tokenizer metadata"
+    for key in TOKENIZER_KEYS:
+        if draft.get(key) != target.get(key):
+            return f"tokenizer {key} differs ({draft.get(key)} vs {target.get(key)})"
+    return None
+
+
+class SmallModelDraft(LlamaDraftModel):
+    """
+    Greedy drafts from a small GGUF model (e.g. TinyLlama).
+    The draft model must share the target model's vocabulary, otherwise the
+    proposed token ids mean nothing to the target.
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 10, n_ctx: int = 8000):
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, verbose=False, **memory_kwargs(model_path))
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs) -> npt.NDArray[np.intc]:
+        tokens = input_ids.tolist()
+
+        # generate() reuses the common prefix; a full match would leave nothing to evaluate
+        if self.llm.n_tokens >= len(tokens) and self.llm.input_ids[:len(tokens)].tolist() == tokens:
+            self.llm.reset()
+
+        draft = []
+        for token in self.llm.generate(tokens, top_k=1, temp=0.0, repeat_penalty=1.0, reset=True):
+            if token == self.llm.token_eos():
+                break
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+
+class CountingDraft(LlamaDraftModel):
+    """Wraps a draft model and counts draft rounds and proposed tokens"""
+
+    def __init__(self, draft: LlamaDraftModel, mode: str, tokens: int):
+        self.draft = draft
+        self.mode = mode
+        self.tokens = tokens
+        self.rounds = 0
+        self.proposed = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs) -> npt.NDArray[np.intc]:
+        tokens = self.draft(input_ids, **kwargs)
+        with self._lock:
+            self.rounds += 1
+            self.proposed += len(tokens)
+        return tokens
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return self.rounds, self.proposed
+
+    def close(self):
+        # A small model draft holds a context and weights of its own
+        if isinstance(self.draft, SmallModelDraft):
+            self.draft.llm.close()
+
+
+class SpeculativeStats:
+    """Acceptance rate and effective tokens/s per prompt and in total"""
+
+    def __init__(self):
+        self.totals = {"prompts": 0, "generated": 0, "proposed": 0, "accepted": 0, "seconds": 0.0}
+
+    def record(self, draft: CountingDraft, before: tuple, generated: int, seconds: float) -> dict:
+        rounds, proposed = draft.snapshot()
+        rounds -= before[0]
+        proposed -= before[1]
+        # EVERY ROUND YIELDS ITS ACCEPTED DRAFT TOKENS PLUS ONE TOKEN FROM THE TARGET
+        accepted = max(min(generated - rounds, proposed), 0)
+
+        self.totals["prompts"] += 1
+        self.totals["generated"] += generated
+        self.totals["proposed"] += proposed
+        self.totals["accepted"] += accepted
+        self.totals["seconds"] += seconds
+
+        return {
+            "mode": draft.mode,
+            "proposed": proposed,
+            "accepted": accepted,
+            "acceptance_rate": round(accepted / proposed, 3) if proposed else 0.0,
+            "tokens_per_second": round(generated / seconds, 2) if seconds > 0 else 0.0,
+        }
+
+    def get_stats(self) -> dict:
+        t = self.totals
+        return {
+            **t,
+            "acceptance_rate": t["accepted"] / t["proposed"] if t["proposed"] else 0.0,
+            "tokens_per_second": t["generated"] / t["seconds"] if t["seconds"] else 0.0,
+        }
+
+
+def build_draft_model(mode: Optional[str], draft_tokens: int, draft_model_name: str, target_path: str) -> Optional[CountingDraft]:
+    """Draft model for a ControlConfig `speculative_mode`, None when disabled or incompatible with the target"""
+    if mode == "prompt_lookup":
+        return CountingDraft(LlamaPromptLookupDecoding(num_pred_tokens=draft_tokens), mode, draft_tokens)
+
+    if mode == "draft_model":
+        path = resolve_model(draft_model_name)["model_path"]
+        if not os.path.exists(path):
+            logger.warning(f"[SPECULATIVE] Draft model not found: {path}. Speculative decoding disabled")
+            return None
+        # Checked on the GGUF headers: a multi-GB draft is never loaded for a target it cannot serve
+        try:
+            mismatch = tokenizer_mismatch(path, target_path)
+        except (OSError, ValueError, struct.error) as e:
+            mismatch = f"unreadable GGUF metadata ({e})"
+        if mismatch:
+            logger.warning(f"[SPECULATIVE] {draft_model_name} cannot draft for {os.path.basename(target_path)}: {mismatch}. Speculative decoding disabled")
+            return None
+        return CountingDraft(SmallModelDraft(path, draft_tokens), mode, draft_tokens)
+
+    return None
@@ -0,0 +1,93 @@
+"""Server start: the port is bound first, the model loads in the background, clients see the progress"""
+import os
+import json
+import time
+import asyncio
+from typing import Callable, Dict, Optional
+import psutil
+from action_zone.action_ws import logger
+
+PREFETCH_CHUNK_BYTES = 16 * 1024**2
+
+
+def prefetch(path: str, on_progress: Callable[[float], None]) -> int:
+    """
+    Reads the GGUF file once, sequentially, so the mmap'd load that follows
+    hits the page cache instead of faulting pages in one by one.
+    Skipped when the file does not fit in free RAM (it would only evict itself).
+    """
+    size = os.path.getsize(path)
+    if size > psutil.virtual_memory().available:
+        logger.info(f"[STARTUP] {path} is larger than free RAM, prefetch skipped")
+        return 0
+
+    done = 0
+    buffer = bytearray(PREFETCH_CHUNK_BYTES)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            done += n
+            on_progress(done / size)
+    return done
+
+
+class Startup:
+    """
+    Phases of the start (prefetch, load, warmup) with their durations.
+    The loader thread only moves `phase`/`progress`; connections accepted
+    before the server is ready poll them and get "loading" status frames,
+    then continue as normal sessions once it is.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phase = "bind"
+        self.progress = 0.0
+        self.timings: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.server = None
+        self.ready = asyncio.Event()
+        self._phase_started = self.started_at
+
+    def enter(self, phase: str):
+        now = time.perf_counter()
+        self.timings[self.phase] = round(now - self._phase_started, 3)
+        self.phase, self.progress, self._phase_started = phase, 0.0, now
+        logger.info(f"[STARTUP] {phase} at {now - self.started_at:.2f}s")
+
+    def finish(self, server):
+        self.enter("ready")
+        self.timings["ready"] = round(self._phase_started - self.started_at, 3)
+        self.server = server
+        self.ready.set()
+        logger.info(f"[STARTUP] Ready in {self.timings['ready']:.2f}s: {self.timings}")
+
+    def fail(self, error: str):
+        self.error = error
+        self.ready.set()
+
+    def status_frame(self) -> dict:
+        return {"type": "status", "status": "loading", "phase": self.phase, "progress": round(self.progress, 2),
+                "elapsed": round(time.perf_counter() - self.started_at, 1)}
+
+    async def handle_client(self, websocket, path: Optional[str] = None):
+        last = None
+        while not self.ready.is_set():
+            frame = self.status_frame()
+            if (frame["phase"], frame["progress"]) != last:
+                await websocket.send(json.dumps(frame))
+                last = (frame["phase"], frame["progress"])
+            try:
+                await asyncio.wait_for(self.ready.wait(), 0.25)
+            except asyncio.TimeoutError:
+                pass
+
+        if self.error:
+            await websocket.send(json.dumps({"error": f"Model failed to load: {self.error}", "type": "error"}))
+            await websocket.close()
+            return
+        await self.server.handle_client(websocket, path)
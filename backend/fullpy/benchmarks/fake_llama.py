@@ -0,0 +1,165 @@
+"""
+Deterministic stand-in for llama_cpp used by the serving-layer benchmarks.
+It emits tokens at a fixed rate (sleeping, so the GIL is released like the
+real C decode loop) and implements just the API surface LlamaChatServer uses.
+"""
+import sys
+import ctypes
+import time
+import types
+from typing import Iterator, List, Optional
+
+
+class FakeState:
+    __slots__ = ('input_ids', 'n_tokens')
+
+    def __init__(self, input_ids: List[int]):
+        self.input_ids = list(input_ids)
+        self.n_tokens = len(input_ids)
+
+    def __sizeof__(self) -> int:
+        return 64 + 8 * self.n_tokens
+
+
+class FakeContext:
+    ctx = None
+
+    def kv_cache_seq_rm(self, seq_id: int, p0: int, p1: int):
+        pass
+
+
+class FakeLlama:
+    # SET BY install()
+    token_rate = 500.0
+    prefill_ms_per_token = 0.0
+    completion_tokens = 16
+
+    def __init__(self, model_path: str = "", n_ctx: int = 8000, chat_format: str = "chatml", draft_model=None, **kwargs):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.chat_format = chat_format
+        self.draft_model = draft_model
+        self.cache = None
+        self._input_ids: List[int] = []
+        self.n_tokens = 0
+        self._ctx = FakeContext()
+
+    # TOKENIZER: ONE TOKEN PER WHITESPACE-SEPARATED WORD
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return [hash(word) & 0xFFFF for word in text.split()]
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return b" ".join(b"w%d" % t for t in tokens)
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def n_vocab(self) -> int:
+        return 32000
+
+    def token_eos(self) -> int:
+        return 2
+
+    @property
+    def input_ids(self):
+        import numpy as np
+        return np.array(self._input_ids[:self.n_tokens], dtype=np.intc)
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def save_state(self) -> FakeState:
+        return FakeState(self._input_ids[:self.n_tokens])
+
+    def load_state(self, state: FakeState):
+        self._input_ids = list(state.input_ids)
+        self.n_tokens = state.n_tokens
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def close(self):
+        pass
+
+    def create_chat_completion(self, messages: List[dict], max_tokens: Optional[int] = None, stream: bool = False, **kwargs) -> Iterator[dict]:
+        prompt = self.tokenize(" ".join(m["content"] for m in messages).encode("utf-8"))
+
+        # PREFILL ONLY WHAT IS NOT ALREADY IN THE CONTEXT
+        reused = 0
+        for a, b in zip(self._input_ids[:self.n_tokens], prompt):
+            if a != b:
+                break
+            reused += 1
+        time.sleep((len(prompt) - reused) * self.prefill_ms_per_token / 1000)
+        self._input_ids = prompt
+        self.n_tokens = len(prompt)
+
+        count = min(self.completion_tokens, max_tokens or self.completion_tokens)
+        delay = 1.0 / self.token_rate
+
+        def chunks():
+            yield {"choices": [{"delta": {"role": "assistant"}}]}
+            for i in range(count):
+                time.sleep(delay)
+                self._input_ids.append(i)
+                self.n_tokens += 1
+                yield {"choices": [{"delta": {"content": f"tok{i} "}}]}
+
+        if stream:
+            return chunks()
+        text = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks())
+        return {
+            "choices": [{"message": {"role": "assistant", "content": text}, "finish_reason": "length"}],
+            "usage": {"prompt_tokens": len(prompt), "completion_tokens": count, "total_tokens": len(prompt) + count},
+        }
+
+
+class FakeDraftModel:
+    def __call__(self, input_ids, /, **kwargs):
+        return input_ids[:0]
+
+
+class FakePromptLookupDecoding(FakeDraftModel):
+    def __init__(self, max_ngram_size: int = 2, num_pred_tokens: int = 10):
+        self.num_pred_tokens = num_pred_tokens
+
+
+class FakeBaseLlamaCache:
+    def __init__(self, capacity_bytes: int = (2 << 30)):
+        self.capacity_bytes = capacity_bytes
+
+
+def install(token_rate: float, completion_tokens: int, prefill_ms_per_token: float = 0.0):
+    """Registers the fake as `llama_cpp` (and the submodules the server imports)"""
+    FakeLlama.token_rate = token_rate
+    FakeLlama.completion_tokens = completion_tokens
+    FakeLlama.prefill_ms_per_token = prefill_ms_per_token
+
+    llama_cpp = types.ModuleType("llama_cpp")
+    llama_cpp.Llama = FakeLlama
+    # READ BY THE LOAD-PARAMETER AUTOTUNER
+    llama_cpp.llama_supports_gpu_offload = lambda: False
+    # CANCEL: THE ABORT FLAG IS INSTALLED, THE FAKE DECODE NEVER READS IT
+    llama_cpp.ggml_abort_callback = ctypes.CFUNCTYPE(ctypes.c_bool, ctypes.c_void_p)
+    llama_cpp.llama_set_abort_callback = lambda ctx, callback, data: None
+
+    llama_cache = types.ModuleType("llama_cpp.llama_cache")
+    llama_cache.BaseLlamaCache = FakeBaseLlamaCache
+
+    llama_speculative = types.ModuleType("llama_cpp.llama_speculative")
+    llama_speculative.LlamaDraftModel = FakeDraftModel
+    llama_speculative.LlamaPromptLookupDecoding = FakePromptLookupDecoding
+
+    # IMPORTED BY THE CONTINUOUS BATCHER, WHICH THE BENCHMARK TURNS OFF
+    internals = types.ModuleType("llama_cpp._internals")
+    chat_format = types.ModuleType("llama_cpp.llama_chat_format")
+
+    llama_cpp.llama_cache = llama_cache
+    llama_cpp.llama_speculative = llama_speculative
+    llama_cpp._internals = internals
+    llama_cpp.llama_chat_format = chat_format
+    sys.modules["llama_cpp"] = llama_cpp
+    sys.modules["llama_cpp.llama_cache"] = llama_cache
+    sys.modules["llama_cpp.llama_speculative"] = llama_speculative
+    sys.modules["llama_cpp._internals"] = internals
+    sys.modules["llama_cpp.llama_chat_format"] = chat_format
@@ -0,0 +1,224 @@
+"""
+Serving-layer micro-benchmark for action_ws.
+
+Runs LlamaChatServer.handle_client over real in-process WebSocket connections
+with a deterministic fake Llama (benchmarks/fake_llama.py), so what is
+measured is our Python layer: scheduler, engine, framing, caches.
+
+    python benchmarks/ws_hot_path.py --sessions 1,10,50,200 --token-rate 500 --tokens 16
+    python benchmarks/ws_hot_path.py --json bench.json   # keep results to diff between commits
+
+Reported per concurrency level:
+    ttft_ms         time from prompt send to the first token frame (p50 / p95 / max)
+    tokens_per_s    tokens delivered to all clients / wall time
+    loop_lag_ms     event-loop lag measured by a 5 ms ticker (p50 / p99 / max)
+    cpu_us_token    process CPU time per delivered token (server + in-process clients)
+    mem_kb_session  RSS growth per connected session
+"""
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import importlib.util
+from pathlib import Path
+
+import psutil
+
+FULLPY_DIR = Path(__file__).resolve().parents[1]
+ACTION_WS_DIR = FULLPY_DIR / "action_zone" / "action_ws"
+sys.path.insert(0, str(FULLPY_DIR))
+sys.path.insert(0, str(ACTION_WS_DIR))
+
+import fake_llama  # noqa: E402  (benchmarks/ is on sys.path as the script directory)
+
+
+def load_server(model_file: str, state_dir: Path):
+    """Imports call_llama.cpp.py against the fake backend and builds a server whose files all live in state_dir"""
+    spec = importlib.util.spec_from_file_location("call_llama_cpp", ACTION_WS_DIR / "call_llama.cpp.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # NOTHING OF THE REAL SERVER IS TOUCHED: KV STATES, SESSIONS, MEMORY, BATCH JOBS, CACHED ANSWERS, MODEL CONFIG
+    module.KV_CACHE_DIR = state_dir / "kv_state"
+    module.SESSION_STORE_PATH = state_dir / "sessions.sqlite"
+    module.MEMORY_DIR = state_dir / "memory"
+    module.BATCH_JOBS_DIR = state_dir / "batch_jobs"
+    module.BATCH_FILES_DIR = state_dir / "batch_jobs" / "files"
+    module.RESPONSE_CACHE_DIR = state_dir / "responses"
+    module.AUTOTUNE_ON_FIRST_LOAD = False
+    from action_zone.action_sqlite.control_config import ControlConfig
+    config_db = state_dir / "config_model.sqlite"
+    shutil.copyfile(ControlConfig.DB_FILE, config_db)
+    ControlConfig.DB_FILE = str(config_db)
+
+    # THE POOL CHECKS THE GGUF ON DISK, POINT IT AT AN EMPTY PLACEHOLDER
+    from action_zone.action_ws import model_pool
+    model_pool.resolve_model = lambda name: {"model_path": model_file, "chat_format": "chatml", "name_of_model": name}
+
+    # THE FAKE HAS NO MULTI-SEQUENCE CONTEXT: MEASURE THE SINGLE-CONTEXT PATH
+    module.CONTINUOUS_BATCHING_SLOTS = 0
+    return module.LlamaChatServer("bench-model.gguf")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def run_client(url: str, prompt: str, done: asyncio.Event, release: asyncio.Event, out: list):
+    import websockets
+
+    async with websockets.connect(url, max_queue=None) as ws:
+        json.loads(await ws.recv())  # ready
+
+        sent = time.perf_counter()
+        await ws.send(json.dumps({"action": "prompt", "prompt": prompt}))
+        first = None
+        tokens = 0
+        error = None
+
+        while True:
+            data = json.loads(await ws.recv())
+            if data.get("type") == "token":
+                first = first or time.perf_counter()
+                tokens += len(data["token"].split())
+            elif data.get("type") == "complete":
+                break
+            elif data.get("type") == "error":
+                error = data.get("error")
+                break
+
+        out.append({"ttft": (first - sent) if first else None, "tokens": tokens, "error": error})
+        done.set()
+        # STAY CONNECTED UNTIL MEMORY IS MEASURED
+        await release.wait()
+
+
+async def run_level(server, url: str, sessions: int, prompt: str) -> dict:
+    import gc
+    gc.collect()
+    process = psutil.Process()
+    server.scheduler.max_queued = max(server.scheduler.max_queued, sessions)
+
+    results = []
+    dones = [asyncio.Event() for _ in range(sessions)]
+    release = asyncio.Event()
+    lag = LoopLagMonitor()
+
+    rss_before = process.memory_info().rss
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+    lag.start()
+
+    clients = [asyncio.create_task(run_client(url, prompt, done, release, results)) for done in dones]
+    await asyncio.gather(*(done.wait() for done in dones))
+
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_before
+    rss_after = process.memory_info().rss
+    await lag.stop()
+
+    release.set()
+    await asyncio.gather(*clients, return_exceptions=True)
+
+    ttfts = [r["ttft"] * 1000 for r in results if r["ttft"] is not None]
+    tokens = sum(r["tokens"] for r in results)
+    lags = [s * 1000 for s in lag.samples]
+
+    return {
+        "sessions": sessions,
+        "errors": sum(1 for r in results if r["error"]),
+        "ttft_ms_p50": round(percentile(ttfts, 0.50), 2),
+        "ttft_ms_p95": round(percentile(ttfts, 0.95), 2),
+        "ttft_ms_max": round(max(ttfts, default=0.0), 2),
+        "tokens_per_s": round(tokens / wall, 1) if wall else 0.0,
+        "loop_lag_ms_p50": round(percentile(lags, 0.50), 3),
+        "loop_lag_ms_p99": round(percentile(lags, 0.99), 3),
+        "loop_lag_ms_max": round(max(lags, default=0.0), 3),
+        "cpu_us_token": round(cpu / tokens * 1e6, 1) if tokens else 0.0,
+        "mem_kb_session": round((rss_after - rss_before) / 1024 / sessions, 1),
+        "wall_s": round(wall, 3),
+    }
+
+
+async def main_async(args) -> list:
+    import websockets
+
+    fake_llama.install(args.token_rate, args.tokens, args.prefill_ms)
+    with tempfile.TemporaryDirectory(prefix="ws-bench-") as state_dir, \
+            tempfile.NamedTemporaryFile(suffix=".gguf") as model_file:
+        server = load_server(model_file.name, Path(state_dir))
+        if args.flush_ms is not None:
+            server.engine.flush_interval = args.flush_ms / 1000
+        server.scheduler.start()
+
+        ws_server = await websockets.serve(server.handle_client, "127.0.0.1", 0, max_queue=None)
+        port = ws_server.sockets[0].getsockname()[1]
+        url = f"ws://127.0.0.1:{port}"
+        prompt = " ".join(f"word{i}" for i in range(args.prompt_words))
+
+        rows = []
+        for sessions in args.sessions:
+            rows.append(await run_level(server, url, sessions, prompt))
+            print_row(rows[-1], header=len(rows) == 1)
+
+        ws_server.close()
+        await ws_server.wait_closed()
+        await server.scheduler.stop()
+        server.engine.shutdown()
+        return rows
+
+
+COLUMNS = ["sessions", "errors", "ttft_ms_p50", "ttft_ms_p95", "ttft_ms_max", "tokens_per_s",
+           "loop_lag_ms_p50", "loop_lag_ms_p99", "loop_lag_ms_max", "cpu_us_token", "mem_kb_session", "wall_s"]
+
+
+def print_row(row: dict, header: bool = False):
+    if header:
+        print(" ".join(f"{c:>15}" for c in COLUMNS))
+    print(" ".join(f"{row[c]:>15}" for c in COLUMNS), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="action_ws serving-layer benchmark with a fake Llama")
+    parser.add_argument("--sessions", type=lambda v: [int(x) for x in v.split(",")], default=[1, 10, 50, 200])
+    parser.add_argument("--token-rate", type=float, default=500.0, help="fake decode speed, tokens/s")
+    parser.add_argument("--tokens", type=int, default=16, help="completion tokens per prompt")
+    parser.add_argument("--prefill-ms", type=float, default=0.0, help="fake prefill cost per prompt token")
+    parser.add_argument("--prompt-words", type=int, default=32)
+    parser.add_argument("--flush-ms", type=float, default=None, help="override FLUSH_INTERVAL_MS")
+    parser.add_argument("--json", type=Path, default=None, help="write the results to this file")
+    args = parser.parse_args()
+
+    rows = asyncio.run(main_async(args))
+    if args.json:
+        args.json.write_text(json.dumps({"args": {k: str(v) for k, v in vars(args).items()}, "results": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import ctypes
+import pytest
+from action_zone.action_ws.abort import ABORT_CALLBACK, AbortFlag, _native_callback, _read_flag
+
+
+def call_native(flag, callback=ABORT_CALLBACK):
+    # The way ggml calls it: through the C function pointer, with the flag's address
+    pointer = ctypes.cast(callback, ctypes.c_void_p).value
+    return ctypes.CFUNCTYPE(ctypes.c_bool, ctypes.c_void_p)(pointer)(flag._data.value)
+
+
+def test_native_callback_without_the_gil():
+    assert _native_callback() is not None
+    assert ABORT_CALLBACK is not _read_flag
+
+
+@pytest.mark.parametrize("callback", [_native_callback(), _read_flag])
+def test_both_callbacks_read_the_flag(callback):
+    flag = AbortFlag()
+    flag.arm("prompt")
+    assert not call_native(flag, callback)
+    flag.abort("prompt")
+    assert call_native(flag, callback)
+
+
+def test_callback_reads_the_flag():
+    flag = AbortFlag()
+    flag.arm("prompt")
+    assert not call_native(flag)
+    assert flag.abort("prompt")
+    assert call_native(flag) and flag.is_set()
+    flag.disarm()
+    assert not call_native(flag)
+
+
+def test_only_the_owner_aborts():
+    flag = AbortFlag()
+    flag.arm("prompt")
+    assert not flag.abort("other") and not flag.abort(None)
+    assert not call_native(flag)
+    flag.disarm()
+    assert not flag.abort("prompt")
+
+
+def test_each_flag_is_independent():
+    first, second = AbortFlag(), AbortFlag()
+    first.arm("a")
+    second.arm("b")
+    first.abort("a")
+    assert call_native(first) and not call_native(second)
@@ -0,0 +1,54 @@
+import pytest
+from action_zone.action_ws.batch_jobs import BatchJob, BatchRunner, FAILED
+
+
+@pytest.fixture
+def runner(tmp_path):
+    files = tmp_path / "files"
+    files.mkdir()
+    (files / "in.jsonl").write_text('{"prompt": "Hi"}\n', encoding="utf-8")
+    (tmp_path / "secret.txt").write_text("secret", encoding="utf-8")
+    return BatchRunner(server=None, jobs_dir=tmp_path / "jobs", files_dir=files)
+
+
+def test_job_file_resolves_under_files_dir(runner):
+    assert runner.job_file("in.jsonl") == (runner.files_dir / "in.jsonl").resolve()
+    assert runner.job_file("sub/../in.jsonl") == (runner.files_dir / "in.jsonl").resolve()
+
+
+@pytest.mark.parametrize("name", ["../secret.txt", "sub/../../secret.txt", "..", ".", ""])
+def test_job_file_rejects_escapes(runner, name):
+    with pytest.raises(ValueError):
+        runner.job_file(name)
+
+
+def test_job_file_rejects_absolute_paths(runner, tmp_path):
+    for name in (str(tmp_path / "secret.txt"), str(runner.files_dir / "in.jsonl"), "/etc/passwd"):
+        with pytest.raises(ValueError):
+            runner.job_file(name)
+
+
+def test_job_file_rejects_symlinks_out(runner, tmp_path):
+    (runner.files_dir / "link.jsonl").symlink_to(tmp_path / "secret.txt")
+    with pytest.raises(ValueError):
+        runner.job_file("link.jsonl")
+
+
+@pytest.mark.parametrize("input_path, output_path", [
+    ("../secret.txt", None),
+    ("in.jsonl", "../out.jsonl"),
+    ("in.jsonl", "/tmp/out.jsonl"),
+    ("/etc/passwd", "out.jsonl"),
+])
+def test_submit_rejects_paths_outside(runner, input_path, output_path):
+    with pytest.raises(ValueError):
+        runner.submit(input_path, output_path)
+    assert not runner.jobs
+
+
+def test_resume_fails_unconfined_manifest(runner, tmp_path):
+    job = BatchJob("old", str(tmp_path / "secret.txt"), str(runner.files_dir / "out.jsonl"))
+    job.save(runner.jobs_dir)
+    runner.resume()
+    assert runner.jobs["old"].status == FAILED
+    assert BatchJob.load(runner.jobs_dir / "old.json").status == FAILED
@@ -0,0 +1,154 @@
+import os
+import zlib
+import struct
+import asyncio
+import hashlib
+import pytest
+from aiohttp import web
+from action_zone.action_sse.integrity import IntegrityError, StreamHasher, check_gguf_header
+from action_zone.action_sse.segmented import SegmentedDownloader
+
+
+def write(tmp_path, data, name="m.gguf"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+@pytest.mark.parametrize("version, counts", [(1, "<II"), (2, "<QQ"), (3, "<QQ")])
+def test_valid_headers(tmp_path, version, counts):
+    path = write(tmp_path, b"GGUF" + struct.pack("<I", version) + struct.pack(counts, 291, 24) + b"\0" * 64)
+    assert check_gguf_header(path) == {"version": version, "tensors": 291, "metadata": 24}
+
+
+def test_vocab_only_gguf_has_no_tensors(tmp_path):
+    path = write(tmp_path, b"GGUF" + struct.pack("<IQQ", 3, 0, 30))
+    assert check_gguf_header(path)["tensors"] == 0
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"GGU",
+    b"GGUF",
+    b"GGUF" + struct.pack("<I", 3) + b"\0" * 10,
+    b"GGUF" + struct.pack("<I", 2) + b"\0" * 15,
+    b"GGUF" + struct.pack("<I", 1) + b"\0" * 7,
+])
+def test_truncated_headers(tmp_path, data):
+    with pytest.raises(IntegrityError):
+        check_gguf_header(write(tmp_path, data))
+
+
+@pytest.mark.parametrize("data", [
+    b"<!DOCTYPE html><html><body>Access denied</body></html>",
+    b"PK\x03\x04" + b"\0" * 40,
+    b"GGUF" + struct.pack("<IQQ", 4, 1, 1),
+    b"GGUF" + struct.pack("<IQQ", 0, 1, 1),
+    b"GGUF" + struct.pack("<IQQ", 3, 1 << 40, 1),
+    b"GGUF" + struct.pack("<IQQ", 3, 1, 1 << 40),
+])
+def test_garbage_headers(tmp_path, data):
+    with pytest.raises(IntegrityError):
+        check_gguf_header(write(tmp_path, data))
+
+
+PIECE = 1000
+
+
+def hashed(data, piece_bytes=PIECE, step=333):
+    hasher = StreamHasher(piece_bytes)
+    for at in range(0, len(data), step):
+        hasher.update(data[at:at + step])
+    return hasher
+
+
+def test_hash_is_independent_of_chunking():
+    data = os.urandom(10 * PIECE + 123)
+    assert hashed(data).hexdigest() == hashed(data, step=4096).hexdigest() == hashlib.sha256(data).hexdigest()
+    assert hashed(data).offset == len(data)
+
+
+def test_rewind_rehashes_only_from_the_piece():
+    good = os.urandom(10 * PIECE + 123)
+    bad = bytearray(good)
+    bad[6 * PIECE + 10] ^= 0xFF
+    hasher = hashed(bytes(bad))
+    assert hasher.hexdigest() != hashlib.sha256(good).hexdigest()
+    # The pieces before the bad one keep their CRCs, the bad one differs
+    assert hasher.piece_crc(5) == zlib.crc32(good[5 * PIECE:6 * PIECE])
+    assert hasher.piece_crc(6) != zlib.crc32(good[6 * PIECE:7 * PIECE])
+
+    hasher.rewind(6)
+    assert hasher.offset == 6 * PIECE
+    hasher.update(good[6 * PIECE:])
+    assert hasher.hexdigest() == hashlib.sha256(good).hexdigest()
+
+
+def test_rewind_to_the_last_partial_piece():
+    data = os.urandom(3 * PIECE + 10)
+    hasher = hashed(data)
+    assert hasher.piece_crc(3) == zlib.crc32(data[3 * PIECE:])
+    hasher.rewind(3)
+    hasher.update(data[3 * PIECE:])
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_reset_starts_over():
+    hasher = hashed(os.urandom(2500))
+    hasher.reset()
+    assert hasher.offset == 0
+    hasher.update(b"abc")
+    assert hasher.hexdigest() == hashlib.sha256(b"abc").hexdigest()
+
+
+def serve(data, corrupt_at):
+    """A Range server that sends one flipped byte the first time it serves `corrupt_at`"""
+    served = {"corrupted": 0}
+
+    async def blob(request):
+        start, _, end = request.headers["Range"][len("bytes="):].partition("-")
+        start, end = int(start), min(int(end), len(data) - 1)
+        body = bytearray(data[start:end + 1])
+        if start <= corrupt_at <= end and not served["corrupted"] and start > 0:
+            body[corrupt_at - start] ^= 0xFF
+            served["corrupted"] += 1
+        return web.Response(status=206, body=bytes(body), headers={
+            "Content-Range": f"bytes {start}-{end}/{len(data)}", "Accept-Ranges": "bytes", "ETag": '"v1"'})
+
+    app = web.Application()
+    app.router.add_get("/model.gguf", blob)
+    return app, served
+
+
+async def download_with_repair(tmp_path, data, sha256):
+    app, served = serve(data, corrupt_at=len(data) // 2 + 7)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        downloader = SegmentedDownloader([f"http://127.0.0.1:{port}/model.gguf"], tmp_path / "model.tmp",
+                                         connections=3, min_segment=16 * 1024, max_segment=64 * 1024,
+                                         sha256=sha256, piece_bytes=32 * 1024)
+        await downloader.run()
+        return downloader, served
+    finally:
+        await runner.cleanup()
+
+
+def test_download_repairs_a_corrupt_piece(tmp_path):
+    data = os.urandom(512 * 1024 + 99)
+    downloader, served = asyncio.run(download_with_repair(tmp_path, data, hashlib.sha256(data).hexdigest()))
+    assert served["corrupted"] == 1
+    assert (tmp_path / "model.tmp").read_bytes() == data
+    assert downloader.sha256 == hashlib.sha256(data).hexdigest()
+    # The repair fetched pieces again, never the whole file twice
+    assert 0 < downloader.refetched < 2 * len(data)
+    assert not (tmp_path / "model.tmp.parts").exists()
+
+
+def test_download_fails_when_nothing_matches(tmp_path):
+    data = os.urandom(256 * 1024 + 5)
+    with pytest.raises(IntegrityError):
+        asyncio.run(download_with_repair(tmp_path, data, "0" * 64))
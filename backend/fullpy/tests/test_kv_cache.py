@@ -0,0 +1,50 @@
+import os
+from action_zone.action_ws.kv_cache import SessionStateCache
+
+
+def disk_files(path):
+    return sum(f.stat().st_size for f in path.glob("*.state"))
+
+
+def test_disk_tier_counts_file_bytes(tmp_path):
+    cache = SessionStateCache(ram_bytes=0, disk_bytes=10**6, disk_dir=tmp_path, model_name="m")
+    for i in range(5):
+        cache.put(f"s{i}", os.urandom(10_000 + i))
+    assert cache.get_stats()["disk_entries"] == 5
+    assert cache.get_stats()["disk_bytes"] == disk_files(tmp_path)
+
+
+def test_restart_keeps_the_same_budget(tmp_path):
+    cache = SessionStateCache(ram_bytes=0, disk_bytes=10**6, disk_dir=tmp_path, model_name="m")
+    for i in range(5):
+        cache.put(f"s{i}", os.urandom(10_000))
+    before = cache.get_stats()["disk_bytes"]
+    restarted = SessionStateCache(ram_bytes=0, disk_bytes=10**6, disk_dir=tmp_path, model_name="m")
+    assert restarted.get_stats()["disk_bytes"] == before
+    assert restarted.session_ids() == {f"s{i}" for i in range(5)}
+
+
+def test_disk_budget_evicts_oldest(tmp_path):
+    cache = SessionStateCache(ram_bytes=0, disk_bytes=35_000, disk_dir=tmp_path, model_name="m")
+    for i in range(5):
+        cache.put(f"s{i}", os.urandom(10_000))
+    stats = cache.get_stats()
+    assert stats["disk_bytes"] == disk_files(tmp_path) <= 35_000
+    assert cache.session_ids() == {"s2", "s3", "s4"}
+    assert stats["disk_evictions"] == 2
+
+
+def test_spill_and_promote(tmp_path):
+    cache = SessionStateCache(ram_bytes=10**6, disk_bytes=10**6, disk_dir=tmp_path, model_name="m")
+    state = os.urandom(1000)
+    cache.put("s", state)
+    cache.spill("s")
+    assert cache.get_stats()["disk_bytes"] == disk_files(tmp_path) > 0
+    assert cache.get("s") == state
+    assert cache.get_stats()["disk_bytes"] == 0 and cache.get_stats()["ram_entries"] == 1
+
+
+def test_other_model_drops_saved_states(tmp_path):
+    SessionStateCache(ram_bytes=0, disk_bytes=10**6, disk_dir=tmp_path, model_name="m").put("s", b"x" * 100)
+    cache = SessionStateCache(ram_bytes=0, disk_bytes=10**6, disk_dir=tmp_path, model_name="other")
+    assert cache.get("s") is None and not list(tmp_path.glob("*.state"))
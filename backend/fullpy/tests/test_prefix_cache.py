@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from action_zone.action_ws.prefix_cache import PrefixStateCache
+
+
+class FakeContext:
+    def kv_cache_seq_rm(self, seq_id, p0, p1):
+        pass
+
+
+class FakeLlama:
+    """What materialize() touches: the evaluated tokens and a state of known size"""
+
+    def __init__(self, tokens):
+        self.input_ids = np.array(tokens, dtype=np.intc)
+        self.n_tokens = len(tokens)
+        self._ctx = FakeContext()
+
+    def save_state(self):
+        return bytearray(1000)
+
+
+def prompt(cache, tokens):
+    try:
+        cache[tokens]
+    except KeyError:
+        pass
+    return cache.materialize(FakeLlama(tokens))
+
+
+def count_nodes(node):
+    return 1 + sum(count_nodes(child) for child in node.children.values())
+
+
+@pytest.fixture
+def cache():
+    return PrefixStateCache(capacity_bytes=10**9, min_prefix_tokens=4)
+
+
+def test_shared_prefix_is_stored_and_hit(cache):
+    system = list(range(100, 110))
+    prompt(cache, system + [1, 2])
+    assert prompt(cache, system + [3, 4])
+    assert cache.get_stats()["prefixes"] == 1
+    with pytest.raises(KeyError):
+        cache[list(range(50, 60))]
+    assert cache[system + [5, 6]] is not None
+    assert cache.stats["reused_tokens"] == len(system)
+
+
+def test_growing_conversation_stays_one_edge(cache):
+    tokens = list(range(20))
+    for end in range(5, 20, 3):
+        prompt(cache, tokens[:end])
+    assert count_nodes(cache.root) == 2
+
+
+def test_eviction_prunes_leaves_and_merges(cache):
+    cache.capacity_bytes = 0
+    for system in (list(range(100, 110)), list(range(200, 210))):
+        prompt(cache, system + [1, 2])
+        prompt(cache, system + [3, 4])
+    # Every state was evicted: only the last prompts' stateless paths remain, without chains
+    assert cache.cache_size == 0 and not cache._stateful
+    assert cache.stats["evictions"] == 2
+    stack = list(cache.root.children.values())
+    while stack:
+        node = stack.pop()
+        assert node.state is not None or len(node.children) != 1
+        stack.extend(node.children.values())
+
+
+def test_eviction_is_least_recently_used(cache):
+    first, second = list(range(100, 110)), list(range(200, 210))
+    prompt(cache, first + [1])
+    prompt(cache, first + [2])
+    prompt(cache, second + [1])
+    prompt(cache, second + [2])
+    cache[first + [3]]
+    cache.capacity_bytes = cache.cache_size - 1
+    cache._evict()
+    assert cache[first + [4]] is not None
+    with pytest.raises(KeyError):
+        cache[second + [3]]
+
+
+def tree_tokens(node):
+    return len(node.edge) + sum(tree_tokens(child) for child in node.children.values())
+
+
+def test_stateless_heads_are_capped(cache):
+    cache.max_tree_tokens = 100
+    for start in range(0, 5000, 20):
+        prompt(cache, list(range(start, start + 20)))
+    assert cache.get_stats()["tree_tokens"] == tree_tokens(cache.root) <= 100
+    assert count_nodes(cache.root) <= 6
+
+
+def test_trimming_keeps_stored_prefixes(cache):
+    system = list(range(100, 110))
+    prompt(cache, system + [1, 2])
+    prompt(cache, system + [3, 4])
+    cache.max_tree_tokens = 30
+    for start in range(1000, 3000, 20):
+        prompt(cache, list(range(start, start + 20)))
+    assert cache.get_stats()["prefixes"] == 1
+    assert cache[system + [5]] is not None
+    assert cache.get_stats()["tree_tokens"] == tree_tokens(cache.root)
@@ -0,0 +1,176 @@
+import time
+import asyncio
+from action_zone.action_sse.scheduler import DONE, DOWNLOADING, PAUSED, QUEUED, DownloadQueue, TokenBucket
+
+
+class Runs:
+    """run() of a DownloadQueue whose jobs end when the test says so"""
+
+    def __init__(self):
+        self.started = []
+        self.release = {}
+
+    async def __call__(self, job):
+        self.started.append(job.model_id)
+        self.release[job.model_id] = asyncio.Event()
+        await self.release[job.model_id].wait()
+
+    async def finish(self, model_id):
+        self.release[model_id].set()
+        await settle()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_priority_then_submission_order():
+    async def run():
+        runs = Runs()
+        queue = DownloadQueue(runs, max_active=1)
+        for model_id, priority in [("a", 0), ("b", 0), ("c", 5), ("d", 0), ("e", 5)]:
+            queue.submit(model_id, priority)
+        await settle()
+        assert [j.model_id for j in queue.waiting()] == ["c", "e", "b", "d"]
+        assert queue.position("e") == 2 and queue.position("a") == 0
+        for model_id in "acebd":
+            await runs.finish(model_id)
+        assert runs.started == ["a", "c", "e", "b", "d"]
+        assert not queue.jobs
+    asyncio.run(run())
+
+
+def test_priority_change_moves_a_job():
+    async def run():
+        runs = Runs()
+        queue = DownloadQueue(runs, max_active=1)
+        for model_id in "abc":
+            queue.submit(model_id)
+        await settle()
+        queue.set_priority("c", 1)
+        assert [j.model_id for j in queue.waiting()] == ["c", "b"]
+        await runs.finish("a")
+        assert runs.started == ["a", "c"]
+    asyncio.run(run())
+
+
+def test_pause_frees_the_slot_and_resume_queues_again():
+    async def run():
+        runs = Runs()
+        queue = DownloadQueue(runs, max_active=1)
+        for model_id in "abc":
+            queue.submit(model_id)
+        await settle()
+        assert queue.pause("a") == DOWNLOADING
+        # The caller stops the running download: its task ends, the slot goes to b
+        await runs.finish("a")
+        assert queue.get("a").state == PAUSED and runs.started == ["a", "b"]
+
+        assert queue.resume("a")
+        # Back ahead of c, queued after it first was
+        assert [j.model_id for j in queue.waiting()] == ["a", "c"]
+        await runs.finish("b")
+        assert runs.started == ["a", "b", "a"]
+    asyncio.run(run())
+
+
+def test_pause_and_remove_a_queued_job():
+    async def run():
+        runs = Runs()
+        queue = DownloadQueue(runs, max_active=1)
+        for model_id in "abc":
+            queue.submit(model_id)
+        await settle()
+        assert queue.pause("b") == QUEUED
+        assert queue.waiting()[0].model_id == "c"
+        assert queue.remove("a") is None  # running
+        assert queue.remove("b").state == PAUSED
+        assert not queue.resume("b") and queue.pause("b") is None
+        await runs.finish("a")
+        assert runs.started == ["a", "c"]
+    asyncio.run(run())
+
+
+def test_resumed_while_stopping_runs_again():
+    async def run():
+        runs = Runs()
+        queue = DownloadQueue(runs, max_active=1)
+        job = queue.submit("a")
+        await settle()
+        queue.pause("a")
+        queue.resume("a")
+        assert job.state == QUEUED and job.task is not None
+        await runs.finish("a")
+        assert runs.started == ["a", "a"] and job.state == DOWNLOADING
+        await runs.finish("a")
+        assert job.state == DONE and not queue.jobs
+    asyncio.run(run())
+
+
+def test_more_slots_start_queued_jobs():
+    async def run():
+        runs = Runs()
+        changes = []
+        queue = DownloadQueue(runs, max_active=1, on_change=lambda: changes.append(queue.count(DOWNLOADING)))
+        for model_id in "abc":
+            queue.submit(model_id)
+        await settle()
+        queue.set_max_active(3)
+        await settle()
+        assert sorted(runs.started) == ["a", "b", "c"] and changes[-1] == 3
+        # A lower limit lets running jobs finish but starts nothing new
+        queue.set_max_active(1)
+        queue.submit("d")
+        await runs.finish("a")
+        await runs.finish("b")
+        assert "d" not in runs.started
+        await runs.finish("c")
+        assert runs.started[-1] == "d"
+    asyncio.run(run())
+
+
+def test_token_bucket_unlimited_never_waits():
+    async def run():
+        bucket = TokenBucket(0)
+        start = time.monotonic()
+        for _ in range(1000):
+            await bucket.take(10**9)
+        return time.monotonic() - start
+    assert asyncio.run(run()) < 0.5
+
+
+def test_token_bucket_holds_the_rate():
+    async def run():
+        bucket = TokenBucket(1_000_000, burst_seconds=0.05)
+        start = time.monotonic()
+        for _ in range(30):
+            await bucket.take(10_000)
+        return time.monotonic() - start
+    # 300 kB at 1 MB/s, less what the burst allows
+    assert 0.2 <= asyncio.run(run()) < 1.0
+
+
+def test_token_bucket_shared_by_readers():
+    async def run():
+        bucket = TokenBucket(1_000_000, burst_seconds=0.05)
+
+        async def reader():
+            for _ in range(10):
+                await bucket.take(10_000)
+
+        start = time.monotonic()
+        await asyncio.gather(*(reader() for _ in range(3)))
+        return time.monotonic() - start
+    assert 0.2 <= asyncio.run(run()) < 1.0
+
+
+def test_token_bucket_rate_change_drops_debt():
+    async def run():
+        bucket = TokenBucket(1000)
+        bucket._tokens = -10**9
+        bucket.set_rate(0)
+        start = time.monotonic()
+        await bucket.take(10**6)
+        return time.monotonic() - start
+    assert asyncio.run(run()) < 0.1
@@ -0,0 +1,76 @@
+import pytest
+from action_zone.action_sse.segmented import RangeSet, Segment, SegmentedDownloader
+
+
+def test_rangeset_merges_overlapping_and_touching():
+    done = RangeSet()
+    for start, end in [(10, 20), (30, 40), (20, 25), (35, 50), (0, 5), (7, 7)]:
+        done.add(start, end)
+    assert done.ranges == [[0, 5], [10, 25], [30, 50]]
+    assert done.total() == 40
+
+
+def test_rangeset_out_of_order_adds_fill_the_file():
+    done = RangeSet()
+    for start in (60, 0, 80, 20, 40):
+        done.add(start, start + 20)
+    assert done.ranges == [[0, 100]]
+    assert done.missing(100) == []
+
+
+def test_rangeset_missing_and_end_from():
+    done = RangeSet([[10, 20], [30, 40]])
+    assert done.missing(50) == [(0, 10), (20, 30), (40, 50)]
+    assert done.end_from(15) == 20
+    assert done.end_from(20) == 20
+    assert done.end_from(0) == 0
+
+
+def test_rangeset_pieces():
+    done = RangeSet([[0, 10], [25, 31]])
+    assert done.pieces(10) == {0, 2, 3}
+
+
+def span(segment):
+    return segment.start, segment.end
+
+
+@pytest.fixture
+def downloader(tmp_path):
+    d = SegmentedDownloader(["http://127.0.0.1/model.gguf"], tmp_path / "model.tmp", connections=4,
+                            min_segment=100, max_segment=1000, segment_seconds=1.0)
+    d.size, d.ranged = 10000, True
+    return d
+
+
+def test_take_sizes_segments_by_speed_and_fair_share(downloader):
+    downloader._pending.append(Segment(0, 10000))
+    # Slow connection: the minimum segment
+    assert span(downloader._take(10)) == (0, 100)
+    # Fast one: capped by max_segment, then by a fair share of what is left
+    assert span(downloader._take(10**9)) == (100, 1100)
+    downloader._pending[0].end = 2100
+    assert span(downloader._take(10**9)) == (1100, 1350)
+
+
+def test_take_steals_half_of_the_largest_segment_in_flight(downloader):
+    small, large = Segment(0, 1000), Segment(1000, 5000)
+    small.received, large.received = 500, 2000
+    downloader._flight += [small, large]
+    stolen = downloader._take(10**6)
+    assert span(stolen) == (3500, 5000)
+    assert large.end == 3500 and small.end == 1000
+
+
+def test_take_leaves_short_tails_alone(downloader):
+    segment = Segment(0, 1000)
+    segment.received = 850
+    downloader._flight.append(segment)
+    assert downloader._take(10**6) is None
+    assert segment.end == 1000
+
+
+def test_retried_segments_keep_their_range(downloader):
+    downloader._pending.append(Segment(0, 10000, attempts=1))
+    segment = downloader._take(10)
+    assert span(segment) == (0, 10000)
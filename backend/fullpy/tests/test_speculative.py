@@ -0,0 +1,50 @@
+import struct
+import pytest
+from action_zone.action_ws.speculative import read_tokenizer_metadata, tokenizer_mismatch
+
+
+def _string(s):
+    data = s.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+
+def write_gguf(path, tokens=("<s>", "</s>", "a", "b"), model="llama", bos=1, eos=2):
+    kvs = [
+        _string("general.architecture") + struct.pack("<I", 8) + _string("llama"),
+        _string("llama.context_length") + struct.pack("<II", 4, 4096),
+        _string("tokenizer.ggml.model") + struct.pack("<I", 8) + _string(model),
+        _string("tokenizer.ggml.tokens") + struct.pack("<IIQ", 9, 8, len(tokens)) + b"".join(_string(t) for t in tokens),
+        _string("tokenizer.ggml.scores") + struct.pack("<IIQ", 9, 6, len(tokens)) + struct.pack(f"<{len(tokens)}f", *[0.0] * len(tokens)),
+        _string("tokenizer.ggml.bos_token_id") + struct.pack("<II", 4, bos),
+        _string("tokenizer.ggml.eos_token_id") + struct.pack("<II", 4, eos),
+    ]
+    path.write_bytes(b"GGUF" + struct.pack("<IQQ", 3, 0, len(kvs)) + b"".join(kvs))
+    return str(path)
+
+
+def test_reads_tokenizer_metadata(tmp_path):
+    meta = read_tokenizer_metadata(write_gguf(tmp_path / "m.gguf"))
+    assert meta["model"] == "llama"
+    assert meta["bos_token_id"] == 1 and meta["eos_token_id"] == 2
+    assert meta["tokens"][0] == 4
+
+
+def test_same_tokenizer_matches(tmp_path):
+    assert tokenizer_mismatch(write_gguf(tmp_path / "d.gguf"), write_gguf(tmp_path / "t.gguf")) is None
+
+
+@pytest.mark.parametrize("draft", [
+    {"tokens": ("<s>", "</s>", "a", "c")},
+    {"tokens": ("<s>", "</s>", "a")},
+    {"model": "gpt2"},
+    {"bos": 0},
+    {"eos": 3},
+])
+def test_different_tokenizer_mismatches(tmp_path, draft):
+    assert tokenizer_mismatch(write_gguf(tmp_path / "d.gguf", **draft), write_gguf(tmp_path / "t.gguf"))
+
+
+def test_rejects_non_gguf(tmp_path):
+    (tmp_path / "x.gguf").write_bytes(b"not a model")
+    with pytest.raises(ValueError):
+        read_tokenizer_metadata(str(tmp_path / "x.gguf"))
@@ -0,0 +1,88 @@
+import os
+import random
+import asyncio
+import pytest
+from action_zone.action_sse.writers import FileWriter, WriteBehindWriter
+
+SIZE = 1024 * 1024 + 777
+
+
+def segments(size, count, chunk, seed=0):
+    """Chunks of `count` segments, interleaved the way parallel connections deliver them"""
+    rng = random.Random(seed)
+    bounds = sorted(rng.sample(range(1, size), count - 1))
+    streams = [[(o, min(o + chunk, e)) for o in range(s, e, chunk)] for s, e in zip([0] + bounds, bounds + [size])]
+    while any(streams):
+        stream = rng.choice([s for s in streams if s])
+        yield stream.pop(0)
+
+
+async def download(writer, data, count, chunk):
+    await writer.open()
+    try:
+        for start, end in segments(len(data), count, chunk):
+            await writer.write(start, data[start:end])
+        await writer.sync()
+    finally:
+        await writer.close()
+
+
+@pytest.fixture
+def data():
+    return os.urandom(SIZE)
+
+
+@pytest.mark.parametrize("buffers, buffer_bytes", [
+    (2, 64 * 1024),       # pool far smaller than the file: waits and evictions
+    (8, 100 * 1000),      # buffer size unrelated to the chunk size
+    (20, 64 * 1024),      # whole file in RAM
+])
+def test_interleaved_writes_match(tmp_path, data, buffers, buffer_bytes):
+    path = tmp_path / "model.tmp"
+    writer = WriteBehindWriter(path, SIZE, buffers, buffer_bytes, flushers=2)
+    asyncio.run(download(writer, data, 6, 16 * 1024 + 3))
+    assert path.read_bytes() == data
+    assert writer.stats["flushes"] > 0
+    if buffers * buffer_bytes < SIZE:
+        assert writer.stats["waits"] > 0
+
+
+def test_ram_tier_when_the_pool_holds_the_file(tmp_path):
+    assert WriteBehindWriter(tmp_path / "a", SIZE, 20, 64 * 1024).tier == "ram"
+    assert WriteBehindWriter(tmp_path / "b", SIZE, 2, 64 * 1024).tier == "buffered"
+    assert FileWriter(tmp_path / "c", SIZE).tier == "direct"
+
+
+def test_direct_writer_matches(tmp_path, data):
+    path = tmp_path / "model.tmp"
+    asyncio.run(download(FileWriter(path, SIZE), data, 4, 10000))
+    assert path.read_bytes() == data
+
+
+def test_read_sees_bytes_still_in_memory(tmp_path, data):
+    async def run():
+        writer = WriteBehindWriter(tmp_path / "model.tmp", SIZE, 4, 256 * 1024)
+        await writer.open()
+        try:
+            await writer.write(0, data[:1000])
+            await writer.write(5000, data[5000:9000])
+            assert bytes(await writer.read(0, 1000)) == data[:1000]
+            assert bytes(await writer.read(5500, 1000)) == data[5500:6500]
+        finally:
+            await writer.close()
+    asyncio.run(run())
+
+
+def test_flush_error_surfaces_on_sync(tmp_path, data):
+    async def run():
+        writer = WriteBehindWriter(tmp_path / "model.tmp", SIZE, 2, 4096)
+        await writer.open()
+        os.close(writer.fd)
+        try:
+            with pytest.raises(OSError):
+                await writer.write(0, data[:4096])
+                await writer.sync()
+        finally:
+            writer.fd = -1
+            await writer.close()
+    asyncio.run(run())
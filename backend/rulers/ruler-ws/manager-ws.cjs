@@ -70,6 +70,8 @@ const { BrowserWindow } = require('electron');
 let wsClient = null;
 let isConnecting = false;
 let reconnectTimeout = null;
+// SESSION GIVEN BY THE SERVER, SENT BACK ON RECONNECT TO KEEP THE CONVERSATION
+let sessionId = null;
 
 // BROADCAST MESSAGE TO ALL WINDOWS
 function broadcast(channel, data) {
@@ -93,7 +95,8 @@ function connectToPythonServer() {
   isConnecting = true;
   console.log('Connecting to Python WebSocket server...');
 
-  wsClient = new WebSocket('ws://localhost:8765');
+  const query = sessionId ? `?sessionId=${encodeURIComponent(sessionId)}` : '';
+  wsClient = new WebSocket(`ws://localhost:8765/${query}`);
 
   // HANDLE CONNECTION OPENED
   wsClient.on('open', () => {
@@ -113,10 +116,13 @@ function connectToPythonServer() {
       const data = JSON.parse(message.toString());
       console.log(`${COLORS.BLUE}Received WS message:${COLORS.RESET}`, data.type || 'unknown');
 
-      const { promptId, token, complete, error, type, status, sessionId } = data;
+      const { promptId, token, complete, error, type, status, sessionId: messageSessionId } = data;
 
-      // PROCESS TOKEN MESSAGE
-      if (type === 'token' && token) {
+      // REMEMBER THE SESSION (A RESUMED ONE KEEPS ITS ID)
+      if (type === 'ready' && messageSessionId) {
+        sessionId = messageSessionId;
+        // PROCESS TOKEN MESSAGE
+      } else if (type === 'token' && token) {
         broadcast('model:new-token', { promptId, token });
         // PROCESS COMPLETION MESSAGE
       } else if (type === 'complete' && complete) {
@@ -127,11 +133,14 @@ function connectToPythonServer() {
         // PROCESS STATUS MESSAGE
       } else if (type === 'status') {
         if (status === 'started') {
-          broadcast('model:started', { promptId, sessionId });
+          broadcast('model:started', { promptId, sessionId: messageSessionId });
         } else if (status === 'canceled') {
           broadcast('model:canceled', promptId);
         } else if (status === 'memory_cleared') {
-          broadcast('model:memory-cleared', sessionId);
+          broadcast('model:memory-cleared', messageSessionId);
+        } else if (status === 'loading') {
+          // SERVER IS UP, MODEL STILL LOADING: READY FOLLOWS ON THIS SAME CONNECTION
+          broadcast('model:loading', { phase: data.phase, progress: data.progress });
         }
       }
 